@@ -0,0 +1,100 @@
+import os
+import json
+import hashlib
+import threading
+
+
+def get_cache_dir(*parts):
+    """获取程序缓存目录（Windows 使用 LOCALAPPDATA，其他系统使用 XDG_CACHE_HOME 或 ~/.cache）"""
+    base = os.environ.get("LOCALAPPDATA") or os.environ.get("XDG_CACHE_HOME")
+    if not base:
+        base = os.path.join(os.path.expanduser("~"), ".cache")
+    cache_dir = os.path.join(base, "cv3", *parts)
+    os.makedirs(cache_dir, exist_ok=True)
+    return cache_dir
+
+
+def file_fingerprint(path):
+    """文件指纹：绝对路径 + 大小 + 修改时间，用于判断缓存是否失效"""
+    stat = os.stat(path)
+    return {
+        "path": os.path.abspath(path),
+        "size": stat.st_size,
+        "mtime_ns": stat.st_mtime_ns
+    }
+
+
+def quick_file_hash(path, sample_size=1024 * 1024):
+    """文件内容的快速摘要：大小 + 开头和结尾各 sample_size 字节，文件移动或改名后仍然一致"""
+    size = os.path.getsize(path)
+    digest = hashlib.sha1(str(size).encode())
+    with open(path, 'rb') as f:
+        digest.update(f.read(sample_size))
+        if size > sample_size * 2:
+            f.seek(-sample_size, os.SEEK_END)
+        digest.update(f.read(sample_size))
+    return digest.hexdigest()
+
+
+def file_hash(path, chunk_size=1024 * 1024):
+    """完整文件内容的 sha1，内容相同的文件无论路径和名称都得到相同结果"""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class JsonCache:
+    """线程安全的 JSON 文件缓存，写入时先写临时文件再原子替换"""
+
+    def __init__(self, cache_path):
+        self.cache_path = cache_path
+        self._lock = threading.Lock()
+        self._data = None
+        self._dirty = False
+
+    def _load(self):
+        if self._data is not None:
+            return
+        try:
+            with open(self.cache_path, 'r', encoding='utf-8') as f:
+                self._data = json.load(f)
+        except (OSError, ValueError):
+            self._data = {}
+
+    def get(self, key, default=None):
+        with self._lock:
+            self._load()
+            return self._data.get(key, default)
+
+    def set(self, key, value):
+        with self._lock:
+            self._load()
+            self._data[key] = value
+            self._dirty = True
+
+    def pop(self, key, default=None):
+        with self._lock:
+            self._load()
+            if key in self._data:
+                self._dirty = True
+            return self._data.pop(key, default)
+
+    def items(self):
+        with self._lock:
+            self._load()
+            return list(self._data.items())
+
+    def save(self):
+        with self._lock:
+            if not self._dirty:
+                return
+            cache_dir = os.path.dirname(self.cache_path)
+            if cache_dir:
+                os.makedirs(cache_dir, exist_ok=True)
+            tmp_path = f"{self.cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(self._data, f, ensure_ascii=False)
+            os.replace(tmp_path, self.cache_path)
+            self._dirty = False
@@ -0,0 +1,784 @@
+import os
+import sys
+import glob
+import time
+import io
+import json
+import zlib
+import struct
+import shutil
+import hashlib
+import argparse
+import itertools
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from PIL import Image, ImageChops, ImageSequence, UnidentifiedImageError
+
+from app_cache import JsonCache, get_cache_dir, file_fingerprint, file_hash
+
+IMAGE_EXTS = ('.jpg', '.jpeg', '.png', '.webp', '.bmp', '.gif', '.tif', '.tiff')
+# 每个工作进程最多排队的任务数，文件再多也不会一次性全部提交
+QUEUE_PER_WORKER = 4
+MAX_WORKERS = 8
+
+# 输出格式：Pillow 格式名、扩展名、是否无损。新增格式时在这里和 SPEED_OPTIONS 中各加一项
+TARGET_FORMATS = {
+    "png": {"format": "PNG", "ext": ".png", "lossless": True},
+    "webp-lossless": {"format": "WEBP", "ext": ".webp", "lossless": True},
+    "webp": {"format": "WEBP", "ext": ".webp", "lossless": False},
+    "jpg": {"format": "JPEG", "ext": ".jpg", "lossless": False}
+}
+DEFAULT_TARGET = "png"
+TARGET_NAMES = {"png": "PNG", "webp-lossless": "WebP无损", "webp": "WebP", "jpg": "JPG"}
+SPEED_PROFILES = ("fast", "balanced", "smallest")
+DEFAULT_SPEED = "balanced"
+SPEED_NAMES = {"fast": "最快", "balanced": "均衡", "smallest": "最小文件"}
+# 各输出格式在每个速度预设下的编码参数，速度预设只影响编码耗时和文件大小，不影响画质：
+# PNG：fast 压缩最快文件较大；balanced 用时约为 Pillow 默认（6级）的一半，文件只大一成左右；
+#   smallest 用 9 级加 optimize，颜色不超过256种时再转为调色板图。palette 不是 Pillow 的保存参数，由 save_image 处理
+# WebP 无损：quality 表示压缩力度，method 越大越慢；exact 保留完全透明像素的颜色值，与原图逐像素一致；
+#   照片类内容约为同预设PNG的一半大小
+# WebP 有损 / JPEG：画质由 quality 决定，见 DEFAULT_QUALITY
+SPEED_OPTIONS = {
+    "png": {
+        "fast": {"compress_level": 1},
+        "balanced": {"compress_level": 4},
+        "smallest": {"optimize": True, "palette": True}
+    },
+    "webp-lossless": {
+        "fast": {"lossless": True, "exact": True, "quality": 25, "method": 1},
+        "balanced": {"lossless": True, "exact": True, "quality": 50, "method": 3},
+        "smallest": {"lossless": True, "exact": True, "quality": 100, "method": 6}
+    },
+    "webp": {
+        "fast": {"method": 2},
+        "balanced": {"method": 4},
+        "smallest": {"method": 6}
+    },
+    "jpg": {
+        "fast": {},
+        "balanced": {"optimize": True},
+        "smallest": {"optimize": True, "progressive": True}
+    }
+}
+# 有损格式默认画质
+DEFAULT_QUALITY = {"webp": 80, "jpg": 90}
+# 缩略图文件名后缀
+THUMBNAIL_SUFFIX = "_thumb"
+# 动图（GIF、动态WebP等）的输出方式：保留动画 / 每帧输出一张图片 / 只取第一帧
+ANIMATION_MODES = ("animate", "frames", "first")
+DEFAULT_ANIMATION = "animate"
+ANIMATION_NAMES = {"animate": "保留动画", "frames": "逐帧输出", "first": "只取第一帧"}
+# 支持动画的输出格式：PNG 输出为 APNG，WebP 输出为动态WebP；其他格式的动图改为逐帧输出
+ANIMATED_FORMATS = ("PNG", "WEBP")
+# 逐帧输出时帧图片所在文件夹的后缀，帧文件名为 0001.png、0002.png……
+FRAMES_SUFFIX = "_frames"
+# 源文件没有记录帧时长时使用的时长（毫秒）
+DEFAULT_FRAME_DURATION = 100
+# 转换逻辑有变化（结果会不同）时加一，旧的缓存记录不再使用
+CONVERT_VERSION = 3
+# 计算源文件摘要的线程数
+HASH_WORKERS = 8
+
+
+def is_image_file(path, image_exts=IMAGE_EXTS):
+    return os.path.isfile(path) and os.path.splitext(path)[1].lower() in image_exts
+
+
+def find_image_files(inputs, recursive=False, image_exts=IMAGE_EXTS):
+    """把输入的文件、文件夹或通配符展开为 [(图片路径, 所属输入文件夹)]，单个文件的所属文件夹为 None。
+
+    所属文件夹用于在输出目录中还原子文件夹结构；结果为绝对路径，去重并保持顺序。
+    """
+    image_files = []
+    seen = set()
+
+    def add(path, base_dir=None):
+        path = os.path.abspath(path)
+        if path not in seen and is_image_file(path, image_exts):
+            seen.add(path)
+            image_files.append((path, base_dir))
+
+    for item in inputs:
+        if os.path.isdir(item):
+            base_dir = os.path.abspath(item)
+            if recursive:
+                for dirpath, dirnames, filenames in os.walk(item):
+                    dirnames.sort()
+                    for file in sorted(filenames):
+                        add(os.path.join(dirpath, file), base_dir)
+            else:
+                for file in sorted(os.listdir(item)):
+                    add(os.path.join(item, file), base_dir)
+        elif os.path.isfile(item):
+            add(item)
+        else:
+            for path in sorted(glob.glob(item, recursive=True)):
+                add(path)
+    return image_files
+
+
+def build_output_path(source, output_dir=None, base_dir=None, ext=".png", suffix=""):
+    """输出路径：未指定 output_dir 时放在源文件旁边；指定时按源文件相对 base_dir 的位置还原子文件夹"""
+    name = os.path.splitext(os.path.basename(source))[0] + suffix + ext
+    if output_dir is None:
+        return os.path.join(os.path.dirname(source), name)
+    if base_dir:
+        relative_dir = os.path.relpath(os.path.dirname(source), base_dir)
+        if relative_dir != os.curdir:
+            return os.path.join(output_dir, relative_dir, name)
+    return os.path.join(output_dir, name)
+
+
+def encoder_options(target=DEFAULT_TARGET, speed=DEFAULT_SPEED, quality=None):
+    """输出格式 + 速度预设 + 画质（只对有损格式有效，默认见 DEFAULT_QUALITY）对应的保存参数"""
+    if target not in TARGET_FORMATS:
+        raise ValueError(f"不支持的输出格式: {target}")
+    if speed not in SPEED_PROFILES:
+        raise ValueError(f"不支持的编码预设: {speed}")
+    options = dict(SPEED_OPTIONS[target][speed])
+    if not TARGET_FORMATS[target]["lossless"]:
+        quality = DEFAULT_QUALITY[target] if quality is None else quality
+        if not 1 <= quality <= 100:
+            raise ValueError("画质必须在1到100之间")
+        options["quality"] = quality
+    return options
+
+
+def thumbnail_path(output):
+    """缩略图与输出文件放在一起，文件名加 THUMBNAIL_SUFFIX"""
+    stem, ext = os.path.splitext(output)
+    return stem + THUMBNAIL_SUFFIX + ext
+
+
+def to_lossless_palette(img):
+    """颜色不超过256种的 RGB/RGBA（完全不透明）图片转为调色板图，像素值不变；否则原样返回"""
+    if img.mode == "RGBA":
+        if img.getchannel("A").getextrema() != (255, 255):
+            return img
+        img = img.convert("RGB")
+    if img.mode != "RGB":
+        return img
+    colors = img.getcolors(256)
+    if colors is None:
+        return img
+    import numpy as np
+    # quantize 按近似颜色查找调色板，相近的颜色会被合并，这里按 RGB 值精确查出每个像素的索引
+    palette = np.array([color for _, color in colors], dtype=np.uint8)
+    lookup = np.zeros(1 << 24, dtype=np.uint8)
+    lookup[(palette[:, 0].astype(np.uint32) << 16) | (palette[:, 1].astype(np.uint32) << 8) | palette[:, 2]] = \
+        np.arange(len(palette), dtype=np.uint8)
+    pixels = np.asarray(img).astype(np.uint32)
+    indices = lookup[(pixels[..., 0] << 16) | (pixels[..., 1] << 8) | pixels[..., 2]]
+    palette_img = Image.frombytes("P", img.size, indices.tobytes())
+    palette_img.putpalette(palette.tobytes())
+    palette_img.info.update(img.info)
+    return palette_img
+
+
+def prepare_for_format(img, format):
+    """转为输出格式支持的颜色模式：JPEG 不支持透明，透明部分铺白底"""
+    if format == "JPEG" and img.mode not in ("RGB", "L", "CMYK"):
+        if img.mode == "P":
+            img = img.convert("RGBA")
+        if img.mode in ("RGBA", "LA"):
+            background = Image.new("RGB", img.size, (255, 255, 255))
+            background.paste(img.convert("RGBA"), mask=img.getchannel("A"))
+            return background
+        return img.convert("RGB")
+    return img
+
+
+def save_image(img, output, format, options):
+    """按编码参数保存，先处理 save 不支持的选项和颜色模式，保留原图的ICC色彩配置"""
+    options = dict(options)
+    if options.pop("palette", False):
+        img = to_lossless_palette(img)
+    img = prepare_for_format(img, format)
+    if "icc_profile" in img.info:
+        options.setdefault("icc_profile", img.info["icc_profile"])
+    img.save(output, format, **options)
+
+
+def save_thumbnail(img, output, format, options, size):
+    """从已解码的图片生成最长边不超过 size 的缩略图，与主输出使用相同的格式和参数"""
+    thumb = img.copy()
+    thumb.thumbnail((size, size), Image.LANCZOS)
+    path = thumbnail_path(output)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        save_image(thumb, tmp_path, format, options)
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return path
+
+
+def ensure_thumbnail(output, format, options, size):
+    """已有输出文件时补齐缩略图：缩略图不存在或尺寸不对时从输出文件重新生成"""
+    path = thumbnail_path(output)
+    with Image.open(output) as img:
+        expected = min(size, max(img.size))
+        if os.path.exists(path):
+            try:
+                with Image.open(path) as thumb:
+                    if max(thumb.size) == expected:
+                        return path
+            except (UnidentifiedImageError, OSError):
+                pass
+        return save_thumbnail(img, output, format, options, size)
+
+
+def is_animated(img):
+    return getattr(img, "is_animated", False)
+
+
+def frames_dir(output):
+    """逐帧输出的文件夹：输出文件名去掉扩展名，加 FRAMES_SUFFIX"""
+    return os.path.splitext(output)[0] + FRAMES_SUFFIX
+
+
+def output_size(path):
+    """输出文件的字节数；逐帧输出时为文件夹中所有帧的总和"""
+    if os.path.isdir(path):
+        return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+    return os.path.getsize(path)
+
+
+def frame_duration(frame):
+    """当前帧的时长（毫秒），需要在帧加载后读取"""
+    return frame.info.get("duration") or DEFAULT_FRAME_DURATION
+
+
+def write_png_chunk(fp, chunk_type, data):
+    fp.write(struct.pack(">I", len(data)) + chunk_type + data)
+    fp.write(struct.pack(">I", zlib.crc32(chunk_type + data)))
+
+
+def read_png_chunks(data):
+    """依次返回 PNG 数据中的 (块类型, 块内容)"""
+    pos = 8  # 跳过文件签名
+    while pos < len(data):
+        length, chunk_type = struct.unpack(">I4s", data[pos:pos + 8])
+        yield chunk_type, data[pos + 8:pos + 8 + length]
+        pos += length + 12
+
+
+class ApngWriter:
+    """逐帧写入 APNG：每帧用 Pillow 编码为普通 PNG，再把其中的图像数据改写为 APNG 帧。
+
+    只保留上一帧（用于找出变化区域）和一帧编码后待写入的数据，内存占用与帧数无关；
+    每帧只编码与上一帧不同的区域，与上一帧完全相同的帧不写入，时长并入上一帧。
+    总帧数在 finish 时回填到 acTL 块，因此 fp 必须可以 seek。
+    """
+
+    def __init__(self, fp, mode, options, loop=0, icc_profile=None):
+        self.fp = fp
+        self.mode = mode
+        # palette 会改变颜色模式，所有帧必须与第一帧的模式相同
+        self.options = {key: value for key, value in options.items() if key != "palette"}
+        self.loop = loop
+        self.icc_profile = icc_profile
+        self.previous = None
+        self.pending = None
+        self.frames = 0
+        self.sequence = 0
+        self.actl_pos = None
+
+    def encode(self, img, **extra):
+        buffer = io.BytesIO()
+        img.save(buffer, "PNG", **self.options, **extra)
+        return read_png_chunks(buffer.getvalue())
+
+    def write_header(self, frame):
+        """文件头取自第一帧的编码结果：IHDR 和图像数据之前的辅助块（色彩配置等）"""
+        self.fp.write(b"\x89PNG\r\n\x1a\n")
+        extra = {"icc_profile": self.icc_profile} if self.icc_profile else {}
+        data = []
+        for chunk_type, chunk in self.encode(frame, **extra):
+            if chunk_type == b"IHDR":
+                write_png_chunk(self.fp, chunk_type, chunk)
+                self.actl_pos = self.fp.tell()
+                self.write_actl()
+            elif chunk_type == b"IDAT":
+                data.append(chunk)
+            elif chunk_type != b"IEND" and not data:
+                write_png_chunk(self.fp, chunk_type, chunk)
+        return b"".join(data)
+
+    def write_actl(self):
+        write_png_chunk(self.fp, b"acTL", struct.pack(">II", self.frames, self.loop))
+
+    def add(self, frame, duration):
+        frame = frame.convert(self.mode)
+        if self.previous is None:
+            data = self.write_header(frame)
+            box = (0, 0) + frame.size
+        else:
+            box = ImageChops.difference(self.previous, frame).getbbox(alpha_only=False)
+            if box is None:
+                self.pending["duration"] += duration
+                return
+            data = b"".join(chunk for chunk_type, chunk in self.encode(frame.crop(box)) if chunk_type == b"IDAT")
+        self.flush()
+        self.pending = {"box": box, "data": data, "duration": duration}
+        self.previous = frame
+
+    def flush(self):
+        if self.pending is None:
+            return
+        left, top, right, bottom = self.pending["box"]
+        delay = min(round(self.pending["duration"]), 0xFFFF)
+        # 帧尺寸、位置、时长（毫秒）；不清除上一帧，变化区域直接覆盖
+        write_png_chunk(self.fp, b"fcTL", struct.pack(">IIIIIHHBB", self.sequence, right - left, bottom - top,
+                                                      left, top, delay, 1000, 0, 0))
+        self.sequence += 1
+        if self.frames == 0:
+            write_png_chunk(self.fp, b"IDAT", self.pending["data"])
+        else:
+            write_png_chunk(self.fp, b"fdAT", struct.pack(">I", self.sequence) + self.pending["data"])
+            self.sequence += 1
+        self.frames += 1
+        self.pending = None
+
+    def finish(self):
+        self.flush()
+        write_png_chunk(self.fp, b"IEND", b"")
+        end = self.fp.tell()
+        self.fp.seek(self.actl_pos)
+        self.write_actl()
+        self.fp.seek(end)
+
+
+def save_animation(img, output, format, options):
+    """保存动图的所有帧：PNG 输出为 APNG，WebP 输出为动态WebP。用 ImageSequence 逐帧读取，
+    同一时间只解码一两帧，帧数再多内存占用也不变"""
+    loop = img.info.get("loop", 0)
+    if format == "WEBP":
+        # WebP 编码器逐帧读取源图片，但每帧的时长需要事先给出，先逐帧读一遍时长（每次只解码一帧）
+        durations = []
+        for frame in ImageSequence.Iterator(img):
+            frame.load()
+            durations.append(frame_duration(frame))
+        img.seek(0)
+        save_image(img, output, format, dict(options, save_all=True, duration=durations, loop=loop))
+        return
+    has_alpha = img.mode in ("RGBA", "LA", "PA") or "transparency" in img.info
+    with open(output, "wb") as fp:
+        writer = ApngWriter(fp, "RGBA" if has_alpha else "RGB", options, loop, img.info.get("icc_profile"))
+        for frame in ImageSequence.Iterator(img):
+            frame.load()
+            writer.add(frame, frame_duration(frame))
+        writer.finish()
+    img.seek(0)
+
+
+def save_frames(img, output, format, options):
+    """把动图的每一帧保存为单独的图片，放在 frames_dir(output) 文件夹中，返回文件夹路径。
+
+    先写入临时文件夹再替换，中途失败不会留下不完整的帧序列。
+    """
+    path = frames_dir(output)
+    ext = os.path.splitext(output)[1]
+    tmp_dir = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(tmp_dir, exist_ok=True)
+        for index, frame in enumerate(ImageSequence.Iterator(img), 1):
+            save_image(frame, os.path.join(tmp_dir, f"{index:04d}{ext}"), format, options)
+        if os.path.isdir(path):
+            shutil.rmtree(path)
+        os.replace(tmp_dir, path)
+    finally:
+        if os.path.isdir(tmp_dir):
+            shutil.rmtree(tmp_dir)
+    img.seek(0)
+    return path
+
+
+def benchmark_profiles(paths, target=DEFAULT_TARGET, quality=None):
+    """对样本图片分别用输出格式的各速度预设编码到内存（解码不计时，无法解码的跳过），
+    返回 [(预设名, 耗时秒, 输出字节数)]"""
+    totals = {speed: [0.0, 0] for speed in SPEED_PROFILES}
+    format = TARGET_FORMATS[target]["format"]
+    for path in paths:
+        try:
+            img = Image.open(path)
+            img.load()
+        except (UnidentifiedImageError, OSError):
+            continue  # 无法解码的样本跳过
+        with img:
+            for speed, total in totals.items():
+                options = encoder_options(target, speed, quality)
+                buffer = io.BytesIO()
+                start = time.perf_counter()
+                save_image(img, buffer, format, options)
+                total[0] += time.perf_counter() - start
+                total[1] += buffer.tell()
+    return [(speed, seconds, size) for speed, (seconds, size) in totals.items()]
+
+
+def make_task(source, output, format="PNG", options=None, reuse_output=False, thumbnail=None,
+              animation=DEFAULT_ANIMATION):
+    """一个转换任务。只包含可以跨进程传递的基本类型。
+
+    format 为 Pillow 格式名（TARGET_FORMATS 中的 "format"），options 一般由 encoder_options 生成。
+    reuse_output 为 True 时，缓存中已有相同转换结果就直接返回那个文件，不在 output 生成新文件
+    （适合每次都用新文件名的输出方式）；否则把已有结果复制到 output。
+    thumbnail 为缩略图最长边（像素），指定时额外输出一张缩略图，见 thumbnail_path。
+    animation 为动图的输出方式（ANIMATION_MODES），对静态图片没有影响；逐帧输出时结果为一个文件夹。
+    """
+    if animation not in ANIMATION_MODES:
+        raise ValueError(f"不支持的动图输出方式: {animation}")
+    return {"source": source, "output": output, "format": format, "options": dict(options or {}),
+            "reuse_output": reuse_output, "thumbnail": thumbnail, "animation": animation}
+
+
+def dedupe_outputs(tasks):
+    """不同源文件对应同一个输出路径时（如 anim.gif 和 anim.webp 都输出为 anim.png），
+    这些任务的输出文件名保留源文件的扩展名（anim.gif.png、anim.webp.png），仍然重复时再加序号，
+    避免互相覆盖。返回新的任务列表，没有冲突的任务原样保留"""
+    def normalize(path):
+        return os.path.normcase(os.path.abspath(path))
+
+    tasks = list(tasks)
+    groups = {}
+    for index, task in enumerate(tasks):
+        groups.setdefault(normalize(task["output"]), []).append(index)
+    used = set(groups)
+    for indexes in groups.values():
+        if len({normalize(tasks[index]["source"]) for index in indexes}) < 2:
+            continue
+        for index in indexes:
+            task = tasks[index]
+            stem, ext = os.path.splitext(task["output"])
+            stem += os.path.splitext(task["source"])[1]
+            output = stem + ext
+            number = 2
+            while normalize(output) in used:
+                output = f"{stem}_{number}{ext}"
+                number += 1
+            used.add(normalize(output))
+            tasks[index] = dict(task, output=output)
+    return tasks
+
+
+def conversion_key(content_hash, format, options, animation=DEFAULT_ANIMATION):
+    """转换缓存键：源文件内容摘要 + 输出格式、编码参数和动图输出方式，同一内容改名或移动后仍能命中"""
+    key_data = json.dumps({
+        "content": content_hash,
+        "format": format,
+        "options": options,
+        "animation": animation,
+        "version": CONVERT_VERSION
+    }, sort_keys=True)
+    return hashlib.sha1(key_data.encode('utf-8')).hexdigest()
+
+
+class ConversionCache:
+    """记录每个转换缓存键已经生成过的输出文件（路径 + 大小 + 修改时间）。
+
+    输出文件被删除或修改过的记录自动失效，内容相同的源文件只需要转换一次。
+    """
+
+    def __init__(self, cache_path=None):
+        if cache_path is None:
+            cache_path = os.path.join(get_cache_dir(), "convert_outputs.json")
+        self.cache = JsonCache(cache_path)
+
+    def lookup(self, key):
+        """返回该缓存键仍然有效的输出文件路径列表，顺便删除失效的记录"""
+        records = self.cache.get(key, [])
+        valid = []
+        for record in records:
+            try:
+                fingerprint = file_fingerprint(record["path"])
+            except OSError:
+                continue
+            if fingerprint == record:
+                valid.append(record)
+        if len(valid) != len(records):
+            if valid:
+                self.cache.set(key, valid)
+            else:
+                self.cache.pop(key)
+        return [record["path"] for record in valid]
+
+    def record(self, key, output):
+        output = os.path.abspath(output)
+        records = [record for record in self.cache.get(key, []) if record["path"] != output]
+        records.append(file_fingerprint(output))
+        self.cache.set(key, records)
+
+    def save(self):
+        self.cache.save()
+
+
+def convert_file(task):
+    """转换一个文件，在工作进程中运行。
+
+    先写入临时文件再替换，中途失败不会留下不完整的输出；异常转为结果中的 error，便于传回主进程。
+    """
+    start = time.perf_counter()
+    output = task["output"]
+    result = {"source": task["source"], "output": output, "ok": False, "error": None, "bytes": 0, "cached": False}
+    if "key" in task:
+        result["key"] = task["key"]
+    tmp_path = f"{output}.{os.getpid()}.tmp"
+    try:
+        output_dir = os.path.dirname(output)
+        if output_dir:
+            os.makedirs(output_dir, exist_ok=True)
+        with Image.open(task["source"]) as img:
+            animation = task["animation"] if is_animated(img) else "first"
+            if animation == "animate" and task["format"] not in ANIMATED_FORMATS:
+                animation = "frames"
+            if animation == "frames":
+                result["output"] = save_frames(img, output, task["format"], task["options"])
+            else:
+                if animation == "animate":
+                    save_animation(img, tmp_path, task["format"], task["options"])
+                else:
+                    save_image(img, tmp_path, task["format"], task["options"])
+                os.replace(tmp_path, output)
+            if task["thumbnail"]:
+                # 复用已解码的图片（动图为第一帧），不需要再读一次源文件
+                result["thumbnail"] = save_thumbnail(img, output, task["format"], task["options"], task["thumbnail"])
+        result["ok"] = True
+        result["bytes"] = output_size(result["output"])
+    except UnidentifiedImageError:
+        result["error"] = "无法识别的图片文件"
+    except Exception as e:
+        result["error"] = str(e)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    result["elapsed"] = time.perf_counter() - start
+    return result
+
+
+class ImageConvertEngine:
+    """批量图片转换：Pillow 解码和编码在进程池中进行，可以用满所有CPU核心，
+    结果按完成顺序逐个返回，界面可以边转换边显示"""
+
+    def __init__(self, workers=None, cache=None):
+        self.workers = workers or max(1, min(MAX_WORKERS, os.cpu_count() or 1))
+        # 传入 ConversionCache 时跳过已经转换过的内容
+        self.cache = cache
+
+    def iter_results(self, tasks):
+        """逐个返回转换结果（完成顺序）。同时提交的任务不超过 workers × QUEUE_PER_WORKER 个，
+        成千上万个文件时内存占用也很小；只有一个任务或只用一个进程时直接在当前进程转换"""
+        tasks = iter(tasks)
+        head = list(itertools.islice(tasks, 2))
+        if self.workers == 1 or len(head) < 2:
+            for task in itertools.chain(head, tasks):
+                yield convert_file(task)
+            return
+
+        tasks = itertools.chain(head, tasks)
+        limit = self.workers * QUEUE_PER_WORKER
+        pending = set()
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            try:
+                while True:
+                    for task in itertools.islice(tasks, limit - len(pending)):
+                        pending.add(executor.submit(convert_file, task))
+                    if not pending:
+                        break
+                    done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield future.result()
+            finally:
+                for future in pending:
+                    future.cancel()
+
+    def task_keys(self, tasks):
+        """并行计算所有任务的转换缓存键，源文件无法读取的为 None（转换时再报错）"""
+        def key_of(task):
+            try:
+                return conversion_key(file_hash(task["source"]), task["format"], task["options"], task["animation"])
+            except OSError:
+                return None
+
+        with ThreadPoolExecutor(max_workers=HASH_WORKERS) as executor:
+            return list(executor.map(key_of, tasks))
+
+    def reuse_result(self, task, key, existing):
+        """用已有的转换结果完成任务：输出已是最新时直接返回，否则复用或复制已有文件"""
+        start = time.perf_counter()
+        output = os.path.abspath(task["output"])
+        result = {"source": task["source"], "output": output, "ok": True, "error": None, "cached": True}
+        if output not in existing:
+            if task["reuse_output"]:
+                result["output"] = existing[0]
+            else:
+                tmp_path = f"{output}.{os.getpid()}.tmp"
+                try:
+                    os.makedirs(os.path.dirname(output), exist_ok=True)
+                    shutil.copyfile(existing[0], tmp_path)
+                    os.replace(tmp_path, output)
+                    self.cache.record(key, output)
+                except OSError as e:
+                    result.update(ok=False, error=str(e))
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
+        if result["ok"] and task["thumbnail"]:
+            try:
+                result["thumbnail"] = ensure_thumbnail(result["output"], task["format"], task["options"],
+                                                       task["thumbnail"])
+            except (UnidentifiedImageError, OSError) as e:
+                result.update(ok=False, error=f"生成缩略图失败: {e}")
+        result["bytes"] = os.path.getsize(result["output"]) if result["ok"] else 0
+        result["elapsed"] = time.perf_counter() - start
+        return result
+
+    def iter_cached_results(self, tasks):
+        """先查缓存：命中的直接返回；同一批中内容和参数相同的任务只转换第一个，其余复用它的结果"""
+        tasks = list(tasks)
+        to_convert = []
+        duplicates = {}
+        for task, key in zip(tasks, self.task_keys(tasks)):
+            if key is None:
+                to_convert.append(task)
+                continue
+            if key in duplicates:
+                duplicates[key].append(task)
+                continue
+            existing = self.cache.lookup(key)
+            if existing:
+                yield self.reuse_result(task, key, existing)
+                continue
+            duplicates[key] = []
+            to_convert.append(dict(task, key=key))
+
+        for result in self.iter_results(to_convert):
+            key = result.pop("key", None)
+            yield result
+            if key is None:
+                continue
+            if result["ok"] and os.path.isfile(result["output"]):
+                self.cache.record(key, result["output"])
+                existing = [os.path.abspath(result["output"])]
+                for task in duplicates[key]:
+                    yield self.reuse_result(task, key, existing)
+            else:
+                # 转换失败时重复的任务也会失败，逐个转换以得到各自的错误信息；
+                # 动图逐帧输出的结果是文件夹，不记入缓存，也逐个转换
+                for task in duplicates[key]:
+                    yield convert_file(task)
+
+    def run(self, tasks, on_result=None):
+        """转换全部任务（输出路径重复的先按 dedupe_outputs 改名），每完成一个调用 on_result(结果)，
+        返回汇总 {"total", "ok", "cached", "failed", "bytes", "elapsed"}"""
+        start = time.perf_counter()
+        summary = {"total": 0, "ok": 0, "cached": 0, "failed": 0, "bytes": 0}
+        tasks = dedupe_outputs(tasks)
+        results = self.iter_cached_results(tasks) if self.cache else self.iter_results(tasks)
+        try:
+            for result in results:
+                summary["total"] += 1
+                if result["ok"]:
+                    summary["ok"] += 1
+                    summary["bytes"] += result["bytes"]
+                    if result["cached"]:
+                        summary["cached"] += 1
+                else:
+                    summary["failed"] += 1
+                if on_result:
+                    on_result(result)
+        finally:
+            if self.cache:
+                self.cache.save()
+        summary["elapsed"] = time.perf_counter() - start
+        return summary
+
+
+def describe_result(result):
+    """单个结果转为一行日志"""
+    if result["ok"] and result["cached"]:
+        return f"已有转换结果: {os.path.basename(result['source'])} -> {result['output']}"
+    if result["ok"]:
+        return f"成功: {os.path.basename(result['source'])} -> {result['output']}"
+    return f"失败: {os.path.basename(result['source'])} - {result['error']}"
+
+
+def describe_summary(summary):
+    return (f"完成 {summary['ok']}/{summary['total']} 个（其中 {summary['cached']} 个使用已有结果），"
+            f"失败 {summary['failed']} 个，"
+            f"输出 {summary['bytes'] / 1024 / 1024:.1f} MB，用时 {summary['elapsed']:.1f} 秒")
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="批量图片格式转换工具（命令行版）")
+    parser.add_argument("inputs", nargs="*", default=["."],
+                        help="图片文件、文件夹或通配符，默认当前文件夹")
+    parser.add_argument("-o", "--output-dir", default=None,
+                        help="输出根目录（保留子文件夹结构），默认与源文件同目录")
+    parser.add_argument("-r", "--recursive", action="store_true", help="递归扫描子文件夹")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="并行进程数，默认按CPU核心数自动选择")
+    parser.add_argument("-q", "--quiet", action="store_true", help="只显示失败的文件和汇总")
+    parser.add_argument("-t", "--to", choices=tuple(TARGET_FORMATS), default=DEFAULT_TARGET, help="输出格式")
+    parser.add_argument("-p", "--profile", choices=SPEED_PROFILES, default=DEFAULT_SPEED,
+                        help="编码预设：fast最快 / balanced均衡 / smallest文件最小")
+    parser.add_argument("--quality", type=int, default=None, help="有损格式（webp、jpg）的画质 1~100")
+    parser.add_argument("--thumbnail", type=int, default=None, metavar="SIZE",
+                        help=f"额外生成最长边为SIZE像素的缩略图（文件名加{THUMBNAIL_SUFFIX}）")
+    parser.add_argument("-a", "--animation", choices=ANIMATION_MODES, default=DEFAULT_ANIMATION,
+                        help="动图输出方式：animate保留动画（PNG为APNG，jpg改为逐帧） / "
+                             f"frames每帧一张图片（放在{FRAMES_SUFFIX}文件夹中） / first只取第一帧")
+    parser.add_argument("--no-cache", action="store_true", help="不使用转换缓存，全部重新转换")
+    parser.add_argument("--benchmark", type=int, nargs="?", const=20, default=None, metavar="N",
+                        help="取前N张图片（默认20）测试输出格式（--to）各编码预设的耗时和输出大小，不转换")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if args.jobs is not None and args.jobs <= 0:
+        print("错误：并行进程数必须为正整数")
+        return 2
+    if args.thumbnail is not None and args.thumbnail <= 0:
+        print("错误：缩略图尺寸必须为正整数")
+        return 2
+    try:
+        options = encoder_options(args.to, args.profile, args.quality)
+    except ValueError as e:
+        print(f"错误：{e}")
+        return 2
+    target = TARGET_FORMATS[args.to]
+
+    image_files = find_image_files(args.inputs, recursive=args.recursive)
+    if not image_files:
+        print("未找到图片文件！")
+        return 1
+
+    if args.benchmark is not None:
+        samples = [source for source, _ in image_files[:args.benchmark]]
+        print(f"{args.to} 编码预设测试: {len(samples)} 张图片")
+        for profile, seconds, size in benchmark_profiles(samples, args.to, args.quality):
+            print(f"  {profile:<9} {seconds:.2f} 秒  {size / 1024 / 1024:.2f} MB")
+        return 0
+
+    tasks = []
+    for source, base_dir in image_files:
+        output = build_output_path(source, args.output_dir, base_dir, target["ext"])
+        if os.path.abspath(output) == source:
+            # 源文件与输出格式相同且输出到原位置时跳过，不覆盖原图
+            continue
+        tasks.append(make_task(source, output, target["format"], options, thumbnail=args.thumbnail,
+                               animation=args.animation))
+
+    def on_result(result):
+        if not result["ok"] or not args.quiet:
+            print(describe_result(result))
+
+    cache = None if args.no_cache else ConversionCache()
+    summary = ImageConvertEngine(workers=args.jobs, cache=cache).run(tasks, on_result)
+    print(describe_summary(summary))
+    return 0 if summary["failed"] == 0 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
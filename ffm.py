@@ -1,11 +1,10 @@
 import os
-import re
-import subprocess
 import tkinter as tk
-from tkinter import filedialog, messagebox, simpledialog
-from pathlib import Path
+from tkinter import messagebox
 import threading
 
+from screenshot_core import ScreenshotExtractor, find_video_files
+
 class VideoScreenshotTool:
     def __init__(self, root):
         self.root = root
@@ -19,8 +18,8 @@ class VideoScreenshotTool:
         # 创建界面元素
         self.create_widgets()
         
-        # 视频文件扩展名列表
-        self.VIDEO_EXTS = ['.mp4', '.mkv', '.avi', '.mov', '.wmv', '.flv', '.webm']
+        # 截图核心（扫描、调用ffmpeg等逻辑）
+        self.extractor = ScreenshotExtractor()
         
     def create_widgets(self):
         # 主框架
@@ -76,61 +75,32 @@ class VideoScreenshotTool:
     
     def process_videos(self, interval):
         try:
-            # 获取当前文件夹路径
-            current_dir = os.getcwd()
-            
-            # 获取所有视频文件
-            video_files = []
-            for file in os.listdir(current_dir):
-                if any(file.lower().endswith(ext) for ext in self.VIDEO_EXTS):
-                    video_files.append(file)
+            # 获取当前文件夹中的所有视频文件
+            video_files = find_video_files([os.getcwd()])
             
             if not video_files:
-                self.status_var.set("就绪")
-                messagebox.showinfo("完成", "当前文件夹内未找到视频文件！")
-                self.enable_buttons()
+                self.root.after(0, lambda: self.status_var.set("就绪"))
+                self.root.after(0, lambda: messagebox.showinfo("完成", "当前文件夹内未找到视频文件！"))
+                self.root.after(0, self.enable_buttons)
                 return
             
             total_videos = len(video_files)
-            processed = 0
             
-            # 处理每个视频文件
-            for video_file in video_files:
-                try:
-                    self.process_single_video(video_file, interval)
-                    processed += 1
-                    self.status_var.set(f"已处理: {processed}/{total_videos}")
-                except Exception as e:
-                    print(f"处理视频 {video_file} 时出错: {str(e)}")
+            # 处理每个视频文件，输出 {视频名}_0001.jpg
+            self.extractor.process_videos(
+                video_files, interval, hdr_mode="none", dolby_mode="keep",
+                name_template="{video_name}_{index}",
+                on_progress=lambda done, total: self.root.after(0, lambda: self.status_var.set(f"已处理: {done}/{total}"))
+            )
             
-            self.status_var.set("就绪")
-            messagebox.showinfo("完成", f"所有视频处理完成！共处理 {total_videos} 个视频文件。")
+            self.root.after(0, lambda: self.status_var.set("就绪"))
+            self.root.after(0, lambda: messagebox.showinfo("完成", f"所有视频处理完成！共处理 {total_videos} 个视频文件。"))
         except Exception as e:
-            messagebox.showerror("错误", f"发生错误: {str(e)}")
-            self.status_var.set("就绪")
+            error_msg = f"发生错误: {str(e)}"
+            self.root.after(0, lambda: messagebox.showerror("错误", error_msg))
+            self.root.after(0, lambda: self.status_var.set("就绪"))
         finally:
-            self.enable_buttons()
-    
-    def process_single_video(self, video_file, interval):
-        # 创建视频对应的文件夹
-        video_name = os.path.splitext(video_file)[0]
-        output_dir = os.path.join(os.getcwd(), video_name)
-        os.makedirs(output_dir, exist_ok=True)
-        
-        # 构建ffmpeg命令
-        cmd = [
-            "ffmpeg",
-            "-i", os.path.abspath(video_file),
-            "-vf", f"fps=1/{interval}",
-            os.path.join(output_dir, f"{video_name}_%04d.jpg")
-        ]
-        
-        # 执行命令
-        result = subprocess.run(cmd, capture_output=True, text=True)
-        
-        if result.returncode != 0:
-            print(f"FFmpeg 错误: {result.stderr}")
-            raise Exception(f"处理视频时出错: {result.stderr}")
+            self.root.after(0, self.enable_buttons)
     
     def enable_buttons(self):
         # 重新启用按钮
@@ -2,17 +2,18 @@ import os
 import re
 import subprocess
 import tkinter as tk
-from tkinter import filedialog, messagebox, simpledialog
-from pathlib import Path
+from tkinter import messagebox
 import threading
-import sys
 from datetime import datetime
 
+from screenshot_core import (ScreenshotExtractor, find_video_files, get_ffmpeg_path,
+                             describe_progress, ADAPTIVE_MODES, DEFAULT_SCENE_THRESHOLD)
+
 class VideoScreenshotTool:
     def __init__(self, root):
         self.root = root
         self.root.title("视频分片截图工具")
-        self.root.geometry("550x500")
+        self.root.geometry("550x620")
         self.root.resizable(False, False)
         
         self.bg_color = "#f5f5f5"
@@ -26,20 +27,17 @@ class VideoScreenshotTool:
         
         self.root.configure(bg=self.bg_color)
         
-        self.ffmpeg_path = self.get_ffmpeg_path()
+        self.ffmpeg_path = get_ffmpeg_path()
+        self.extractor = ScreenshotExtractor(self.ffmpeg_path)
         
-        self.VIDEO_EXTS = ['.mp4', '.mkv', '.avi', '.mov', '.wmv', '.flv', '.webm', '.m4v', '.3gp']
+        self.cpu_count = self.extractor.cpu_count
+        self.default_concurrency = self.extractor.default_concurrency
         
         self.create_widgets()
         
         self.check_ffmpeg()
-    
-    def get_ffmpeg_path(self):
-        local_ffmpeg = os.path.join(os.getcwd(), "ffmpeg", "bin", "ffmpeg.exe")
-        if os.path.exists(local_ffmpeg):
-            return local_ffmpeg
-        else:
-            return "ffmpeg"
+        
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
     
     def check_ffmpeg(self):
         try:
@@ -95,6 +93,22 @@ class VideoScreenshotTool:
                                  font=self.font, width=8, relief="solid", bd=1)
         interval_entry.pack(side=tk.LEFT)
         
+        concurrency_frame = tk.Frame(settings_card, bg="white")
+        concurrency_frame.pack(fill=tk.X, padx=15, pady=(0, 12))
+        
+        concurrency_label = tk.Label(concurrency_frame, text="并行任务数:", 
+                                    font=self.font, bg="white", width=12, anchor=tk.W)
+        concurrency_label.pack(side=tk.LEFT)
+        
+        self.concurrency_var = tk.StringVar(value=str(self.default_concurrency))
+        concurrency_entry = tk.Entry(concurrency_frame, textvariable=self.concurrency_var, 
+                                    font=self.font, width=8, relief="solid", bd=1)
+        concurrency_entry.pack(side=tk.LEFT)
+        
+        concurrency_hint = tk.Label(concurrency_frame, text=f"(CPU核心数: {self.cpu_count})", 
+                                   font=self.font, bg="white", fg="#999999")
+        concurrency_hint.pack(side=tk.LEFT, padx=(10, 0))
+        
         format_frame = tk.Frame(settings_card, bg="white")
         format_frame.pack(fill=tk.X, padx=15, pady=(0, 12))
         
@@ -111,6 +125,34 @@ class VideoScreenshotTool:
                                    value="png", font=self.font, bg="white", anchor=tk.W)
         format_png.pack(side=tk.LEFT)
         
+        mode_frame = tk.Frame(settings_card, bg="white")
+        mode_frame.pack(fill=tk.X, padx=15, pady=(0, 12))
+        
+        mode_label = tk.Label(mode_frame, text="提取模式:", 
+                             font=self.font, bg="white", width=12, anchor=tk.W)
+        mode_label.pack(side=tk.LEFT)
+        
+        self.extract_mode_names = {
+            "fps": "逐帧解码",
+            "seek": "精确定位",
+            "seek_key": "关键帧定位",
+            "keyframe": "仅关键帧",
+            "scene": "场景变化(自适应)",
+            "dedup": "去除重复画面(自适应)"
+        }
+        self.extract_mode_label = tk.StringVar(value=self.extract_mode_names["fps"])
+        mode_menu = tk.OptionMenu(mode_frame, self.extract_mode_label, *self.extract_mode_names.values())
+        mode_menu.config(font=self.font, bg="white", relief="solid", bd=1, highlightthickness=0, width=16)
+        mode_menu.pack(side=tk.LEFT)
+        
+        threshold_label = tk.Label(mode_frame, text="场景阈值:", font=self.font, bg="white")
+        threshold_label.pack(side=tk.LEFT, padx=(15, 5))
+        
+        self.scene_threshold_var = tk.StringVar(value=str(DEFAULT_SCENE_THRESHOLD))
+        threshold_entry = tk.Entry(mode_frame, textvariable=self.scene_threshold_var, 
+                                  font=self.font, width=6, relief="solid", bd=1)
+        threshold_entry.pack(side=tk.LEFT)
+        
         hdr_frame = tk.Frame(settings_card, bg="white")
         hdr_frame.pack(fill=tk.X, padx=15, pady=(0, 12))
         
@@ -131,6 +173,26 @@ class VideoScreenshotTool:
                                  value="none", font=self.font, bg="white", anchor=tk.W)
         hdr_none.pack(side=tk.LEFT)
         
+        hdr_preset_frame = tk.Frame(settings_card, bg="white")
+        hdr_preset_frame.pack(fill=tk.X, padx=15, pady=(0, 12))
+        
+        hdr_preset_label = tk.Label(hdr_preset_frame, text="HDR转换速度:", 
+                                   font=self.font, bg="white", width=12, anchor=tk.W)
+        hdr_preset_label.pack(side=tk.LEFT)
+        
+        self.hdr_preset = tk.StringVar(value="quality")
+        hdr_quality = tk.Radiobutton(hdr_preset_frame, text="高质量", variable=self.hdr_preset, 
+                                    value="quality", font=self.font, bg="white", anchor=tk.W)
+        hdr_quality.pack(side=tk.LEFT, padx=(0, 10))
+        
+        hdr_fast = tk.Radiobutton(hdr_preset_frame, text="快速", variable=self.hdr_preset, 
+                                 value="fast", font=self.font, bg="white", anchor=tk.W)
+        hdr_fast.pack(side=tk.LEFT, padx=(0, 10))
+        
+        hdr_clip = tk.Radiobutton(hdr_preset_frame, text="最快(高光裁切)", variable=self.hdr_preset, 
+                                 value="clip", font=self.font, bg="white", anchor=tk.W)
+        hdr_clip.pack(side=tk.LEFT)
+        
         dolby_frame = tk.Frame(settings_card, bg="white")
         dolby_frame.pack(fill=tk.X, padx=15, pady=(0, 12))
         
@@ -171,7 +233,21 @@ class VideoScreenshotTool:
                                    fg="white", width=15, height=1, cursor="hand2",
                                    activebackground="#1976D2", activeforeground="white",
                                    relief="flat", bd=0)
-        self.run_button.pack()
+        self.run_button.pack(side=tk.LEFT, expand=True)
+        
+        self.pause_button = tk.Button(button_frame, text="暂停", font=self.font, 
+                                     command=self.toggle_pause, bg="#BDBDBD", 
+                                     fg="white", width=8, height=1, cursor="hand2",
+                                     activebackground="#F57C00", activeforeground="white",
+                                     relief="flat", bd=0, state=tk.DISABLED)
+        self.pause_button.pack(side=tk.LEFT, expand=True)
+        
+        self.cancel_button = tk.Button(button_frame, text="取消", font=self.font, 
+                                      command=self.cancel_screenshot, bg="#BDBDBD", 
+                                      fg="white", width=8, height=1, cursor="hand2",
+                                      activebackground="#D32F2F", activeforeground="white",
+                                      relief="flat", bd=0, state=tk.DISABLED)
+        self.cancel_button.pack(side=tk.LEFT, expand=True)
         
         status_frame = tk.Frame(main_frame, bg="#e0e0e0", height=25)
         status_frame.pack(fill=tk.X, side=tk.BOTTOM)
@@ -196,26 +272,41 @@ class VideoScreenshotTool:
             messagebox.showerror("输入错误", "请输入一个有效的正浮点数作为截图间隔！")
             return
         
+        try:
+            concurrency = int(self.concurrency_var.get())
+            if concurrency <= 0:
+                raise ValueError("并行任务数必须为正整数")
+        except ValueError:
+            messagebox.showerror("输入错误", "请输入一个有效的正整数作为并行任务数！")
+            return
+        
+        try:
+            scene_threshold = float(self.scene_threshold_var.get())
+            if not 0 < scene_threshold < 1:
+                raise ValueError("场景阈值必须在0到1之间")
+        except ValueError:
+            messagebox.showerror("输入错误", "请输入0到1之间的数字作为场景阈值！")
+            return
+        
         self.run_button.config(state=tk.DISABLED, bg="#BDBDBD")
+        self.pause_button.config(state=tk.NORMAL, bg=self.secondary_color, text="暂停")
+        self.cancel_button.config(state=tk.NORMAL, bg=self.error_color)
         self.status_var.set("正在处理...")
         
         hdr_mode = self.hdr_mode.get()
+        hdr_preset = self.hdr_preset.get()
         output_format = self.format_var.get()
         dolby_mode = self.dolby_mode.get()
+        extract_mode = next(mode for mode, name in self.extract_mode_names.items()
+                            if name == self.extract_mode_label.get())
         
         current_date = datetime.now().strftime("%m%d")
         
-        threading.Thread(target=self.process_videos, args=(interval, hdr_mode, output_format, dolby_mode, current_date), daemon=True).start()
+        threading.Thread(target=self.process_videos, args=(interval, hdr_mode, output_format, dolby_mode, current_date, concurrency, extract_mode, scene_threshold, hdr_preset), daemon=True).start()
     
-    def process_videos(self, interval, hdr_mode, output_format, dolby_mode, current_date):
+    def process_videos(self, interval, hdr_mode, output_format, dolby_mode, current_date, concurrency=1, extract_mode="fps", scene_threshold=DEFAULT_SCENE_THRESHOLD, hdr_preset="quality"):
         try:
-            current_dir = os.getcwd()
-            
-            video_files = []
-            for file in os.listdir(current_dir):
-                file_path = os.path.join(current_dir, file)
-                if os.path.isfile(file_path) and any(file.lower().endswith(ext) for ext in self.VIDEO_EXTS):
-                    video_files.append(file)
+            video_files = find_video_files([os.getcwd()])
             
             if not video_files:
                 self.root.after(0, lambda: self.status_var.set("就绪"))
@@ -224,21 +315,40 @@ class VideoScreenshotTool:
                 return
             
             total_videos = len(video_files)
-            processed = 0
+            finished = [0]
+            
+            def on_progress(done, total):
+                finished[0] = done
+                self.root.after(0, lambda: self.status_var.set(f"已处理: {done}/{total}"))
+            
+            def on_file_progress(video_file, progress):
+                status = (f"已处理: {finished[0]}/{total_videos}  "
+                          f"{os.path.basename(video_file)} {describe_progress(progress)}")
+                self.root.after(0, lambda: self.status_var.set(status))
+            
+            def on_error(video_file, error):
+                error_msg = f"处理视频 {os.path.basename(video_file)} 时出错: {str(error)}"
+                self.root.after(0, lambda: messagebox.showerror("处理错误", error_msg))
+            
+            processed = self.extractor.process_videos(
+                video_files, interval, hdr_mode=hdr_mode, output_format=output_format,
+                dolby_mode=dolby_mode, current_date=current_date, concurrency=concurrency,
+                extract_mode=extract_mode, on_progress=on_progress, on_error=on_error,
+                scene_threshold=scene_threshold, hdr_preset=hdr_preset,
+                on_file_progress=on_file_progress
+            )
             
-            for video_file in video_files:
-                try:
-                    success = self.process_single_video(video_file, interval, hdr_mode, output_format, dolby_mode, current_date)
-                    if success:
-                        processed += 1
-                    self.root.after(0, lambda: self.status_var.set(f"已处理: {processed}/{total_videos}"))
-                except Exception as e:
-                    print(f"处理视频 {video_file} 时出错: {str(e)}")
-                    error_msg = f"处理视频 {video_file} 时出错: {str(e)}"
-                    self.root.after(0, lambda msg=error_msg: messagebox.showerror("处理错误", msg))
+            if self.extractor.controller.cancelled:
+                cancel_msg = f"已取消，共完成 {processed}/{total_videos} 个视频文件。已生成的截图会保留，下次运行时继续处理。"
+                self.root.after(0, lambda: messagebox.showinfo("已取消", cancel_msg))
+                return
             
+            done_msg = f"视频处理完成！共处理 {processed}/{total_videos} 个视频文件。"
+            if extract_mode in ADAPTIVE_MODES:
+                stats = self.extractor.last_run_stats
+                done_msg += f"\n共保留 {stats['frames']} 张截图，丢弃 {stats['dropped']} 张相似画面。"
             self.root.after(0, lambda: self.status_var.set("就绪"))
-            self.root.after(0, lambda: messagebox.showinfo("完成", f"视频处理完成！共处理 {processed}/{total_videos} 个视频文件。"))
+            self.root.after(0, lambda: messagebox.showinfo("完成", done_msg))
         except Exception as e:
             error_msg = f"发生错误: {str(e)}"
             self.root.after(0, lambda msg=error_msg: messagebox.showerror("错误", msg))
@@ -246,111 +356,33 @@ class VideoScreenshotTool:
         finally:
             self.root.after(0, self.enable_buttons)
     
-    def detect_hdr_video(self, video_file):
-        try:
-            cmd = [
-                self.ffmpeg_path,
-                "-i", os.path.abspath(video_file),
-                "-hide_banner"
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
-            
-            stderr = result.stderr.lower()
-            hdr_indicators = [
-                "bt.2020", "rec.2020",
-                "pq", "smpte st 2084",
-                "hlg", "arib-std-b67",
-                "hdr10", "hdr10+",
-                "dolby vision"
-            ]
-            
-            return any(indicator in stderr for indicator in hdr_indicators)
-        except:
-            return False
+    def toggle_pause(self):
+        controller = self.extractor.controller
+        if controller.paused:
+            controller.resume()
+            self.pause_button.config(text="暂停")
+            self.status_var.set("正在处理...")
+        else:
+            # 正在截图的视频会继续完成，排队中的视频等待继续
+            controller.pause()
+            self.pause_button.config(text="继续")
+            self.status_var.set("已暂停，当前视频完成后停止")
     
-    def detect_dolby_audio(self, video_file):
-        try:
-            cmd = [
-                self.ffmpeg_path,
-                "-i", os.path.abspath(video_file),
-                "-hide_banner"
-            ]
-            result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
-            
-            stderr = result.stderr.lower()
-            dolby_indicators = [
-                "truehd", "dolby atmos", "dolby truehd", "e-ac-3", "atmos"
-            ]
-            
-            return any(indicator in stderr for indicator in dolby_indicators)
-        except:
-            return False
+    def cancel_screenshot(self):
+        self.pause_button.config(state=tk.DISABLED, bg="#BDBDBD")
+        self.cancel_button.config(state=tk.DISABLED, bg="#BDBDBD")
+        self.status_var.set("正在取消...")
+        self.extractor.controller.cancel()
     
-    def process_single_video(self, video_file, interval, hdr_mode, output_format, dolby_mode, current_date):
-        video_name = os.path.splitext(video_file)[0]
-        video_name = re.sub(r'[<>:"/\\|?*]', '_', video_name)
-        output_dir = os.path.join(os.getcwd(), video_name)
-        os.makedirs(output_dir, exist_ok=True)
-        
-        cmd = [self.ffmpeg_path, "-i", os.path.abspath(video_file)]
-        
-        has_dolby_audio = self.detect_dolby_audio(video_file)
-        remove_audio = False
-        
-        if dolby_mode == "auto" and has_dolby_audio:
-            remove_audio = True
-            print(f"检测到杜比音频，自动移除音频: {video_file}")
-        elif dolby_mode == "remove":
-            remove_audio = True
-            print(f"强制移除音频: {video_file}")
-        
-        if remove_audio:
-            cmd.extend(["-map", "0:v:0"])
-        
-        is_hdr = False
-        if hdr_mode != "none":
-            is_hdr = self.detect_hdr_video(video_file)
-            if is_hdr:
-                print(f"检测到HDR视频: {video_file}")
-        
-        if (hdr_mode == "force" or (hdr_mode == "auto" and is_hdr)):
-            vf_filter = (
-                f"fps=1/{interval},"
-                "zscale=t=linear:npl=100,format=gbrpf32le,"
-                "zscale=p=bt709,tonemap=hable:param=1.0,"
-                "zscale=t=bt709:m=bt709:r=pc,format=yuv420p"
-            )
-            cmd.extend(["-vf", vf_filter])
-            print(f"应用HDR转SDR处理: {video_file}")
-        else:
-            cmd.extend(["-vf", f"fps=1/{interval}"])
-        
-        if output_format == "jpg":
-            cmd.extend(["-q:v", "2"])
-        else:
-            cmd.extend(["-compression_level", "6"])
-        
-        output_pattern = os.path.join(output_dir, f"{video_name}_%04d_{current_date}.{output_format}")
-        cmd.append(output_pattern)
-        
-        result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
-        
-        if result.returncode != 0:
-            error_msg = result.stderr
-            if "Invalid data found" in error_msg:
-                error_msg = "视频文件格式可能损坏或不支持"
-            elif "Permission denied" in error_msg:
-                error_msg = "没有文件访问权限"
-            elif "No such file or directory" in error_msg:
-                error_msg = "视频文件不存在或路径错误"
-                
-            print(f"FFmpeg 错误: {error_msg}")
-            raise Exception(f"处理视频时出错: {error_msg}")
-        
-        return True
+    def on_close(self):
+        # 关闭窗口时结束所有 ffmpeg 子进程，避免残留后台进程
+        self.extractor.controller.cancel()
+        self.root.destroy()
     
     def enable_buttons(self):
         self.run_button.config(state=tk.NORMAL, bg=self.primary_color)
+        self.pause_button.config(state=tk.DISABLED, bg="#BDBDBD", text="暂停")
+        self.cancel_button.config(state=tk.DISABLED, bg="#BDBDBD")
         self.status_var.set("就绪")
 
 if __name__ == "__main__":
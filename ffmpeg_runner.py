@@ -0,0 +1,164 @@
+import os
+import time
+import threading
+import subprocess
+from collections import deque
+
+from job_controller import popen_kwargs, kill_process_tree
+
+
+def format_seconds(seconds):
+    """秒数格式化为 HH:MM:SS，未知时返回 --:--:--"""
+    if seconds is None:
+        return "--:--:--"
+    seconds = int(max(0, seconds))
+    return f"{seconds // 3600:02d}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}"
+
+
+def parse_seconds(text):
+    """解析 "90"、"1:30.5"、"1:02:03" 形式的时间为秒数，空字符串返回 None，格式错误或为负数时抛出 ValueError"""
+    text = text.strip()
+    if not text:
+        return None
+    parts = [float(part) for part in text.split(":")]
+    if len(parts) > 3 or any(part < 0 for part in parts):
+        raise ValueError(f"无效的时间: {text}")
+    seconds = 0.0
+    for part in parts:
+        seconds = seconds * 60 + part
+    return seconds
+
+
+class ProgressParser:
+    """解析 ffmpeg -progress 输出的 key=value 块，换算为百分比、处理速度和剩余时间"""
+
+    def __init__(self, duration=None):
+        self.duration = duration
+        self.start_time = time.monotonic()
+        self.values = {}
+
+    def feed(self, line):
+        """输入一行，块结束（progress=...）时返回进度字典，否则返回 None"""
+        key, sep, value = line.strip().partition('=')
+        if not sep:
+            return None
+        self.values[key] = value.strip()
+        if key != "progress":
+            return None
+        return self.snapshot(finished=(value.strip() == "end"))
+
+    def snapshot(self, finished=False):
+        out_time = None
+        # out_time_ms 实际单位也是微秒（ffmpeg 的历史遗留问题）
+        for key in ("out_time_us", "out_time_ms"):
+            try:
+                out_time = int(self.values[key]) / 1000000
+                break
+            except (KeyError, ValueError):
+                continue
+
+        try:
+            fps = float(self.values.get("fps", ""))
+        except ValueError:
+            fps = None
+        try:
+            speed = float(self.values.get("speed", "").rstrip('x'))
+        except ValueError:
+            speed = None
+
+        elapsed = time.monotonic() - self.start_time
+        percent = None
+        eta = None
+        if self.duration and out_time is not None:
+            percent = 100.0 if finished else min(99.9, max(0.0, out_time / self.duration * 100))
+            if finished:
+                eta = 0
+            elif out_time > 0:
+                eta = elapsed * (self.duration - out_time) / out_time
+
+        return {
+            "out_time": out_time,
+            "percent": percent,
+            "fps": fps,
+            "speed": speed,
+            "elapsed": elapsed,
+            "eta": eta,
+            "finished": finished
+        }
+
+
+def run_ffmpeg(cmd, duration=None, on_progress=None, min_interval=0.5, stderr_lines=200, controller=None,
+               input_data=None):
+    """运行 ffmpeg 并从 -progress pipe:1 读取进度。
+
+    duration 为预计输出时长（秒），用于换算百分比和剩余时间；on_progress 在读取线程中调用，
+    两次回调至少间隔 min_interval 秒（结束时一定回调一次），界面需自行切回主线程。
+    stderr 只保留最后 stderr_lines 行，长时间任务不会占用越来越多的内存。
+    传入 controller (JobController) 时进程会被登记，取消后结束进程并抛出 JobCancelled。
+    input_data 为写入 ffmpeg 标准输入的文本（如 -i pipe:0 的 concat 列表），不需要时 stdin 关闭。
+    返回 subprocess.CompletedProcess，stderr 为保留的最后几行文本。
+    """
+    if controller:
+        controller.check_cancelled()
+    # 通过标准输入传数据时不能加 -nostdin
+    stdin_args = [] if input_data is not None else ["-nostdin"]
+    cmd = [cmd[0]] + stdin_args + ["-progress", "pipe:1", "-nostats"] + list(cmd[1:])
+    process = subprocess.Popen(
+        cmd,
+        stdin=subprocess.PIPE if input_data is not None else subprocess.DEVNULL,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.PIPE,
+        text=True,
+        encoding='utf-8',
+        errors='ignore',
+        **popen_kwargs()
+    )
+    if controller:
+        controller.register_process(process)
+
+    stderr_tail = deque(maxlen=stderr_lines)
+
+    def read_stderr():
+        for line in process.stderr:
+            stderr_tail.append(line.rstrip())
+
+    stderr_thread = threading.Thread(target=read_stderr, daemon=True)
+    stderr_thread.start()
+
+    def write_stdin():
+        # 单独线程写入，数据很大时不会与读取 stdout 互相阻塞
+        try:
+            process.stdin.write(input_data)
+            process.stdin.close()
+        except OSError:
+            pass
+
+    if input_data is not None:
+        threading.Thread(target=write_stdin, daemon=True).start()
+
+    parser = ProgressParser(duration)
+    last_report = 0
+    try:
+        for line in process.stdout:
+            progress = parser.feed(line)
+            if progress is None or on_progress is None:
+                continue
+            now = time.monotonic()
+            if progress["finished"] or now - last_report >= min_interval:
+                last_report = now
+                on_progress(progress)
+        process.wait()
+    finally:
+        if process.poll() is None:
+            kill_process_tree(process)
+            process.wait()
+        if controller:
+            controller.unregister_process(process)
+        stderr_thread.join()
+        process.stdout.close()
+        process.stderr.close()
+
+    if controller:
+        controller.check_cancelled()
+
+    return subprocess.CompletedProcess(cmd, process.returncode, None, os.linesep.join(stderr_tail))
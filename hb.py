@@ -1,17 +1,37 @@
 import tkinter as tk
 from tkinter import ttk
 from tkinterdnd2 import TkinterDnD, DND_FILES
-from PIL import Image, ImageOps
+from PIL import Image
 import os
+import threading
 from datetime import datetime
-import math
-import re
+
+from image_merge_core import ImageMergeEngine, DEFAULT_COLUMNS
+from natural_sort import sort_paths, parse_timestamp
+
+# EXIF 中的拍摄时间（DateTimeOriginal，位于 Exif 子IFD）和修改时间（DateTime）
+EXIF_IFD = 0x8769
+EXIF_DATETIME_ORIGINAL = 36867
+EXIF_DATETIME = 306
+
+ORIGINAL_SIZE = "原始大小"
+MAX_CELL_CHOICES = (ORIGINAL_SIZE, "4096", "2048", "1024", "512")
+
+MODE_NAMES = {
+    "horizontal": "横向合并",
+    "square": "网格合并 (2×n)",
+    "grid3": "网格合并 (3×n)",
+    "grid4": "网格合并 (4×n)",
+    "grid": "自定义网格",
+    "justified": "等高行",
+    "masonry": "瀑布流"
+}
 
 class ImageMergerApp:
     def __init__(self, root):
         self.root = root
         self.root.title("图片合并工具")
-        self.root.geometry("650x550")
+        self.root.geometry("650x650")
         self.root.configure(bg='#f0f0f0')
         
         # 设置应用样式
@@ -24,9 +44,15 @@ class ImageMergerApp:
         
         # 支持的图片格式
         self.supported_formats = ('.jpg', '.jpeg', '.png', '.webp')
-        self.max_images = 100  # 设置一个较高的上限避免内存问题
         self.merge_mode = tk.StringVar(value="horizontal")  # 默认为横向合并
         self.output_format = tk.StringVar(value="jpg")  # 默认输出格式为JPG
+        self.sort_order = tk.StringVar(value="name")  # 默认按文件名自然顺序
+        self.max_cell = tk.StringVar(value=ORIGINAL_SIZE)  # 单元格最长边，默认不缩小
+        self.fast_resize = tk.BooleanVar(value=False)  # 快速缩放：解码时直接缩小并用双线性插值
+        self.columns = tk.StringVar(value=str(DEFAULT_COLUMNS))  # 瀑布流和自定义网格的列数
+        # 合并时逐张解码贴图，内存占用不随图片数量增长，因此不再限制图片数量
+        self.engine = ImageMergeEngine(log=self.log_message)
+        self.processing = False
 
         # 创建GUI组件
         self.create_widgets()
@@ -66,6 +92,34 @@ class ImageMergerApp:
             variable=self.merge_mode, value="grid4"
         ).pack(side=tk.LEFT, padx=5)
         
+        # 按图片比例排版的合并方式
+        layout_frame = ttk.Frame(main_frame)
+        layout_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(layout_frame, text="更多排版:", font=('Arial', 10)).pack(side=tk.LEFT, padx=(0, 10))
+        
+        ttk.Radiobutton(
+            layout_frame, text="等高行", 
+            variable=self.merge_mode, value="justified"
+        ).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Radiobutton(
+            layout_frame, text="瀑布流", 
+            variable=self.merge_mode, value="masonry"
+        ).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Radiobutton(
+            layout_frame, text="自定义网格", 
+            variable=self.merge_mode, value="grid"
+        ).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Label(layout_frame, text="列数:", font=('Arial', 10)).pack(side=tk.LEFT, padx=(10, 5))
+        
+        ttk.Spinbox(
+            layout_frame, from_=1, to=50, width=5,
+            textvariable=self.columns
+        ).pack(side=tk.LEFT)
+        
         # 输出格式选择区域
         format_frame = ttk.Frame(main_frame)
         format_frame.pack(fill=tk.X, pady=5)
@@ -82,6 +136,38 @@ class ImageMergerApp:
             variable=self.output_format, value="png"
         ).pack(side=tk.LEFT, padx=5)
         
+        # 排序方式选择区域
+        order_frame = ttk.Frame(main_frame)
+        order_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(order_frame, text="排列顺序:", font=('Arial', 10)).pack(side=tk.LEFT, padx=(0, 10))
+        
+        ttk.Radiobutton(
+            order_frame, text="按文件名", 
+            variable=self.sort_order, value="name"
+        ).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Radiobutton(
+            order_frame, text="按拍摄时间", 
+            variable=self.sort_order, value="time"
+        ).pack(side=tk.LEFT, padx=5)
+        
+        # 输出尺寸区域
+        size_frame = ttk.Frame(main_frame)
+        size_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(size_frame, text="单元格最长边:", font=('Arial', 10)).pack(side=tk.LEFT, padx=(0, 10))
+        
+        ttk.Combobox(
+            size_frame, textvariable=self.max_cell,
+            values=MAX_CELL_CHOICES, width=10, state='readonly'
+        ).pack(side=tk.LEFT, padx=5)
+        
+        ttk.Checkbutton(
+            size_frame, text="快速缩放（大图更快，画质略低）",
+            variable=self.fast_resize
+        ).pack(side=tk.LEFT, padx=10)
+        
         # 添加分隔线
         ttk.Separator(main_frame, orient=tk.HORIZONTAL).pack(fill=tk.X, pady=10)
         
@@ -105,6 +191,15 @@ class ImageMergerApp:
         self.drop_label.drop_target_register(DND_FILES)
         self.drop_label.dnd_bind('<<Drop>>', self.handle_drop)
         
+        # 进度条
+        self.progress_var = tk.DoubleVar()
+        ttk.Progressbar(
+            main_frame,
+            variable=self.progress_var,
+            maximum=100,
+            mode='determinate'
+        ).pack(fill=tk.X, pady=(5, 0))
+        
         # 添加分隔线
         ttk.Separator(main_frame, orient=tk.HORIZONTAL).pack(fill=tk.X, pady=10)
         
@@ -130,12 +225,20 @@ class ImageMergerApp:
         self.log_text.config(yscrollcommand=scrollbar.set)
 
     def log_message(self, message):
+        """记录日志，任意线程都可以调用，实际写入在主线程进行"""
+        self.root.after(0, self.append_log, message)
+
+    def append_log(self, message):
         self.log_text.config(state='normal')
         self.log_text.insert(tk.END, message + "\n")
         self.log_text.see(tk.END)
         self.log_text.config(state='disabled')
 
     def handle_drop(self, event):
+        if self.processing:
+            self.log_message("警告：当前正在处理中，请等待完成")
+            return
+            
         files = self.root.tk.splitlist(event.data)
         valid_files = []
 
@@ -149,209 +252,83 @@ class ImageMergerApp:
             self.log_message("错误：至少需要1张图片")
             return
             
-        selected_mode = self.merge_mode.get()
-        mode_names = {
-            "horizontal": "横向合并",
-            "square": "网格合并 (2×n)",
-            "grid3": "网格合并 (3×n)",
-            "grid4": "网格合并 (4×n)"
-        }
-        
-        # 检查不同模式下的图片数量要求
-        if selected_mode == "grid4" and len(valid_files) < 1:
-            self.log_message("错误：网格合并(4×n)至少需要1张图片")
+        try:
+            columns = int(self.columns.get())
+            if columns < 1:
+                raise ValueError("列数必须大于0")
+        except ValueError:
+            self.log_message("错误：列数必须是大于0的整数")
             return
+            
+        # Tk 变量只能在主线程读取，启动后台线程前先取出所有设置
+        max_cell = self.max_cell.get()
+        options = {
+            "columns": columns,
+            "mode": self.merge_mode.get(),
+            "output_format": self.output_format.get(),
+            "sort_order": self.sort_order.get(),
+            "preset": "fast" if self.fast_resize.get() else "quality",
+            "max_cell": None if max_cell == ORIGINAL_SIZE else int(max_cell)
+        }
         
-        # 排序图片：如果所有文件名都是纯数字，则按数字排序，否则按文件名排序
-        if self.all_files_numeric(valid_files):
-            valid_files.sort(key=lambda x: self.extract_number(os.path.basename(x)))
-            self.log_message("已按文件名数字顺序排序图片")
-        else:
-            valid_files.sort(key=lambda x: os.path.basename(x))
-            self.log_message("已按文件名顺序排序图片")
-        
-        # 限制最大图片数量以避免内存问题
-        if len(valid_files) > self.max_images:
-            self.log_message(f"警告：图片数量超过{self.max_images}张，只处理前{self.max_images}张")
-            valid_files = valid_files[:self.max_images]
+        # 解码和缩放在后台线程池中进行，界面不会卡住
+        self.processing = True
+        self.progress_var.set(0)
+        threading.Thread(target=self.merge_images, args=(valid_files, options), daemon=True).start()
 
-        self.log_message(f"开始处理 {len(valid_files)} 张图片...")
-        self.log_message(f"合并模式: {mode_names[selected_mode]}")
-        self.log_message(f"输出格式: {self.output_format.get().upper()}")
-        
+    def get_capture_time(self, path):
+        """读取 EXIF 拍摄时间（只解析文件头，不解码图片），没有时返回 None"""
+        try:
+            with Image.open(path) as img:
+                exif = img.getexif()
+                value = exif.get_ifd(EXIF_IFD).get(EXIF_DATETIME_ORIGINAL) or exif.get(EXIF_DATETIME)
+        except Exception:
+            return None
+        return parse_timestamp(value)
+
+    def merge_images(self, file_paths, options):
+        """在后台线程中运行：排序、合并并保存"""
+        mode = options["mode"]
         try:
-            output_path = self.merge_images(valid_files, selected_mode)
+            # 排序图片：按文件名自然顺序（多段数字逐段比较），或按 EXIF 拍摄时间
+            if options["sort_order"] == "time":
+                file_paths = sort_paths(file_paths, "time", self.get_capture_time)
+                self.log_message("已按拍摄时间排序图片（无拍摄时间的按文件名排在最后）")
+            else:
+                file_paths = sort_paths(file_paths, "name")
+                self.log_message("已按文件名自然顺序排序图片")
+
+            self.log_message(f"开始处理 {len(file_paths)} 张图片...")
+            self.log_message(f"合并模式: {MODE_NAMES[mode]}")
+            if mode in ("grid", "masonry"):
+                self.log_message(f"列数: {options['columns']}")
+            self.log_message(f"输出格式: {options['output_format'].upper()}")
+
+            def on_progress(done, total):
+                self.root.after(0, self.progress_var.set, done / total * 100)
+
+            output_path = self.get_output_path(file_paths[0], mode, options["output_format"])
+            self.engine.merge(
+                file_paths, mode, options["output_format"], output_path,
+                preset=options["preset"], max_cell=options["max_cell"],
+                columns=options["columns"] if mode in ("grid", "masonry") else None,
+                on_progress=on_progress
+            )
             self.log_message(f"合并成功！保存路径: {output_path}")
         except Exception as e:
             self.log_message(f"处理出错: {str(e)}")
+        finally:
+            self.root.after(0, self.finish_merge)
 
-    def all_files_numeric(self, file_paths):
-        """检查所有文件名是否都是纯数字（不含扩展名）"""
-        for path in file_paths:
-            filename = os.path.splitext(os.path.basename(path))[0]
-            if not re.match(r'^\d+$', filename):
-                return False
-        return True
+    def finish_merge(self):
+        self.processing = False
 
-    def extract_number(self, filename):
-        """从文件名中提取数字（不含扩展名）"""
-        name = os.path.splitext(filename)[0]
-        return int(name) if name.isdigit() else 0
-
-    def merge_images(self, file_paths, mode):
-        images = []
-        for path in file_paths:
-            img = Image.open(path)
-            # 如果输出格式是PNG，确保图片有alpha通道
-            if self.output_format.get() == "png" and img.mode != "RGBA":
-                img = img.convert("RGBA")
-            images.append(img)
-        
-        if mode == "horizontal":
-            return self.merge_horizontal(images, file_paths)
-        elif mode == "square":
-            return self.merge_square(images, file_paths)
-        elif mode == "grid3":
-            return self.merge_grid(images, file_paths, 3)
-        elif mode == "grid4":
-            return self.merge_grid(images, file_paths, 4)
-    
-    def merge_horizontal(self, images, file_paths):
-        # 计算所有图片的最大高度
-        max_height = max(img.height for img in images)
-        
-        # 调整所有图片到相同高度
-        resized_images = []
-        for img in images:
-            w_percent = max_height / float(img.height)
-            new_width = int(float(img.width) * float(w_percent))
-            resized = img.resize((new_width, max_height), Image.LANCZOS)
-            resized_images.append(resized)
-        
-        # 计算总宽度
-        total_width = sum(img.width for img in resized_images)
-        
-        # 根据输出格式创建新图片
-        output_format = self.output_format.get()
-        if output_format == "png":
-            merged_img = Image.new('RGBA', (total_width, max_height), (0, 0, 0, 0))
-        else:
-            merged_img = Image.new('RGB', (total_width, max_height), (255, 255, 255))
-        
-        # 拼接图片
-        x_offset = 0
-        for img in resized_images:
-            merged_img.paste(img, (x_offset, 0))
-            x_offset += img.width
-            
-        return self.save_image(merged_img, file_paths[0])
-    
-    def merge_square(self, images, file_paths):
-        # 计算网格中每个单元格的大小
-        cell_width = max(img.width for img in images) if images else 100
-        cell_height = max(img.height for img in images) if images else 100
-        
-        # 创建2x2网格
-        grid_width = cell_width * 2
-        grid_height = cell_height * 2
-        
-        # 根据输出格式创建新图片
-        output_format = self.output_format.get()
-        if output_format == "png":
-            merged_img = Image.new('RGBA', (grid_width, grid_height), (0, 0, 0, 0))
-        else:
-            merged_img = Image.new('RGB', (grid_width, grid_height), (255, 255, 255))
-        
-        # 将图片放置到网格中
-        positions = [
-            (0, 0),             # 第一行第一列
-            (cell_width, 0),    # 第一行第二列
-            (0, cell_height),   # 第二行第一列
-            (cell_width, cell_height)  # 第二行第二列
-        ]
-        
-        for i in range(min(len(images), 4)):
-            # 调整图片大小以适应网格单元格
-            resized_img = ImageOps.pad(images[i], (cell_width, cell_height), 
-                                       color='white' if output_format == "jpg" else (0, 0, 0, 0), 
-                                       method=Image.LANCZOS)
-            merged_img.paste(resized_img, positions[i])
-            
-        return self.save_image(merged_img, file_paths[0])
-    
-    def merge_grid(self, images, file_paths, columns):
-        """通用的网格合并方法"""
-        if not images:
-            raise ValueError("没有图片可合并")
-            
-        # 计算网格的行数
-        num_images = len(images)
-        rows = math.ceil(num_images / columns)
-        
-        # 计算所有图片的最大宽度和高度
-        max_width = max(img.width for img in images)
-        max_height = max(img.height for img in images)
-        
-        # 创建网格图片
-        grid_width = max_width * columns
-        grid_height = max_height * rows
-        
-        # 根据输出格式创建新图片
-        output_format = self.output_format.get()
-        if output_format == "png":
-            merged_img = Image.new('RGBA', (grid_width, grid_height), (0, 0, 0, 0))
-        else:
-            merged_img = Image.new('RGB', (grid_width, grid_height), (255, 255, 255))
-        
-        # 按顺序放置图片
-        for i, img in enumerate(images):
-            # 计算当前图片的位置
-            row = i // columns
-            col = i % columns
-            
-            # 计算坐标
-            x = col * max_width
-            y = row * max_height
-            
-            # 调整图片大小以适应网格单元格
-            resized_img = ImageOps.pad(img, (max_width, max_height), 
-                                      color='white' if output_format == "jpg" else (0, 0, 0, 0), 
-                                      method=Image.LANCZOS)
-            merged_img.paste(resized_img, (x, y))
-            
-        return self.save_image(merged_img, file_paths[0])
-    
-    def save_image(self, image, reference_path):
-        # 获取第一个图片所在目录
+    def get_output_path(self, reference_path, mode, output_format):
+        # 输出到第一个图片所在目录，根据模式和格式生成文件名
         output_dir = os.path.dirname(reference_path)
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        
-        # 根据模式和格式生成文件名
-        mode_names = {
-            "horizontal": "horizontal",
-            "square": "square",
-            "grid3": "grid3",
-            "grid4": "grid4"
-        }
-        mode = self.merge_mode.get()
-        format_ext = self.output_format.get()
-        output_filename = f"merged_{mode_names[mode]}_{timestamp}.{format_ext}"
-        
-        output_path = os.path.join(output_dir, output_filename)
-        
-        # 保存图片
-        if format_ext == "jpg":
-            # 确保图片是RGB模式
-            if image.mode != "RGB":
-                image = image.convert("RGB")
-            image.save(output_path, quality=100, subsampling=0)
-        else:  # PNG格式
-            # 确保图片是RGBA模式
-            if image.mode != "RGBA":
-                image = image.convert("RGBA")
-            image.save(output_path, format="PNG")
-            
-        return output_path
+        output_filename = f"merged_{mode}_{timestamp}.{output_format}"
+        return os.path.join(output_dir, output_filename)
 
 if __name__ == '__main__':
     root = TkinterDnD.Tk()
@@ -0,0 +1,401 @@
+import os
+import math
+import zlib
+import struct
+import tempfile
+import itertools
+import statistics
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from PIL import Image, ImageChops
+
+MERGE_MODES = ("horizontal", "square", "grid3", "grid4", "grid", "justified", "masonry")
+GRID_COLUMNS = {"square": 2, "grid3": 3, "grid4": 4}
+# 自定义网格和瀑布流默认的列数
+DEFAULT_COLUMNS = 3
+# 等高行排列每行最多的图片数，限制排版计算量
+JUSTIFIED_MAX_ROW = 20
+# JPEG 格式限制的最大边长
+JPEG_MAX_SIDE = 65535
+# PNG 输出超过这个像素数时按条带写出，不在内存中创建整张画布
+STREAM_PIXEL_THRESHOLD = 64 * 1000 * 1000
+# 条带写出时每次压缩的行数
+BAND_HEIGHT = 64
+PNG_SIGNATURE = b'\x89PNG\r\n\x1a\n'
+PNG_COLOR_TYPES = {"RGB": 2, "RGBA": 6}
+# PNG 的 Up 滤波：每行记录与上一行的差值，照片类内容压缩效果比不滤波好得多
+PNG_FILTER_UP = b'\x02'
+# 缩放方式：reducing_gap 为先按整数倍快速缩小（JPEG 在解码时直接缩小）后，与目标尺寸保留的倍数，
+# 越大越接近直接 LANCZOS 全尺寸缩放的效果；fast 直接解码到接近目标尺寸再双线性缩放
+RESAMPLE_PRESETS = {
+    "quality": {"resample": Image.LANCZOS, "reducing_gap": 2.0},
+    "fast": {"resample": Image.BILINEAR, "reducing_gap": 1.0}
+}
+DEFAULT_RESAMPLE_PRESET = "quality"
+# 并行解码缩放的线程数上限（Pillow 解码和缩放时会释放 GIL）
+MAX_WORKERS = 8
+
+
+def read_image_info(path):
+    """只读取文件头得到尺寸，不解码像素"""
+    with Image.open(path) as img:
+        width, height = img.size
+    return {"path": path, "width": width, "height": height}
+
+
+def fit_box(width, height, cell_width, cell_height):
+    """等比缩放到单元格内并居中，计算方式与 ImageOps.pad 相同，返回相对单元格的 (x, y, 宽, 高)"""
+    if width / height > cell_width / cell_height:
+        new_width, new_height = cell_width, max(1, round(height / width * cell_width))
+    else:
+        new_width, new_height = max(1, round(width / height * cell_height)), cell_height
+    return (round((cell_width - new_width) / 2), round((cell_height - new_height) / 2), new_width, new_height)
+
+
+def limit_cell(width, height, max_cell=None):
+    """单元格最长边超过 max_cell 时等比缩小"""
+    if not max_cell or max(width, height) <= max_cell:
+        return width, height
+    scale = max_cell / max(width, height)
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def layout_horizontal(infos, max_cell=None):
+    """所有图片缩放到最大高度后从左到右排列"""
+    height = max(info["height"] for info in infos)
+    if max_cell:
+        height = min(height, max_cell)
+    tiles = []
+    x = 0
+    for info in infos:
+        tile_width = int(info["width"] * (height / info["height"]))
+        tiles.append({"path": info["path"], "x": x, "y": 0, "width": tile_width, "height": height})
+        x += tile_width
+    return {"width": x, "height": height, "tiles": tiles}
+
+
+def layout_grid(infos, columns, max_cell=None):
+    """columns 列的网格，行数由图片数量决定。
+
+    单元格取所有图片宽高比和高度的中位数，而不是最大的图片，个别大图或特殊比例的图不会让
+    所有单元格都变大、留出大片空白；图片等比缩放后在单元格内居中。
+    """
+    columns = max(1, min(columns, len(infos)))
+    rows = math.ceil(len(infos) / columns)
+    aspect = statistics.median(info["width"] / info["height"] for info in infos)
+    cell_height = statistics.median(info["height"] for info in infos)
+    cell_width, cell_height = limit_cell(max(1, round(cell_height * aspect)), max(1, round(cell_height)), max_cell)
+    tiles = []
+    for i, info in enumerate(infos):
+        x, y, tile_width, tile_height = fit_box(info["width"], info["height"], cell_width, cell_height)
+        tiles.append({
+            "path": info["path"],
+            "x": i % columns * cell_width + x,
+            "y": i // columns * cell_height + y,
+            "width": tile_width,
+            "height": tile_height
+        })
+    return {"width": cell_width * columns, "height": cell_height * rows, "tiles": tiles}
+
+
+def layout_justified(infos, row_height, canvas_width=None):
+    """等高行排列：按顺序分行，每行缩放到正好填满画布宽度，没有留白（最后一行不拉伸）。
+
+    画布宽度默认取使整体接近正方形的值；分行用动态规划，使各行高度尽量接近 row_height。
+    """
+    ratios = [info["width"] / info["height"] for info in infos]
+    if canvas_width is None:
+        canvas_width = max(1, round(math.sqrt(sum(ratios)) * row_height))
+
+    count = len(ratios)
+    best = [0.0] + [math.inf] * count
+    breaks = [0] * (count + 1)
+    for end in range(1, count + 1):
+        total = 0
+        for begin in range(end - 1, max(-1, end - 1 - JUSTIFIED_MAX_ROW), -1):
+            total += ratios[begin]
+            height = canvas_width / total
+            if end == count and height > row_height:
+                cost = 0  # 最后一行图片不够时保持目标高度，不计代价
+            else:
+                cost = ((height - row_height) / row_height) ** 2
+            if best[begin] + cost < best[end]:
+                best[end] = best[begin] + cost
+                breaks[end] = begin
+
+    rows = []
+    end = count
+    while end > 0:
+        rows.append((breaks[end], end))
+        end = breaks[end]
+    rows.reverse()
+
+    tiles = []
+    y = 0
+    for begin, end in rows:
+        total = sum(ratios[begin:end])
+        height = canvas_width / total
+        if end == count and height > row_height:
+            height = row_height
+        row_pixels = max(1, round(height))
+        # 按累计宽度取整，整行宽度之和正好等于画布宽度
+        cumulative = 0
+        x = 0
+        for i in range(begin, end):
+            cumulative += ratios[i]
+            next_x = min(canvas_width, round(cumulative * height))
+            tiles.append({"path": infos[i]["path"], "x": x, "y": y, "width": max(1, next_x - x), "height": row_pixels})
+            x = next_x
+        y += row_pixels
+    return {"width": canvas_width, "height": y, "tiles": tiles}
+
+
+def layout_masonry(infos, columns, column_width):
+    """瀑布流：所有图片缩放到相同宽度，按顺序放入当前最短的一列，只有底部参差不齐"""
+    columns = max(1, min(columns, len(infos)))
+    heights = [0] * columns
+    tiles = []
+    for info in infos:
+        column = heights.index(min(heights))
+        tile_height = max(1, round(info["height"] * column_width / info["width"]))
+        tiles.append({
+            "path": info["path"],
+            "x": column * column_width,
+            "y": heights[column],
+            "width": column_width,
+            "height": tile_height
+        })
+        heights[column] += tile_height
+    return {"width": column_width * columns, "height": max(heights), "tiles": tiles}
+
+
+def plan_layout(infos, mode, max_cell=None, columns=None):
+    """只根据图片尺寸计算画布大小和每张图片的位置，返回 {"width", "height", "tiles": [...]}。
+
+    tiles 中每项为 {"path", "x", "y", "width", "height"}，即图片缩放后在画布上占据的区域，
+    渲染时只解码、缩放和写入这些区域。
+    max_cell 限制单元格（横向合并和等高行为行高，瀑布流为列宽）的最长边，先定下输出尺寸，
+    解码时才能直接按目标大小缩小。columns 为自定义网格和瀑布流的列数。
+    """
+    if not infos:
+        raise ValueError("没有图片可合并")
+    if mode not in MERGE_MODES:
+        raise ValueError(f"不支持的合并方式: {mode}")
+    columns = GRID_COLUMNS.get(mode) or columns or DEFAULT_COLUMNS
+
+    if mode == "horizontal":
+        return layout_horizontal(infos, max_cell)
+    if mode == "justified":
+        row_height = round(statistics.median(info["height"] for info in infos))
+        return layout_justified(infos, min(row_height, max_cell) if max_cell else row_height)
+    if mode == "masonry":
+        column_width = round(statistics.median(info["width"] for info in infos))
+        return layout_masonry(infos, columns, min(column_width, max_cell) if max_cell else column_width)
+    return layout_grid(infos, columns, max_cell)
+
+
+def layout_coverage(layout):
+    """图片实际覆盖的面积占画布的比例"""
+    covered = sum(tile["width"] * tile["height"] for tile in layout["tiles"])
+    return covered / (layout["width"] * layout["height"])
+
+
+class PngStripWriter:
+    """逐条带写出 8 位 RGB/RGBA 的 PNG，内存占用只与条带大小有关，与整张图片大小无关"""
+
+    def __init__(self, path, width, height, mode, compress_level=6):
+        if mode not in PNG_COLOR_TYPES:
+            raise ValueError(f"不支持的PNG模式: {mode}")
+        self.width = width
+        self.height = height
+        self.mode = mode
+        self.stride = width * len(mode)
+        self.rows_written = 0
+        self.compressor = zlib.compressobj(compress_level)
+        # 第一行的"上一行"视为全 0，Up 滤波后与原始数据相同
+        self.previous_row = bytes(self.stride)
+        self.file = open(path, 'wb')
+        self.file.write(PNG_SIGNATURE)
+        self._write_chunk(b'IHDR', struct.pack(">IIBBBBB", width, height, 8, PNG_COLOR_TYPES[mode], 0, 0, 0))
+
+    def _write_chunk(self, chunk_type, data):
+        self.file.write(struct.pack(">I", len(data)))
+        self.file.write(chunk_type)
+        self.file.write(data)
+        self.file.write(struct.pack(">I", zlib.crc32(data, zlib.crc32(chunk_type)) & 0xffffffff))
+
+    def write_band(self, band):
+        """写入紧接着上一条带的若干行，band 为宽度与整张图片相同的 Image"""
+        rows = band.height
+        if band.width != self.width or band.mode != self.mode:
+            raise ValueError("条带的宽度或模式与输出不一致")
+        if self.rows_written + rows > self.height:
+            raise ValueError("写入的行数超过图片高度")
+
+        # 用上一行错开一行的图片做逐字节相减（模256），一次算出整条带的 Up 滤波结果
+        prior = Image.frombytes(self.mode, (self.width, 1), self.previous_row)
+        if rows > 1:
+            shifted = Image.new(self.mode, band.size)
+            shifted.paste(prior, (0, 0))
+            shifted.paste(band.crop((0, 0, self.width, rows - 1)), (0, 1))
+            prior = shifted
+        filtered = ImageChops.subtract_modulo(band, prior).tobytes()
+
+        stride = self.stride
+        data = b''.join(PNG_FILTER_UP + filtered[i:i + stride] for i in range(0, len(filtered), stride))
+        compressed = self.compressor.compress(data)
+        if compressed:
+            self._write_chunk(b'IDAT', compressed)
+        self.previous_row = band.crop((0, rows - 1, self.width, rows)).tobytes()
+        self.rows_written += rows
+
+    def finish(self):
+        """写完所有行后调用，写入剩余压缩数据和文件尾"""
+        if self.rows_written != self.height:
+            raise ValueError(f"PNG 只写入了 {self.rows_written}/{self.height} 行")
+        self._write_chunk(b'IDAT', self.compressor.flush())
+        self._write_chunk(b'IEND', b'')
+
+    def close(self):
+        self.file.close()
+
+
+class ImageMergeEngine:
+    """图片合并核心：先只读文件头算出布局，再逐张解码、缩放、贴到画布上，
+    同一时间只有一张源图在内存中。PNG 输出很大时画布放在临时文件里，按条带压缩写出。"""
+
+    def __init__(self, log=print, scratch_dir=None, stream_threshold=STREAM_PIXEL_THRESHOLD, workers=None):
+        self.log = log
+        # 条带写出时临时画布所在目录，默认使用系统临时目录
+        self.scratch_dir = scratch_dir
+        self.stream_threshold = stream_threshold
+        self.workers = workers or max(1, min(MAX_WORKERS, os.cpu_count() or 1))
+
+    def plan(self, file_paths, mode, max_cell=None, columns=None):
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            infos = list(executor.map(read_image_info, file_paths))
+        return plan_layout(infos, mode, max_cell, columns)
+
+    def load_tile(self, tile, canvas_mode, preset=DEFAULT_RESAMPLE_PRESET):
+        """解码一张图片并缩放到布局中的大小。
+
+        缩小时 JPEG 用 draft 在解码阶段按 1/2、1/4、1/8 缩小，只解码接近目标尺寸的像素；
+        其他格式由 resize 的 reducing_gap 先做整数倍缩小，再做精细缩放。
+        """
+        options = RESAMPLE_PRESETS[preset]
+        size = (tile["width"], tile["height"])
+        with Image.open(tile["path"]) as img:
+            if img.width > size[0] and img.height > size[1]:
+                gap = options["reducing_gap"]
+                img.draft(None, (int(size[0] * gap), int(size[1] * gap)))
+            if img.mode != canvas_mode:
+                img = img.convert(canvas_mode)
+            if img.size == size:
+                return img.copy()
+            return img.resize(size, options["resample"], reducing_gap=options["reducing_gap"])
+
+    def iter_tiles(self, tiles, canvas_mode, preset=DEFAULT_RESAMPLE_PRESET, on_progress=None):
+        """在线程池中并行解码缩放，按布局顺序逐张返回 (tile, 图片)，贴图顺序与单线程时相同。
+
+        同时解码和等待贴图的图片不超过线程数的两倍，内存占用与图片总数无关。
+        每贴完一张调用 on_progress(已完成数, 总数)。
+        """
+        total = len(tiles)
+        window = self.workers * 2
+        remaining = iter(tiles)
+        pending = deque()
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            def fill():
+                for tile in itertools.islice(remaining, window - len(pending)):
+                    pending.append((tile, executor.submit(self.load_tile, tile, canvas_mode, preset)))
+
+            try:
+                fill()
+                done = 0
+                while pending:
+                    tile, future = pending.popleft()
+                    img = future.result()
+                    # 先补充任务再贴图，贴图时线程池不空闲
+                    fill()
+                    yield tile, img
+                    done += 1
+                    if on_progress:
+                        on_progress(done, total)
+            finally:
+                for _, future in pending:
+                    future.cancel()
+
+    def merge(self, file_paths, mode, output_format, output_path, stream=None, preset=DEFAULT_RESAMPLE_PRESET,
+              max_cell=None, columns=None, on_progress=None):
+        """合并图片并保存到 output_path。stream 为 None 时按输出大小自动决定是否条带写出（仅PNG）；
+        preset 为 RESAMPLE_PRESETS 中的缩放方式，max_cell、columns 见 plan_layout，on_progress 见 iter_tiles"""
+        if preset not in RESAMPLE_PRESETS:
+            raise ValueError(f"不支持的缩放方式: {preset}")
+        layout = self.plan(file_paths, mode, max_cell, columns)
+        width, height = layout["width"], layout["height"]
+        self.log(f"输出尺寸: {width}×{height}，图片覆盖 {layout_coverage(layout):.0%}")
+
+        if output_format == "jpg":
+            if width > JPEG_MAX_SIDE or height > JPEG_MAX_SIDE:
+                raise ValueError(f"输出尺寸 {width}×{height} 超过JPG上限 {JPEG_MAX_SIDE}，请改用PNG输出")
+            stream = False
+        elif stream is None:
+            stream = width * height > self.stream_threshold
+
+        try:
+            if stream:
+                self.log("输出较大，使用条带方式写出PNG")
+                self.render_streaming(layout, output_path, preset, on_progress)
+            else:
+                canvas = self.render_canvas(layout, output_format, preset, on_progress)
+                canvas.save(output_path, **self.save_options(output_format))
+        except BaseException:
+            if os.path.exists(output_path):
+                os.remove(output_path)
+            raise
+        return output_path
+
+    @staticmethod
+    def save_options(output_format):
+        if output_format == "jpg":
+            return {"format": "JPEG", "quality": 100, "subsampling": 0}
+        return {"format": "PNG"}
+
+    def render_canvas(self, layout, output_format, preset=DEFAULT_RESAMPLE_PRESET, on_progress=None):
+        """在内存画布上逐张贴图"""
+        if output_format == "png":
+            canvas = Image.new('RGBA', (layout["width"], layout["height"]), (0, 0, 0, 0))
+        else:
+            canvas = Image.new('RGB', (layout["width"], layout["height"]), (255, 255, 255))
+        for tile, img in self.iter_tiles(layout["tiles"], canvas.mode, preset, on_progress):
+            canvas.paste(img, (tile["x"], tile["y"]))
+            img.close()
+        return canvas
+
+    def render_streaming(self, layout, output_path, preset=DEFAULT_RESAMPLE_PRESET, on_progress=None):
+        """把画布放在临时文件中（透明背景即全 0，未覆盖的区域不需要写入），
+        每张图片按行写入对应位置，最后按条带读出并压缩为 PNG"""
+        width, height = layout["width"], layout["height"]
+        bpp = len("RGBA")
+        stride = width * bpp
+        with tempfile.TemporaryFile(dir=self.scratch_dir) as raw:
+            raw.truncate(stride * height)
+            for tile, img in self.iter_tiles(layout["tiles"], "RGBA", preset, on_progress):
+                data = img.tobytes()
+                img.close()
+                row_bytes = tile["width"] * bpp
+                for row in range(tile["height"]):
+                    raw.seek((tile["y"] + row) * stride + tile["x"] * bpp)
+                    raw.write(data[row * row_bytes:(row + 1) * row_bytes])
+                del data
+
+            writer = PngStripWriter(output_path, width, height, "RGBA")
+            try:
+                raw.seek(0)
+                for top in range(0, height, BAND_HEIGHT):
+                    rows = min(BAND_HEIGHT, height - top)
+                    writer.write_band(Image.frombytes("RGBA", (width, rows), raw.read(rows * stride)))
+                writer.finish()
+            finally:
+                writer.close()
@@ -0,0 +1,125 @@
+import os
+import signal
+import threading
+import subprocess
+
+
+class JobCancelled(Exception):
+    """任务已被用户取消"""
+
+
+def popen_kwargs():
+    """启动子进程的平台参数：Windows 不弹出控制台窗口；其他系统放入独立进程组，便于整组结束"""
+    if os.name == 'nt':
+        return {"creationflags": getattr(subprocess, "CREATE_NO_WINDOW", 0)}
+    return {"start_new_session": True}
+
+
+def kill_process_tree(process):
+    """结束进程及其所有子进程"""
+    if process.poll() is not None:
+        return
+    try:
+        if os.name == 'nt':
+            subprocess.run(["taskkill", "/F", "/T", "/PID", str(process.pid)],
+                           capture_output=True, **popen_kwargs())
+        else:
+            os.killpg(process.pid, signal.SIGKILL)
+    except OSError:
+        pass
+    if process.poll() is None:
+        try:
+            process.kill()
+        except OSError:
+            pass
+
+
+class JobController:
+    """批量任务控制：跟踪所有启动的 ffmpeg 进程，支持取消、暂停和继续队列。
+
+    暂停只影响尚未开始的任务，正在运行的 ffmpeg 会继续完成；取消会立即结束所有子进程，
+    并删除登记过的未完成输出和临时文件。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._processes = set()
+        self._partial_files = set()
+        self._cancelled = threading.Event()
+        self._running = threading.Event()
+        self._running.set()
+
+    @property
+    def cancelled(self):
+        return self._cancelled.is_set()
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def reset(self):
+        """开始新的一批任务前调用"""
+        with self._lock:
+            self._processes.clear()
+            self._partial_files.clear()
+        self._cancelled.clear()
+        self._running.set()
+
+    def check_cancelled(self):
+        if self._cancelled.is_set():
+            raise JobCancelled("任务已取消")
+
+    def wait_if_paused(self):
+        """队列暂停时阻塞，直到继续或取消"""
+        while not self._running.wait(0.2):
+            if self._cancelled.is_set():
+                break
+        self.check_cancelled()
+
+    def pause(self):
+        self._running.clear()
+
+    def resume(self):
+        self._running.set()
+
+    def cancel(self):
+        self._cancelled.set()
+        self._running.set()
+        with self._lock:
+            processes = list(self._processes)
+        for process in processes:
+            kill_process_tree(process)
+        self.cleanup_partial_files()
+
+    def register_process(self, process):
+        with self._lock:
+            self._processes.add(process)
+        # 注册前已经取消的情况
+        if self._cancelled.is_set():
+            kill_process_tree(process)
+
+    def unregister_process(self, process):
+        with self._lock:
+            self._processes.discard(process)
+
+    def track_partial_file(self, path):
+        """登记未完成的输出或临时文件，取消时删除"""
+        with self._lock:
+            self._partial_files.add(path)
+
+    def untrack_partial_file(self, path):
+        """输出已完整写入，不再需要清理"""
+        with self._lock:
+            self._partial_files.discard(path)
+
+    def cleanup_partial_files(self):
+        """删除登记的文件；删除失败的（如 Windows 上进程尚未完全退出）保留登记，可再次调用重试"""
+        with self._lock:
+            paths = list(self._partial_files)
+        for path in paths:
+            try:
+                if os.path.exists(path):
+                    os.remove(path)
+            except OSError:
+                continue
+            self.untrack_partial_file(path)
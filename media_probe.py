@@ -0,0 +1,307 @@
+import os
+import re
+import json
+import shutil
+import subprocess
+
+from app_cache import JsonCache, get_cache_dir, file_fingerprint
+
+HDR_TRANSFERS = ('smpte2084', 'arib-std-b67')
+HDR_PRIMARIES = ('bt2020',)
+DOLBY_AUDIO_CODECS = ('truehd', 'eac3')
+# 探测结果的字段有变化时加一，旧版本的缓存会重新探测
+PROBE_VERSION = 3
+
+
+def get_ffprobe_path(ffmpeg_path):
+    """根据 ffmpeg 路径推断同目录下的 ffprobe，找不到时返回 None"""
+    ffmpeg_dir = os.path.dirname(ffmpeg_path)
+    if ffmpeg_dir:
+        exe_name = "ffprobe.exe" if ffmpeg_path.lower().endswith(".exe") else "ffprobe"
+        candidate = os.path.join(ffmpeg_dir, exe_name)
+        return candidate if os.path.exists(candidate) else None
+    return shutil.which("ffprobe")
+
+
+def parse_frame_rate(value):
+    """解析 '30000/1001' 或 '25' 形式的帧率"""
+    if not value:
+        return None
+    try:
+        if '/' in value:
+            num, den = value.split('/', 1)
+            return float(num) / float(den) if float(den) else None
+        return float(value)
+    except ValueError:
+        return None
+
+
+def parse_ffprobe_json(data):
+    """把 ffprobe -print_format json 的输出整理为统一的探测结果"""
+    fmt = data.get("format", {})
+    streams = []
+    for s in data.get("streams", []):
+        side_data = s.get("side_data_list") or []
+        streams.append({
+            "index": s.get("index"),
+            "codec_type": s.get("codec_type"),
+            "codec_name": s.get("codec_name"),
+            "profile": s.get("profile"),
+            "level": s.get("level"),
+            # 编码器私有数据（H.264 的 SPS/PPS 等）的校验值，流复制拼接时必须一致
+            "extradata_hash": s.get("extradata_hash"),
+            "width": s.get("width"),
+            "height": s.get("height"),
+            "pix_fmt": s.get("pix_fmt"),
+            "color_range": s.get("color_range"),
+            "color_space": s.get("color_space"),
+            "color_primaries": s.get("color_primaries"),
+            "color_transfer": s.get("color_transfer"),
+            "fps": parse_frame_rate(s.get("avg_frame_rate")) or parse_frame_rate(s.get("r_frame_rate")),
+            "time_base": s.get("time_base") if s.get("codec_type") == "video" else None,
+            "sample_rate": int(s["sample_rate"]) if s.get("sample_rate") else None,
+            "channel_layout": s.get("channel_layout"),
+            "dolby_vision": any("dovi" in str(sd.get("side_data_type", "")).lower() for sd in side_data),
+            "creation_time": (s.get("tags") or {}).get("creation_time")
+        })
+
+    duration = fmt.get("duration")
+    return {
+        "format_name": fmt.get("format_name"),
+        "duration": float(duration) if duration else None,
+        "bit_rate": int(fmt["bit_rate"]) if fmt.get("bit_rate") else None,
+        "creation_time": (fmt.get("tags") or {}).get("creation_time"),
+        "streams": streams
+    }
+
+
+def parse_ffmpeg_banner(text):
+    """ffprobe 不可用时，解析 `ffmpeg -i` 输出的文本信息"""
+    info = {"format_name": None, "duration": None, "bit_rate": None, "creation_time": None, "streams": []}
+
+    match = re.search(r"Input #0, ([^ ]+), from", text)
+    if match:
+        info["format_name"] = match.group(1).rstrip(',')
+
+    match = re.search(r"Duration: (\d+):(\d+):(\d+(?:\.\d+)?)", text)
+    if match:
+        h, m, s = match.groups()
+        info["duration"] = int(h) * 3600 + int(m) * 60 + float(s)
+
+    match = re.search(r"Duration:.*?bitrate: (\d+) kb/s", text)
+    if match:
+        info["bit_rate"] = int(match.group(1)) * 1000
+
+    match = re.search(r"creation_time\s*:\s*(\S+)", text)
+    if match:
+        info["creation_time"] = match.group(1)
+
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        match = re.match(r"\s*Stream #0:(\d+)\S*: (Video|Audio|Subtitle|Data|Attachment): (.*)", line)
+        if not match:
+            continue
+        index, codec_type, rest = match.groups()
+        codec_match = re.match(r"(\w+)(?: \(([^)]*)\))?", rest)
+        stream = {
+            "index": int(index),
+            "codec_type": codec_type.lower(),
+            "codec_name": codec_match.group(1) if codec_match else None,
+            "profile": codec_match.group(2) if codec_match else None,
+            "level": None,
+            "extradata_hash": None,
+            "width": None,
+            "height": None,
+            "pix_fmt": None,
+            "color_range": None,
+            "color_space": None,
+            "color_primaries": None,
+            "color_transfer": None,
+            "fps": None,
+            "time_base": None,
+            "sample_rate": None,
+            "channel_layout": None,
+            "dolby_vision": False,
+            "creation_time": None
+        }
+
+        if codec_type == "Video":
+            # 例: yuv420p10le(tv, bt2020nc/bt2020/smpte2084), 3840x2160 [SAR 1:1 DAR 16:9], 23.98 fps
+            pix_match = re.search(r", (\w+)(?:\(([^)]*)\))?, (\d+)x(\d+)", rest)
+            if pix_match:
+                stream["pix_fmt"] = pix_match.group(1)
+                stream["width"] = int(pix_match.group(3))
+                stream["height"] = int(pix_match.group(4))
+                for part in (pix_match.group(2) or "").split(','):
+                    part = part.strip()
+                    if part in ("tv", "pc"):
+                        stream["color_range"] = part
+                    elif '/' in part:
+                        space, primaries, transfer = (part.split('/') + [None, None])[:3]
+                        stream["color_space"] = space
+                        stream["color_primaries"] = primaries
+                        stream["color_transfer"] = transfer
+                    elif part.startswith("bt") or part.startswith("smpte"):
+                        # 三者相同时 ffmpeg 只输出一个值
+                        stream["color_space"] = stream["color_primaries"] = stream["color_transfer"] = part
+            fps_match = re.search(r"([\d.]+)(k?) fps", rest)
+            if fps_match:
+                stream["fps"] = float(fps_match.group(1)) * (1000 if fps_match.group(2) else 1)
+            tbn_match = re.search(r"([\d.]+)(k?) tbn", rest)
+            if tbn_match:
+                stream["time_base"] = f"1/{int(float(tbn_match.group(1)) * (1000 if tbn_match.group(2) else 1))}"
+        elif codec_type == "Audio":
+            # 例: aac (LC) (mp4a / 0x6134706D), 48000 Hz, stereo, fltp, 128 kb/s
+            audio_match = re.search(r"(\d+) Hz, ([^,]+)", rest)
+            if audio_match:
+                stream["sample_rate"] = int(audio_match.group(1))
+                stream["channel_layout"] = audio_match.group(2).strip()
+
+        # 流的附加信息（Metadata/Side data）缩进更深，直到下一个 Stream 行为止
+        for extra in lines[i + 1:]:
+            if re.match(r"\s*Stream #", extra) or not extra.startswith("    "):
+                break
+            lowered = extra.lower()
+            if "dovi" in lowered or "dolby vision" in lowered:
+                stream["dolby_vision"] = True
+            if "creation_time" in lowered and stream["creation_time"] is None:
+                stream["creation_time"] = extra.split(':', 1)[1].strip()
+
+        info["streams"].append(stream)
+
+    return info
+
+
+def video_stream(info):
+    """返回第一个视频流，没有则返回 None"""
+    for stream in info.get("streams", []):
+        if stream["codec_type"] == "video":
+            return stream
+    return None
+
+
+def is_hdr(info):
+    stream = video_stream(info)
+    if not stream:
+        return False
+    return (stream["color_transfer"] in HDR_TRANSFERS
+            or stream["color_primaries"] in HDR_PRIMARIES
+            or stream["dolby_vision"])
+
+
+def has_dolby_audio(info):
+    for stream in info.get("streams", []):
+        if stream["codec_type"] != "audio":
+            continue
+        profile = (stream.get("profile") or "").lower()
+        if stream["codec_name"] in DOLBY_AUDIO_CODECS or "atmos" in profile:
+            return True
+    return False
+
+
+class MediaProber:
+    """每个文件只探测一次，结果按 路径+大小+修改时间 持久化缓存"""
+
+    def __init__(self, ffmpeg_path, cache_path=None):
+        self.ffmpeg_path = ffmpeg_path
+        self.ffprobe_path = get_ffprobe_path(ffmpeg_path)
+        if cache_path is None:
+            cache_path = os.path.join(get_cache_dir(), "media_probe.json")
+        self.cache = JsonCache(cache_path)
+
+    def probe(self, video_file):
+        fingerprint = file_fingerprint(video_file)
+        key = fingerprint["path"]
+        cached = self.cache.get(key)
+        if (cached and cached.get("size") == fingerprint["size"]
+                and cached.get("mtime_ns") == fingerprint["mtime_ns"]
+                and cached.get("version") == PROBE_VERSION):
+            return cached["info"]
+
+        info = self._run_probe(key)
+        self.cache.set(key, dict(fingerprint, info=info, version=PROBE_VERSION))
+        return info
+
+    def get_decision(self, video_file, name, compute):
+        """按文件缓存由探测结果推导出的判断（如是否HDR），文件不变时直接返回上次的结果"""
+        info = self.probe(video_file)
+        key = os.path.abspath(video_file)
+        entry = self.cache.get(key)
+        decisions = entry.get("decisions", {})
+        if name not in decisions:
+            decisions = dict(decisions, **{name: compute(info)})
+            self.cache.set(key, dict(entry, decisions=decisions))
+        return decisions[name]
+
+    def keyframe_times(self, video_file, start=0, window=30):
+        """返回 start 之前最近的关键帧到 start+window 之间所有关键帧的时间（相对文件开头，秒）。
+
+        只解码这一小段里的关键帧，不需要扫描整个文件。
+        """
+        # -noaccurate_seek 保留 start 之前的那个关键帧，其时间为负数（相对 start）
+        cmd = [
+            self.ffmpeg_path, "-hide_banner", "-noaccurate_seek",
+            "-skip_frame", "nokey", "-ss", f"{start:.3f}", "-i", video_file,
+            "-t", f"{window:.3f}", "-map", "0:v:0", "-vf", "showinfo", "-f", "null", "-"
+        ]
+        result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
+        return [round(start + float(t), 6) for t in re.findall(r"pts_time:(-?[\d.]+)", result.stderr)]
+
+    def reorder_delay(self, video_file):
+        """视频关键帧的 pts 与 dts 之差（秒，有B帧时大于0），按文件缓存。
+
+        流复制裁剪时 concat 的 outpoint 按 dts 比较，需要减去这个差值才能在关键帧处准确断开。
+        """
+        return self.get_decision(video_file, "reorder_delay",
+                                 lambda info: self._read_reorder_delay(os.path.abspath(video_file)))
+
+    def _read_reorder_delay(self, video_path):
+        # framecrc 每行为: 流序号, dts, pts, 时长, 大小, 校验值[, 标志]；第一个数据包是关键帧
+        cmd = [self.ffmpeg_path, "-hide_banner", "-v", "error", "-i", video_path,
+               "-map", "0:v:0", "-c", "copy", "-frames:v", "1", "-f", "framecrc", "-"]
+        result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
+        time_base = re.search(r"#tb 0: (\d+)/(\d+)", result.stdout)
+        packet = re.search(r"^0,\s*(-?\d+),\s*(-?\d+),", result.stdout, re.MULTILINE)
+        if not time_base or not packet:
+            return 0.0
+        num, den = int(time_base.group(1)), int(time_base.group(2))
+        return max(0, int(packet.group(2)) - int(packet.group(1))) * num / den
+
+    def x264_options(self, video_file):
+        """x264 编码的视频在第一个数据包的 SEI 中记录了编码参数，返回 {参数名: 值}，其他编码器返回 {}，按文件缓存。
+
+        重新编码部分片段时据此使用与原视频相同的参数，生成相同的 SPS/PPS，才能与原视频直接复制拼接。
+        """
+        return self.get_decision(video_file, "x264_options",
+                                 lambda info: self._read_x264_options(os.path.abspath(video_file)))
+
+    def _read_x264_options(self, video_path):
+        cmd = [self.ffmpeg_path, "-hide_banner", "-v", "error", "-i", video_path,
+               "-map", "0:v:0", "-c", "copy", "-frames:v", "1", "-f", "data", "-"]
+        result = subprocess.run(cmd, capture_output=True)
+        match = re.search(rb"x264 - core \d+.*? options: ([^\x00]*)", result.stdout, re.DOTALL)
+        if not match:
+            return {}
+        items = match.group(1).decode("ascii", errors="ignore").split()
+        return dict(item.split("=", 1) for item in items if "=" in item)
+
+    def _run_probe(self, video_path):
+        if self.ffprobe_path:
+            cmd = [
+                self.ffprobe_path, "-v", "error",
+                "-print_format", "json",
+                "-show_format", "-show_streams",
+                # 输出 extradata_hash，用于判断参数集是否相同
+                "-show_data_hash", "CRC32",
+                video_path
+            ]
+            result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
+            if result.returncode == 0:
+                return parse_ffprobe_json(json.loads(result.stdout or "{}"))
+
+        cmd = [self.ffmpeg_path, "-hide_banner", "-i", video_path]
+        result = subprocess.run(cmd, capture_output=True, text=True, encoding='utf-8', errors='ignore')
+        return parse_ffmpeg_banner(result.stderr)
+
+    def save(self):
+        self.cache.save()
@@ -0,0 +1,725 @@
+import os
+import json
+import errno
+import math
+import time
+import uuid
+import shutil
+import hashlib
+import threading
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from app_cache import get_cache_dir, quick_file_hash
+from ffmpeg_runner import run_ffmpeg, format_seconds
+from job_controller import JobController
+from media_probe import MediaProber, video_stream
+from natural_sort import sort_paths, parse_timestamp
+
+# 重新编码时可以生成的格式及对应编码器，目标格式不在其中时统一转为 H.264/AAC
+VIDEO_ENCODERS = {"h264": "libx264", "hevc": "libx265", "mpeg4": "mpeg4"}
+AUDIO_ENCODERS = {"aac": "aac", "mp3": "libmp3lame", "ac3": "ac3", "opus": "libopus"}
+DEFAULT_VIDEO_CODEC = "h264"
+DEFAULT_AUDIO_CODEC = "aac"
+PROBE_WORKERS = 8
+# 转码参数有变化时加一，旧的缓存片段不再使用
+NORMALIZE_VERSION = 2
+# 转码片段缓存的容量上限，超出后删除最久未使用的片段
+SEGMENT_CACHE_MAX_BYTES = 20 * 1024 ** 3
+# 片段很多时每次 concat 最多拼接的文件数，超出后先分组拼接再合并各组结果
+CONCAT_GROUP_SIZE = 200
+# 逐个列出片段的日志最多显示的条数
+LOG_DETAIL_LIMIT = 20
+# 裁剪时在入点之后查找关键帧的最大范围（秒）
+KEYFRAME_SEARCH_WINDOW = 30
+
+# 影响 H.264 参数集（SPS/PPS）的 x264 参数。重新编码的片段要与直接复制的片段拼接时，
+# 从原视频记录的 x264 参数中取这些项（及码率控制方式），生成的参数集才会相同
+X264_HEADER_OPTIONS = ("cabac", "ref", "8x8dct", "bframes", "b_pyramid", "weightp", "weightb", "direct",
+                       "constrained_intra", "bluray_compat", "open_gop", "chroma_qp_offset")
+# ffprobe 的档次名称与编码器 -profile:v 参数的对应关系
+X264_PROFILES = {"Constrained Baseline": "baseline", "Baseline": "baseline", "Main": "main", "High": "high",
+                 "High 10": "high10", "High 4:2:2": "high422", "High 4:4:4 Predictive": "high444"}
+X265_PROFILES = {"Main": "main", "Main 10": "main10", "Main Still Picture": "mainstillpicture"}
+
+# 流复制拼接要求这些参数全部一致
+SIGNATURE_FIELDS = {
+    "video_codec": "视频编码",
+    "video_profile": "编码档次",
+    "video_level": "编码级别",
+    "video_extradata": "参数集(SPS/PPS)",
+    "width": "宽度",
+    "height": "高度",
+    "pix_fmt": "像素格式",
+    "fps": "帧率",
+    "time_base": "时间基",
+    "audio_codec": "音频编码",
+    "sample_rate": "采样率",
+    "channel_layout": "声道"
+}
+
+
+def audio_stream(info):
+    """返回第一个音频流，没有则返回 None"""
+    for stream in info.get("streams", []):
+        if stream["codec_type"] == "audio":
+            return stream
+    return None
+
+
+def stream_signature(info):
+    """决定能否直接 -c copy 拼接的流参数。
+
+    mp4 中整条视频轨只有一份参数集（如 H.264 的 avcC），档次、级别或 SPS/PPS 不同的片段
+    即使分辨率和帧率相同，复制拼接后也可能无法解码，所以一并比较。
+    """
+    video = video_stream(info) or {}
+    audio = audio_stream(info) or {}
+    return {
+        "video_codec": video.get("codec_name"),
+        "video_profile": video.get("profile"),
+        "video_level": video.get("level"),
+        "video_extradata": video.get("extradata_hash"),
+        "width": video.get("width"),
+        "height": video.get("height"),
+        "pix_fmt": video.get("pix_fmt"),
+        "fps": round(video["fps"], 2) if video.get("fps") else None,
+        "time_base": video.get("time_base"),
+        "audio_codec": audio.get("codec_name"),
+        "sample_rate": audio.get("sample_rate"),
+        "channel_layout": audio.get("channel_layout")
+    }
+
+
+def build_target_profile(signatures, durations):
+    """选出总时长最长的一组参数作为目标，尽量让更多内容保持无损复制。
+
+    有任意输入带音频时目标一定带音频；目标编码无法重新生成时改用 H.264/AAC。
+    """
+    require_audio = any(sig["audio_codec"] for sig in signatures)
+    totals = Counter()
+    for sig, duration in zip(signatures, durations):
+        if sig["audio_codec"] or not require_audio:
+            totals[tuple(sorted(sig.items()))] += duration or 0
+    profile = dict(max(totals, key=totals.get))
+
+    if profile["video_codec"] not in VIDEO_ENCODERS:
+        # 换用其他编码后原来的档次、级别和参数集都不再适用
+        profile.update(video_codec=DEFAULT_VIDEO_CODEC, video_profile=None, video_level=None,
+                       video_extradata=None)
+    if profile["audio_codec"] and profile["audio_codec"] not in AUDIO_ENCODERS:
+        profile["audio_codec"] = DEFAULT_AUDIO_CODEC
+    return profile
+
+
+def build_video_encoder_args(profile, x264_options=None):
+    """重新编码视频的编码器参数：档次和级别取目标参数；目标是 x264 编码时（x264_options 为原视频
+    记录的参数）沿用影响参数集的设置和码率控制方式，使重新编码的片段可以与原视频复制拼接"""
+    encoder = VIDEO_ENCODERS[profile["video_codec"]]
+    args = ["-c:v", encoder]
+    if encoder == "libx264":
+        args.extend(["-preset", "veryfast"])
+        if X264_PROFILES.get(profile.get("video_profile")):
+            args.extend(["-profile:v", X264_PROFILES[profile["video_profile"]]])
+        if profile.get("video_level"):
+            args.extend(["-level", f"{profile['video_level'] / 10:g}"])
+        options = x264_options or {}
+        params = [f"{key}={options[key]}" for key in X264_HEADER_OPTIONS if key in options]
+        if options.get("interlaced") in ("tff", "bff"):
+            params.append(f"{options['interlaced']}=1")
+        # PPS 中的初始量化参数由码率控制方式决定
+        rc = options.get("rc")
+        if rc == "crf" and "crf" in options:
+            params.append(f"crf={options['crf']}")
+        elif rc == "cqp" and "qp" in options:
+            params.append(f"qp={options['qp']}")
+        elif rc in ("abr", "cbr", "2pass") and "bitrate" in options:
+            params.append(f"bitrate={options['bitrate']}")
+        else:
+            args.extend(["-crf", "18"])
+        if params:
+            args.extend(["-x264-params", ":".join(params)])
+    elif encoder == "libx265":
+        args.extend(["-preset", "veryfast", "-crf", "18"])
+        if X265_PROFILES.get(profile.get("video_profile")):
+            args.extend(["-profile:v", X265_PROFILES[profile["video_profile"]]])
+    else:
+        args.extend(["-q:v", "2"])
+    return args
+
+
+def describe_mismatch(signature, profile):
+    """列出与目标不一致的参数，用于日志"""
+    return [f"{SIGNATURE_FIELDS[key]} {signature[key]} → {profile[key]}"
+            for key in SIGNATURE_FIELDS if signature[key] != profile[key]]
+
+
+def segment_cache_key(video_file, profile, trim=None, encoder_args=None):
+    """转码片段的缓存键：输入内容摘要 + 目标参数 + 裁剪范围 + 编码器参数，同一片段换顺序或改名后仍能命中"""
+    key_data = json.dumps({
+        "content": quick_file_hash(video_file),
+        "profile": profile,
+        "trim": trim,
+        "encoder": encoder_args,
+        "version": NORMALIZE_VERSION
+    }, sort_keys=True)
+    return hashlib.sha1(key_data.encode('utf-8')).hexdigest()
+
+
+def prune_segment_cache(cache_dir, max_bytes=SEGMENT_CACHE_MAX_BYTES):
+    """缓存超过上限时按最近使用时间删除旧片段"""
+    entries = []
+    for name in os.listdir(cache_dir):
+        path = os.path.join(cache_dir, name)
+        if name.endswith(".mp4") and os.path.isfile(path):
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, stat.st_size, path))
+    total = sum(size for _, size, _ in entries)
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+        try:
+            os.remove(path)
+            total -= size
+        except OSError:
+            pass
+
+
+def build_concat_list(entries):
+    """生成 concat 分离器的文件列表文本。
+
+    每项是文件路径，或 {"path", "inpoint", "outpoint", "duration"} 字典（后三项可选），
+    inpoint/outpoint 用于流复制裁剪，duration 用于指定片段时长，避免音视频长度不一致造成空隙。
+    """
+    lines = []
+    for entry in entries:
+        if isinstance(entry, str):
+            entry = {"path": entry}
+        # Windows路径需要转换为正斜杠（先转换，否则会破坏下面转义单引号用的反斜杠）
+        safe_path = os.path.abspath(entry["path"]).replace("\\", "/")
+        # 转义文件名中的特殊字符
+        safe_path = safe_path.replace("'", "'\\''")
+        # 列表经管道传入时相对路径会按 pipe: 解析，需写成带 file: 前缀的绝对路径
+        lines.append(f"file 'file:{safe_path}'\n")
+        for key in ("inpoint", "outpoint", "duration"):
+            if entry.get(key) is not None:
+                lines.append(f"{key} {entry[key]:.6f}\n")
+    return "".join(lines)
+
+
+def partial_output_path(directory):
+    """目录下唯一的临时输出文件名，多个合并同时进行时互不冲突"""
+    return os.path.join(directory, f".merge_{uuid.uuid4().hex}.partial.mp4")
+
+
+def reserve_output_path(directory, name, ext=".mp4"):
+    """用 O_CREAT|O_EXCL 创建空的占位文件占用输出文件名，已存在时依次尝试 name_1、name_2……，返回占用的路径。
+
+    合并完成前最终文件还不存在，只检查文件是否存在挡不住同时进行的合并选到同一个名字；
+    占位文件由 move_into_place(reserved=True) 替换，合并失败时用 release_output_path 删除。
+    """
+    counter = 0
+    while True:
+        path = os.path.join(directory, f"{name}_{counter}{ext}" if counter else f"{name}{ext}")
+        try:
+            os.close(os.open(path, os.O_CREAT | os.O_EXCL | os.O_WRONLY))
+            return path
+        except FileExistsError:
+            counter += 1
+
+
+def release_output_path(path):
+    """删除仍为空的占位文件（合并失败或取消时）"""
+    try:
+        if os.path.getsize(path) == 0:
+            os.remove(path)
+    except OSError:
+        pass
+
+
+def place_file(src, dst, replace=False):
+    """同一磁盘内移动文件。replace 为 False 时目标已存在则抛出 FileExistsError，检查和移动是同一个原子操作；
+    跨磁盘时抛出 OSError(EXDEV)"""
+    if replace:
+        os.replace(src, dst)
+    elif os.name == "nt":
+        # Windows 下目标已存在时 rename 失败
+        os.rename(src, dst)
+    else:
+        try:
+            # 目标已存在时 link 失败
+            os.link(src, dst)
+        except FileExistsError:
+            raise
+        except OSError as e:
+            if e.errno == errno.EXDEV:
+                raise
+            # 不支持硬链接的文件系统（如 exFAT）只能先检查再移动
+            if os.path.exists(dst):
+                raise FileExistsError(errno.EEXIST, "输出文件已存在", dst)
+            os.rename(src, dst)
+            return
+        os.remove(src)
+
+
+def move_into_place(src, dst, controller=None, reserved=False):
+    """把临时输出移动到最终位置，不覆盖已有文件（目标已存在时抛出 FileExistsError）。
+
+    reserved 为 True 表示 dst 是 reserve_output_path 创建的占位文件，只有它仍为空时才替换。
+    同一磁盘直接移动；跨磁盘时先复制到目标目录的临时文件再移动，目标路径上不会出现写了一半的文件。
+    """
+    if reserved and os.path.exists(dst) and os.path.getsize(dst) > 0:
+        raise FileExistsError(errno.EEXIST, "输出文件已存在", dst)
+    try:
+        place_file(src, dst, replace=reserved)
+        return
+    except FileExistsError:
+        raise
+    except OSError:
+        if not os.path.exists(src):
+            raise
+    tmp_path = partial_output_path(os.path.dirname(os.path.abspath(dst)))
+    if controller:
+        controller.track_partial_file(tmp_path)
+    try:
+        shutil.copyfile(src, tmp_path)
+        place_file(tmp_path, dst, replace=reserved)
+        os.remove(src)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        if controller:
+            controller.untrack_partial_file(tmp_path)
+
+
+def fps_expression(fps):
+    """把 29.97 这类近似值还原为 30000/1001，避免重新编码后帧率出现偏差"""
+    for base in (24, 30, 60):
+        if abs(fps - base * 1000 / 1001) < 0.01:
+            return f"{base * 1000}/1001"
+    return f"{fps:g}"
+
+
+class VideoMergeEngine:
+    """视频合并核心：预检各输入的流参数，只对不兼容的片段重新编码，最后统一流复制拼接"""
+
+    def __init__(self, ffmpeg_path, prober=None, controller=None, log=print, cache_dir=None, cpu_count=None):
+        self.ffmpeg_path = ffmpeg_path
+        self.prober = prober or MediaProber(ffmpeg_path)
+        self.controller = controller or JobController()
+        self.log = log
+        # 转码后的片段按内容缓存，再次合并相同片段时直接复用
+        self.cache_dir = cache_dir or get_cache_dir("merge_segments")
+        self.cpu_count = cpu_count or os.cpu_count() or 1
+
+    @property
+    def default_concurrency(self):
+        return max(1, min(8, self.cpu_count // 4))
+
+    def get_ffmpeg_threads(self, concurrency):
+        """按并行任务数平分CPU核心，避免多个ffmpeg进程争抢"""
+        return max(1, self.cpu_count // concurrency)
+
+    def probe_all(self, file_paths):
+        """并行探测（结果有缓存），返回与 file_paths 顺序一致的探测结果列表"""
+        try:
+            with ThreadPoolExecutor(max_workers=max(1, min(PROBE_WORKERS, len(file_paths)))) as executor:
+                return list(executor.map(self.prober.probe, file_paths))
+        finally:
+            self.prober.save()
+
+    def sort_files(self, file_paths, order="name"):
+        """按文件名自然顺序，或按容器记录的拍摄时间（creation_time）排序，没有时间的排在最后"""
+        get_time = None
+        if order == "time":
+            times = {}
+            for path, info in zip(file_paths, self.probe_all(file_paths)):
+                stream = video_stream(info) or {}
+                times[path] = parse_timestamp(info.get("creation_time") or stream.get("creation_time"))
+            get_time = times.get
+        return sort_paths(file_paths, order, get_time)
+
+    def build_trims(self, file_paths, head=0, tail=0):
+        """每个视频统一去掉开头 head 秒、结尾 tail 秒，返回 merge() 使用的 {路径: (入点, 出点)}"""
+        trims = {}
+        for path, info in zip(file_paths, self.probe_all(file_paths)):
+            duration = info.get("duration")
+            if tail and not duration:
+                raise Exception(f"无法获取视频时长，不能裁剪结尾: {os.path.basename(path)}")
+            trims[path] = (head, duration - tail if tail else None)
+        return trims
+
+    def preflight(self, file_paths, trims=None):
+        """并行探测所有输入并分组，返回 {"profile": 目标参数, "segments": [...]}。
+
+        每个片段包含 path、info、duration（裁剪后）、trim（(入点, 出点) 或 None）、
+        reencode（是否需要重新编码）和 reasons（不一致的参数）。
+        """
+        infos = self.probe_all(file_paths)
+
+        for path, info in zip(file_paths, infos):
+            if not video_stream(info):
+                raise Exception(f"无法读取视频流: {os.path.basename(path)}")
+
+        signatures = [stream_signature(info) for info in infos]
+        durations = [info.get("duration") for info in infos]
+        profile = build_target_profile(signatures, durations)
+
+        segments = []
+        for path, info, sig in zip(file_paths, infos, signatures):
+            reasons = describe_mismatch(sig, profile)
+            duration = info.get("duration")
+            trim = None
+            if trims and trims.get(path):
+                start, end = trims[path]
+                start = max(0.0, start or 0.0)
+                end = min(end, duration) if end and duration else (end or duration)
+                if end is not None and end <= start:
+                    raise Exception(f"裁剪后没有剩余内容: {os.path.basename(path)}")
+                if start > 0 or (end is not None and duration and end < duration):
+                    trim = (start, end)
+                    duration = end - start if end is not None else None
+            segments.append({
+                "path": path,
+                "info": info,
+                "duration": duration,
+                "trim": trim,
+                "reencode": bool(reasons),
+                "reasons": reasons
+            })
+        return {"profile": profile, "segments": segments}
+
+    def build_normalize_command(self, segment, output_path, profile, threads=None, encoder_args=None):
+        """把片段重新编码为目标参数：缩放加黑边保持比例，缺少音轨时补静音。
+        encoder_args 为视频编码器参数，默认由 build_video_encoder_args 生成"""
+        width, height = profile["width"], profile["height"]
+        filters = [
+            f"scale={width}:{height}:force_original_aspect_ratio=decrease",
+            f"pad={width}:{height}:(ow-iw)/2:(oh-ih)/2",
+            "setsar=1"
+        ]
+        if profile["fps"]:
+            filters.append(f"fps={fps_expression(profile['fps'])}")
+        if profile["pix_fmt"]:
+            filters.append(f"format={profile['pix_fmt']}")
+
+        cmd = [self.ffmpeg_path, "-y"]
+        if segment.get("trim"):
+            # 输入端 -ss 在重新编码时是逐帧精确的
+            cmd.extend(["-ss", f"{segment['trim'][0]:.6f}"])
+        cmd.extend(["-i", segment["path"]])
+        needs_silence = profile["audio_codec"] and not audio_stream(segment["info"])
+        if needs_silence:
+            cmd.extend(["-f", "lavfi", "-i",
+                        f"anullsrc=r={profile['sample_rate']}:cl={profile['channel_layout']}"])
+
+        if segment.get("trim") and segment["trim"][1] is not None:
+            cmd.extend(["-t", f"{segment['trim'][1] - segment['trim'][0]:.6f}"])
+        cmd.extend(["-map", "0:v:0", "-vf", ",".join(filters)])
+        cmd.extend(encoder_args or build_video_encoder_args(profile))
+        if threads:
+            # 多个片段并行转码时限制每个编码器的线程数
+            cmd.extend(["-threads", str(threads)])
+        if profile["time_base"]:
+            # mp4 的时间基由 track timescale 决定，保持一致才能无缝复制拼接
+            cmd.extend(["-video_track_timescale", profile["time_base"].split('/')[-1]])
+
+        if profile["audio_codec"]:
+            cmd.extend(["-map", "1:a:0" if needs_silence else "0:a:0",
+                        "-c:a", AUDIO_ENCODERS[profile["audio_codec"]],
+                        "-af", f"aformat=sample_rates={profile['sample_rate']}"
+                               f":channel_layouts={profile['channel_layout']}"])
+            if needs_silence:
+                cmd.append("-shortest")
+        else:
+            cmd.append("-an")
+
+        # 输出到临时文件名，需要显式指定容器
+        cmd.extend(["-f", "mp4", output_path])
+        return cmd
+
+    def normalize_segment(self, segment, profile, threads=None, on_progress=None, encoder_args=None):
+        """转码为目标参数（有 trim 时只转码该范围）并写入缓存，返回缓存片段路径；已有缓存时直接返回"""
+        cache_key = segment_cache_key(segment["path"], profile, segment.get("trim"), encoder_args)
+        cache_path = os.path.join(self.cache_dir, f"{cache_key}.mp4")
+        if os.path.exists(cache_path):
+            # 更新修改时间，清理缓存时按最近使用排序
+            os.utime(cache_path)
+            self.log(f"使用已缓存的转码片段: {os.path.basename(segment['path'])}")
+            return cache_path
+
+        # 先写临时文件，完成后原子替换，避免中断后留下不完整的缓存
+        tmp_path = f"{cache_path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        self.controller.track_partial_file(tmp_path)
+        try:
+            cmd = self.build_normalize_command(segment, tmp_path, profile, threads=threads,
+                                               encoder_args=encoder_args)
+            result = run_ffmpeg(cmd, duration=segment["duration"], on_progress=on_progress,
+                                controller=self.controller)
+            if result.returncode != 0:
+                raise Exception(f"转码 {os.path.basename(segment['path'])} 失败: {result.stderr[-500:]}")
+            os.replace(tmp_path, cache_path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            self.controller.untrack_partial_file(tmp_path)
+        return cache_path
+
+    def normalize_segments(self, jobs, profile, concurrency=None, on_progress=None, encoder_args=None):
+        """在线程池中并行转码，返回与 jobs 顺序一致的转码后路径列表"""
+        if not jobs:
+            return []
+        concurrency = max(1, min(concurrency or self.default_concurrency, len(jobs)))
+        threads = self.get_ffmpeg_threads(concurrency)
+
+        results = [None] * len(jobs)
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {}
+            for number, job in enumerate(jobs, start=1):
+                stage = f"转码 {number}/{len(jobs)}: {os.path.basename(job['path'])}"
+                callback = (lambda progress, stage=stage: on_progress(stage, progress)) if on_progress else None
+                futures[executor.submit(self.normalize_segment, job, profile, threads, callback,
+                                        encoder_args)] = number - 1
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except Exception:
+                    # 一个片段失败后不再启动排队中的转码
+                    executor.shutdown(wait=False, cancel_futures=True)
+                    raise
+        prune_segment_cache(self.cache_dir)
+        return results
+
+    def encoder_args_for(self, segments, profile):
+        """重新编码使用的编码器参数。目标为 H.264 时参照第一个直接复制的片段记录的 x264 参数，
+        转码片段才有机会生成与它相同的参数集"""
+        x264_options = None
+        if profile["video_codec"] == "h264":
+            reference = next((segment for segment in segments if not segment["reencode"]), None)
+            if reference:
+                x264_options = self.prober.x264_options(reference["path"])
+        return build_video_encoder_args(profile, x264_options)
+
+    def incompatible_outputs(self, paths, profile):
+        """返回档次、级别或参数集与目标不一致的转码结果；目标参数集未知（没有 ffprobe）时无法比较，视为一致"""
+        if not profile.get("video_extradata"):
+            return []
+        keys = ("video_profile", "video_level", "video_extradata")
+        return [path for path, info in zip(paths, self.probe_all(paths))
+                if any(stream_signature(info)[key] != profile[key] for key in keys)]
+
+    def plan_trim(self, segment, profile, accurate=False):
+        """流复制片段的裁剪方案，返回 [(类型, 内容)]：("copy", concat 列表项) 或 ("encode", 转码任务)。
+
+        流复制只能从关键帧开始。非精确模式把入点提前到之前最近的关键帧，整段流复制；
+        精确模式只重新编码入点到下一个关键帧、最后一个关键帧到出点这两段不完整的 GOP，
+        中间部分仍然流复制。
+        """
+        path = segment["path"]
+        fps = profile["fps"] or 25
+        half_frame = 0.5 / fps
+        start, end = segment["trim"]
+        # concat 的 outpoint 按 dts 比较，有B帧时要减去关键帧的 pts/dts 差值
+        delay = self.prober.reorder_delay(path)
+
+        def copy_entry(inpoint, outpoint):
+            return ("copy", {
+                "path": path,
+                "inpoint": inpoint if inpoint > 0 else None,
+                "outpoint": outpoint - delay if outpoint is not None else None,
+                "duration": (outpoint - inpoint) if outpoint is not None else None
+            })
+
+        def encode_job(job_start, job_end):
+            return ("encode", dict(segment, trim=(job_start, job_end),
+                                   duration=(job_end - job_start) if job_end is not None else None))
+
+        if accurate:
+            # 对齐到帧边界（保留显示时间在 [入点, 出点) 内的帧），转码段与流复制段之间不会重叠或留下空隙
+            start = math.ceil(start * fps - 1e-6) / fps
+            end = math.ceil(end * fps - 1e-6) / fps if end is not None else None
+
+        keyframes = self.prober.keyframe_times(
+            path, start, min(KEYFRAME_SEARCH_WINDOW, (end or start + KEYFRAME_SEARCH_WINDOW) - start) + half_frame)
+        before = [k for k in keyframes if k <= start + half_frame]
+        after = [k for k in keyframes if k > start + half_frame]
+        snapped = max(before[-1], 0.0) if before else 0.0
+
+        if not accurate:
+            if start - snapped > half_frame:
+                self.log(f"{os.path.basename(path)}: 入点 {start:.3f}s 对齐到关键帧 {snapped:.3f}s")
+            return [copy_entry(snapped, end)]
+
+        # 流复制部分从入点（刚好是关键帧时）或其后的第一个关键帧开始
+        copy_start = snapped if start - snapped <= half_frame else (after[0] if after else None)
+        # 到出点前最后一个关键帧结束，出点刚好是关键帧或到文件末尾时不需要转码结尾
+        copy_end = end
+        if end is not None and copy_start is not None:
+            tail_keyframes = [k for k in self.prober.keyframe_times(path, end, half_frame)
+                              if k <= end + half_frame]
+            if tail_keyframes and end - tail_keyframes[-1] > half_frame:
+                copy_end = tail_keyframes[-1]
+
+        if copy_start is None or (copy_end is not None and copy_end - copy_start <= half_frame):
+            # 整个范围在一个 GOP 内，直接转码
+            return [encode_job(start, end)]
+
+        parts = []
+        if copy_start - start > half_frame:
+            parts.append(encode_job(start, copy_start))
+        parts.append(copy_entry(copy_start, copy_end))
+        if end is not None and end - copy_end > half_frame:
+            parts.append(encode_job(copy_end, end))
+        return parts
+
+    def concat(self, file_paths, output_path, duration=None, on_progress=None, scratch_dir=None, reserved=False):
+        """流复制拼接，所有输入的流参数必须一致。
+
+        文件列表通过标准输入传给 ffmpeg，不在输入目录写任何文件；输出先写到 scratch_dir
+        （默认输出目录）下的唯一临时文件，完成后再移动到 output_path，同一文件夹可以同时进行多个合并。
+        output_path 已存在时不会覆盖，reserved 见 move_into_place。
+        """
+        tmp_path = partial_output_path(scratch_dir or os.path.dirname(os.path.abspath(output_path)))
+        self.controller.track_partial_file(tmp_path)
+        try:
+            command = [
+                self.ffmpeg_path,
+                "-f", "concat",
+                "-safe", "0",
+                # 列表来自管道，需要允许其中引用本地文件
+                "-protocol_whitelist", "file,pipe",
+                "-i", "pipe:0",
+                "-c", "copy",  # 直接复制流，不重新编码
+                "-y",  # 覆盖输出文件
+                tmp_path
+            ]
+            self.log(f"命令: {' '.join(command)}")
+            result = run_ffmpeg(command, duration=duration, on_progress=on_progress,
+                                controller=self.controller, input_data=build_concat_list(file_paths))
+            if result.returncode != 0:
+                self.log(result.stderr)
+                raise Exception(f"视频合并失败，返回码: {result.returncode}")
+            move_into_place(tmp_path, output_path, controller=self.controller, reserved=reserved)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            self.controller.untrack_partial_file(tmp_path)
+
+    def concat_hierarchical(self, file_paths, durations, output_path, on_progress=None, scratch_dir=None,
+                            group_size=CONCAT_GROUP_SIZE, reserved=False):
+        """片段数量超过 group_size 时分层拼接：每组先拼成中间文件，再拼接各组结果，直到一次可以完成"""
+        work_dir = scratch_dir or os.path.dirname(os.path.abspath(output_path))
+        intermediates = []
+        level = 1
+        try:
+            while len(file_paths) > group_size:
+                groups = [(file_paths[i:i + group_size], durations[i:i + group_size])
+                          for i in range(0, len(file_paths), group_size)]
+                self.log(f"第 {level} 层: {len(file_paths)} 个文件分为 {len(groups)} 组拼接")
+                next_paths, next_durations = [], []
+                for number, (group_paths, group_durations) in enumerate(groups, start=1):
+                    group_output = partial_output_path(work_dir)
+                    intermediates.append(group_output)
+                    self.controller.track_partial_file(group_output)
+                    group_duration = sum(group_durations) if all(group_durations) else None
+                    stage = f"第 {level} 层合并 {number}/{len(groups)}"
+                    self.concat(group_paths, group_output, duration=group_duration, scratch_dir=work_dir,
+                                on_progress=(lambda progress, stage=stage: on_progress(stage, progress))
+                                if on_progress else None)
+                    next_paths.append(group_output)
+                    next_durations.append(group_duration)
+                file_paths, durations = next_paths, next_durations
+                level += 1
+
+            total_duration = sum(durations) if all(durations) else None
+            self.concat(file_paths, output_path, duration=total_duration, scratch_dir=scratch_dir,
+                        reserved=reserved, on_progress=(lambda progress: on_progress("合并", progress)) if on_progress else None)
+        finally:
+            for path in intermediates:
+                if os.path.exists(path):
+                    os.remove(path)
+                self.controller.untrack_partial_file(path)
+
+    def merge(self, file_paths, output_path, on_progress=None, concurrency=None, scratch_dir=None,
+              trims=None, accurate_trim=False, reserved=False):
+        """按给定顺序合并视频。on_progress(阶段说明, 进度字典) 在工作线程中调用。
+        scratch_dir 为合并时写临时输出的目录（如更快的本地磁盘），完成后移动到 output_path；
+        output_path 已存在时不会覆盖，用 reserve_output_path 占用的文件名时 reserved 为 True。
+        trims 为 {路径: (入点秒, 出点秒或None)}；accurate_trim 为 False 时入点对齐到关键帧，
+        为 True 时只重新编码入点处不完整的 GOP，保证逐帧精确。
+
+        返回预检结果，调用方可据此显示哪些片段被重新编码；plan["stats"] 为片段数、数据量和吞吐量。
+        """
+        start_time = time.monotonic()
+        plan = self.preflight(file_paths, trims)
+        segments = plan["segments"]
+        profile = plan["profile"]
+        reencode = [segment for segment in segments if segment["reencode"]]
+        if reencode:
+            self.log(f"目标参数: {profile['video_codec']} {profile['width']}x{profile['height']} "
+                     f"{profile['fps']}fps {profile['audio_codec'] or '无音频'}")
+            for segment in reencode[:LOG_DETAIL_LIMIT]:
+                self.log(f"需要重新编码 {os.path.basename(segment['path'])}: {'，'.join(segment['reasons'])}")
+            if len(reencode) > LOG_DETAIL_LIMIT:
+                self.log(f"……共 {len(reencode)} 个片段需要重新编码")
+        else:
+            self.log("所有视频流参数一致，直接无损拼接")
+
+        # 每个片段拆成若干 concat 列表项：流复制（可带入点/出点）或先转码再拼接
+        parts = []
+        for segment in segments:
+            if segment["reencode"]:
+                parts.append(("encode", segment))
+            elif segment["trim"]:
+                parts.extend(self.plan_trim(segment, profile, accurate=accurate_trim))
+            else:
+                parts.append(("copy", segment["path"]))
+
+        encoder_args = self.encoder_args_for(segments, profile)
+        jobs = [content for kind, content in parts if kind == "encode"]
+        encoded = self.normalize_segments(jobs, profile, concurrency=concurrency, on_progress=on_progress,
+                                          encoder_args=encoder_args)
+        if encoded and any(kind == "copy" for kind, _ in parts):
+            # mp4 的视频轨只有一份参数集，转码片段的参数集与直接复制的片段不同时不能混合拼接，
+            # 改为全部按相同参数重新编码（已转码的片段在缓存中，不会重复转码）
+            mismatched = self.incompatible_outputs(encoded, profile)
+            if mismatched:
+                self.log(f"{len(mismatched)} 个转码片段的参数集与原视频不同，无法与直接复制的片段拼接，改为全部重新编码")
+                for segment in segments:
+                    if not segment["reencode"]:
+                        segment["reencode"] = True
+                        segment["reasons"] = ["参数集无法与转码片段保持一致"]
+                parts = [("encode", segment) for segment in segments]
+                encoded = self.normalize_segments(segments, profile, concurrency=concurrency,
+                                                  on_progress=on_progress, encoder_args=encoder_args)
+        encoded = iter(encoded)
+        durations = {segment["path"]: segment["duration"] for segment in segments}
+        concat_entries, entry_durations = [], []
+        for kind, content in parts:
+            if kind == "encode":
+                # 转码结果的音频可能比视频略长，指定时长避免下一段前出现空隙
+                concat_entries.append({"path": next(encoded), "duration": content["duration"]})
+                entry_durations.append(content["duration"])
+            elif isinstance(content, dict):
+                concat_entries.append(content)
+                entry_durations.append(content["duration"])
+            else:
+                concat_entries.append(content)
+                entry_durations.append(durations[content])
+
+        self.log("开始合并视频...")
+        self.concat_hierarchical(concat_entries, entry_durations, output_path,
+                                 on_progress=on_progress, scratch_dir=scratch_dir, reserved=reserved)
+
+        elapsed = max(time.monotonic() - start_time, 0.001)
+        total_bytes = sum(os.path.getsize(segment["path"]) for segment in segments)
+        plan["stats"] = {
+            "clips": len(segments),
+            "bytes": total_bytes,
+            "elapsed": elapsed,
+            "clips_per_second": len(segments) / elapsed,
+            "mb_per_second": total_bytes / 1024 ** 2 / elapsed
+        }
+        self.log(f"共 {len(segments)} 个片段，{total_bytes / 1024 ** 2:.1f} MB，用时 {format_seconds(elapsed)}，"
+                 f"吞吐量 {plan['stats']['clips_per_second']:.1f} 个/秒，{plan['stats']['mb_per_second']:.1f} MB/秒")
+        return plan
@@ -0,0 +1,64 @@
+import os
+import re
+from datetime import datetime, timezone
+
+_DIGITS = re.compile(r'\d+')
+
+SORT_ORDERS = ("name", "time")
+
+
+def _encode_number(match):
+    digits = match.group().lstrip('0') or '0'
+    return f"\x00{chr(len(digits))}{digits}"
+
+
+def natural_key(path):
+    """文件名的自然排序键：按数字和文字分段比较，ep2_part10 排在 ep10_part2 前面。
+
+    每段数字改写为 \\x00 + 位数 + 去掉前导零的数字，先比位数再逐位比较，就是按数值比较；
+    \\x00 小于任何文字字符，与逐段比较时"文字较短的一方在前"一致。键是单个字符串，
+    比较在 C 层完成，比混合 int/str 的列表快。数字相同时（如 01 和 1）再按原文件名区分，保证结果稳定。
+    """
+    name = os.path.basename(path)
+    stem, ext = os.path.splitext(name)
+    return (_DIGITS.sub(_encode_number, stem.casefold()), ext.casefold(), name)
+
+
+def natural_sorted(paths):
+    return sorted(paths, key=natural_key)
+
+
+def parse_timestamp(value):
+    """解析 EXIF（2024:01:02 03:04:05）或 ISO 8601（2024-01-02T03:04:05.000000Z）时间，失败返回 None"""
+    if not value:
+        return None
+    value = str(value).strip().rstrip('\x00')
+    for fmt in ("%Y:%m:%d %H:%M:%S", "%Y-%m-%dT%H:%M:%S.%f%z", "%Y-%m-%dT%H:%M:%S%z",
+                "%Y-%m-%dT%H:%M:%S.%f", "%Y-%m-%dT%H:%M:%S", "%Y-%m-%d %H:%M:%S"):
+        try:
+            parsed = datetime.strptime(value.replace('Z', '+0000'), fmt)
+        except ValueError:
+            continue
+        if parsed.tzinfo is None:
+            # EXIF 时间不带时区，按本地时间处理
+            return parsed.timestamp()
+        return parsed.astimezone(timezone.utc).timestamp()
+    return None
+
+
+def sort_paths(paths, order="name", get_time=None):
+    """按文件名自然顺序或拍摄时间排序。
+
+    order="time" 时 get_time(路径) 返回时间戳或 None；有时间的按时间排在前面，
+    时间相同或没有时间的再按文件名自然顺序排列。
+    """
+    if order not in SORT_ORDERS:
+        raise ValueError(f"不支持的排序方式: {order}")
+    if order == "name" or get_time is None:
+        return natural_sorted(paths)
+
+    def time_key(path):
+        timestamp = get_time(path)
+        return (timestamp is None, timestamp or 0, natural_key(path))
+
+    return sorted(paths, key=time_key)
@@ -1,37 +1,97 @@
 import os
+import threading
 import tkinter as tk
 from tkinterdnd2 import TkinterDnD, DND_FILES
-from PIL import Image, UnidentifiedImageError
 from tkinter import scrolledtext
 
-# 创建一个png文件夹用于保存转换后的文件
-output_dir = "png"
-if not os.path.exists(output_dir):
-    os.makedirs(output_dir)
+from convert_core import (ImageConvertEngine, ConversionCache, find_image_files, build_output_path, make_task,
+                          encoder_options, TARGET_FORMATS, TARGET_NAMES, DEFAULT_TARGET, SPEED_NAMES, DEFAULT_SPEED,
+                          DEFAULT_QUALITY, ANIMATION_NAMES, DEFAULT_ANIMATION)
+
+# 缩略图最长边（像素）
+THUMBNAIL_SIZE = 256
+
+# 转换后的文件按格式保存到 png、webp、jpg 文件夹
+def get_output_dir(target):
+    return TARGET_FORMATS[target]["ext"].lstrip(".")
 
-# 创建一个函数来将图片转换为PNG
-def convert_to_png(file_path):
-    try:
-        # 使用Pillow库打开图片
-        img = Image.open(file_path)
-        # 提取文件名（无扩展名）
-        file_name = os.path.splitext(os.path.basename(file_path))[0]
-        # 保存为PNG格式
-        output_path = os.path.join(output_dir, f"{file_name}.png")
-        img.save(output_path, "PNG")
-        return output_path
-    except UnidentifiedImageError:
-        log_message(f"错误: 无法识别文件 {file_path}")
-        return None
+
+# 转换在进程池中进行，界面线程只负责显示结果；内容和参数都没变的图片不重复转换
+engine = ImageConvertEngine(cache=ConversionCache())
+processing = False
 
 # 当用户拖入文件时调用的函数
 def on_drop(event):
+    global processing
+    if processing:
+        log_message("警告: 当前正在转换中，请等待完成")
+        return
+
     file_paths = root.tk.splitlist(event.data)
+    target = target_format.get()
+    try:
+        # 无损格式没有画质参数
+        target_quality = None if TARGET_FORMATS[target]["lossless"] else int(quality.get())
+        options = encoder_options(target, speed_profile.get(), target_quality)
+    except ValueError:
+        log_message("错误: 画质必须是1到100之间的整数")
+        return
+    output_dir = get_output_dir(target)
+    ext = TARGET_FORMATS[target]["ext"]
+    format = TARGET_FORMATS[target]["format"]
+    thumbnail = THUMBNAIL_SIZE if make_thumbnail.get() else None
+
+    sources = []
     for file_path in file_paths:
         if os.path.isfile(file_path):
-            output_path = convert_to_png(file_path)
-            if output_path:
-                log_message(f"成功: 图片已转换为 {output_path}")
+            # 不限扩展名，无法识别的文件在转换时报错
+            sources.append((file_path, None))
+        elif os.path.isdir(file_path):
+            # 文件夹递归转换，保留子文件夹结构
+            sources.extend(find_image_files([file_path], recursive=True))
+    tasks = [make_task(source, build_output_path(source, output_dir, base_dir, ext), format, options,
+                       thumbnail=thumbnail, animation=animation_mode.get())
+             for source, base_dir in sources]
+    if not tasks:
+        return
+
+    processing = True
+    log_message(f"开始转换 {len(tasks)} 个文件...")
+    threading.Thread(target=convert_all, args=(tasks, output_dir), daemon=True).start()
+
+# 在后台线程中转换，每完成一个文件把结果送回界面线程显示
+def convert_all(tasks, output_dir):
+    def on_result(result):
+        if result["ok"] and result["cached"]:
+            message = f"跳过: 已有相同内容的转换结果 {result['output']}"
+        elif result["ok"]:
+            message = f"成功: 图片已转换为 {result['output']}"
+        else:
+            message = f"错误: 无法转换文件 {result['source']} - {result['error']}"
+        root.after(0, log_message, message)
+
+    try:
+        os.makedirs(output_dir, exist_ok=True)
+        summary = engine.run(tasks, on_result)
+        root.after(0, log_message, f"转换完成: 成功 {summary['ok']} 个（跳过 {summary['cached']} 个），"
+                                   f"失败 {summary['failed']} 个，用时 {summary['elapsed']:.1f} 秒")
+    except Exception as e:
+        root.after(0, log_message, f"错误: {e}")
+    finally:
+        root.after(0, finish_convert)
+
+# 切换输出格式时画质恢复为该格式的默认值，无损格式不需要画质
+def on_target_change(*args):
+    target = target_format.get()
+    if TARGET_FORMATS[target]["lossless"]:
+        quality_box.config(state=tk.DISABLED)
+    else:
+        quality_box.config(state=tk.NORMAL)
+        quality.set(str(DEFAULT_QUALITY[target]))
+
+def finish_convert():
+    global processing
+    processing = False
 
 # 日志信息显示
 def log_message(message):
@@ -40,23 +100,62 @@ def log_message(message):
     log_area.config(state=tk.DISABLED)  # 禁止用户编辑日志区域
     log_area.yview(tk.END)  # 自动滚动到底部
 
-# 创建TkinterDnD窗口
-root = TkinterDnD.Tk()
-root.title("图片格式转换器")
-root.geometry("600x400")  # 调整窗口大小
-root.config(bg='#34495e')
+# 转换用的工作进程会重新导入本文件，界面只能在主程序中创建
+if __name__ == '__main__':
+    # 创建TkinterDnD窗口
+    root = TkinterDnD.Tk()
+    root.title("图片格式转换器")
+    root.geometry("640x490")  # 调整窗口大小
+    root.config(bg='#34495e')
+
+    # 添加一个提示标签
+    label = tk.Label(root, text="请将图片拖入此窗口\n自动转换为所选格式", bg='#34495e', fg='white', font=('Arial', 20, 'bold'))
+    label.pack(pady=(30, 10))
+
+    option_style = dict(bg='#34495e', fg='white', selectcolor='#2c3e50', activebackground='#34495e', font=('Arial', 12))
+
+    # 输出格式
+    target_format = tk.StringVar(value=DEFAULT_TARGET)
+    target_frame = tk.Frame(root, bg='#34495e')
+    target_frame.pack()
+    for value, text in TARGET_NAMES.items():
+        tk.Radiobutton(target_frame, text=text, variable=target_format, value=value,
+                       **option_style).pack(side=tk.LEFT, padx=10)
+
+    # 编码预设：最快 / 均衡 / 最小文件；有损格式的画质；是否额外生成缩略图
+    speed_profile = tk.StringVar(value=DEFAULT_SPEED)
+    quality = tk.StringVar()
+    make_thumbnail = tk.BooleanVar(value=False)
+    profile_frame = tk.Frame(root, bg='#34495e')
+    profile_frame.pack()
+    for value, text in SPEED_NAMES.items():
+        tk.Radiobutton(profile_frame, text=text, variable=speed_profile, value=value,
+                       **option_style).pack(side=tk.LEFT, padx=10)
+    tk.Label(profile_frame, text="画质:", bg='#34495e', fg='white', font=('Arial', 12)).pack(side=tk.LEFT, padx=(10, 0))
+    quality_box = tk.Spinbox(profile_frame, from_=1, to=100, width=4, textvariable=quality)
+    quality_box.pack(side=tk.LEFT)
+    tk.Checkbutton(profile_frame, text="缩略图", variable=make_thumbnail,
+                   **option_style).pack(side=tk.LEFT, padx=10)
+
+    target_format.trace_add("write", on_target_change)
+    on_target_change()
 
-# 添加一个提示标签
-label = tk.Label(root, text="请将图片拖入此窗口\n自动转换为PNG格式", bg='#34495e', fg='white', font=('Arial', 20, 'bold'))
-label.pack(pady=40)
+    # 动图（GIF、动态WebP）的输出方式：PNG保存为APNG，JPG不支持动画时逐帧输出
+    animation_mode = tk.StringVar(value=DEFAULT_ANIMATION)
+    animation_frame = tk.Frame(root, bg='#34495e')
+    animation_frame.pack()
+    tk.Label(animation_frame, text="动图:", bg='#34495e', fg='white', font=('Arial', 12)).pack(side=tk.LEFT)
+    for value, text in ANIMATION_NAMES.items():
+        tk.Radiobutton(animation_frame, text=text, variable=animation_mode, value=value,
+                       **option_style).pack(side=tk.LEFT, padx=10)
 
-# 创建一个滚动文本框，用于显示日志信息
-log_area = scrolledtext.ScrolledText(root, height=8, bg='#ecf0f1', font=('Arial', 12), state=tk.DISABLED, wrap=tk.WORD)
-log_area.pack(fill=tk.BOTH, padx=20, pady=20, expand=True)
+    # 创建一个滚动文本框，用于显示日志信息
+    log_area = scrolledtext.ScrolledText(root, height=8, bg='#ecf0f1', font=('Arial', 12), state=tk.DISABLED, wrap=tk.WORD)
+    log_area.pack(fill=tk.BOTH, padx=20, pady=20, expand=True)
 
-# 绑定拖入事件
-root.drop_target_register(DND_FILES)
-root.dnd_bind('<<Drop>>', on_drop)
+    # 绑定拖入事件
+    root.drop_target_register(DND_FILES)
+    root.dnd_bind('<<Drop>>', on_drop)
 
-# 运行窗口
-root.mainloop()
+    # 运行窗口
+    root.mainloop()
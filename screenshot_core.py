@@ -0,0 +1,770 @@
+import os
+import re
+import sys
+import glob
+import json
+import math
+import time
+import functools
+import argparse
+import threading
+import subprocess
+from collections import deque
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor, CancelledError, as_completed
+
+from app_cache import JsonCache, file_fingerprint, get_cache_dir
+from ffmpeg_runner import run_ffmpeg, format_seconds
+from job_controller import JobController, JobCancelled, popen_kwargs
+from media_probe import MediaProber, is_hdr, has_dolby_audio
+
+VIDEO_EXTS = ['.mp4', '.mkv', '.avi', '.mov', '.wmv', '.flv', '.webm', '.m4v', '.3gp']
+
+HDR_TONEMAP_FILTER = (
+    "zscale=t=linear:npl=100,format=gbrpf32le,"
+    "zscale=p=bt709,tonemap=hable:param=1.0,"
+    "zscale=t=bt709:m=bt709:r=pc,format=yuv420p"
+)
+
+# HDR转SDR预设：quality 为原有的 hable 色调映射（三次 zscale + 32位浮点）；
+# fast 先统一转为 PQ 的16位整数 RGB，再用预先算好的 3D LUT 一步完成线性化、色域转换、hable 映射和 gamma 编码，
+# 不经过浮点格式；clip 不做色调映射，直接转换到 bt709，高光会被裁切但速度最快
+HDR_PRESETS = {
+    "quality": HDR_TONEMAP_FILTER,
+    "fast": (
+        "zscale=t=smpte2084:npl=100:r=pc,format=gbrp16le,"
+        "lut3d=file={lut},"
+        "zscale=m=bt709:r=pc,format=yuv420p"
+    ),
+    "clip": "zscale=t=bt709:p=bt709:m=bt709:r=pc:npl=100,format=yuv420p"
+}
+
+# fast 预设的 LUT 参数：边长33，按 1000 尼特峰值（tonemap 滤镜无元数据时的默认值）计算。
+# 公式改动时需要修改版本号，让缓存目录里的旧 LUT 失效
+HDR_LUT_VERSION = 1
+HDR_LUT_SIZE = 33
+HDR_LUT_PEAK = 10.0
+
+# 截图文件名模板，{index} 为4位序号
+DEFAULT_NAME_TEMPLATE = "{video_name}_{index}_{date}"
+
+EXTRACT_MODES = ("fps", "seek", "seek_key", "keyframe", "scene", "dedup")
+
+# 自适应采样模式：按画面变化筛选，截图时间点不固定
+ADAPTIVE_MODES = ("scene", "dedup")
+
+DEFAULT_SCENE_THRESHOLD = 0.3
+
+# 定位模式下每个ffmpeg进程处理的时间点数量
+SEEK_BATCH_SIZE = 16
+
+MANIFEST_NAME = ".screenshot_manifest.json"
+
+# iter_frames 支持的原始像素格式及其通道数
+RAW_PIX_FMT_CHANNELS = {"rgb24": 3, "bgr24": 3, "rgba": 4, "bgra": 4, "gray": 1}
+
+
+def get_ffmpeg_path():
+    """优先使用当前目录或程序目录下的 ffmpeg/bin/ffmpeg.exe，否则使用系统PATH中的ffmpeg"""
+    for base_dir in (os.getcwd(), os.path.dirname(os.path.abspath(__file__))):
+        local_ffmpeg = os.path.join(base_dir, "ffmpeg", "bin", "ffmpeg.exe")
+        if os.path.exists(local_ffmpeg):
+            return local_ffmpeg
+    return "ffmpeg"
+
+
+def _pq_to_linear(value):
+    """PQ(SMPTE ST 2084) 解码，返回以 100 尼特为 1.0 的线性亮度，与 zscale npl=100 一致"""
+    m1, m2 = 2610 / 16384, 2523 / 4096 * 128
+    c1, c2, c3 = 3424 / 4096, 2413 / 4096 * 32, 2392 / 4096 * 32
+    e = value ** (1 / m2)
+    return (max(e - c1, 0.0) / (c2 - c3 * e)) ** (1 / m1) * 100
+
+
+def _hable(x):
+    a, b, c, d, e, f = 0.15, 0.50, 0.10, 0.20, 0.02, 0.30
+    return (x * (x * a + c * b) + d * e) / (x * (x * a + b) + d * f) - e / f
+
+
+def _tonemap_hable(rgb, peak=HDR_LUT_PEAK, desat=2.0):
+    """与 ffmpeg tonemap=hable 相同的算法：先对过亮像素去饱和，再按最亮通道等比缩放"""
+    r, g, b = rgb
+    luma = 0.2126 * r + 0.7152 * g + 0.0722 * b
+    overbright = max(luma - desat, 1e-6) / max(luma, 1e-6)
+    r, g, b = (x + (luma - x) * overbright for x in (r, g, b))
+    sig = max(r, g, b, 1e-6)
+    scale = _hable(sig) / _hable(peak) / sig
+    return r * scale, g * scale, b * scale
+
+
+BT2020_TO_BT709 = (
+    (1.6605, -0.5876, -0.0728),
+    (-0.1246, 1.1329, -0.0083),
+    (-0.0182, -0.1006, 1.1187),
+)
+
+
+def write_hdr_lut(path, size=HDR_LUT_SIZE, peak=HDR_LUT_PEAK):
+    """生成 .cube 格式的 3D LUT：输入为 PQ 编码的 bt2020 RGB，输出为 hable 映射后的 bt709 SDR RGB。
+    输出 gamma 与 zscale 的 t=bt709 相同（BT.1886 的反函数，即 1/2.4 次幂）"""
+    linear = [_pq_to_linear(i / (size - 1)) for i in range(size)]
+    lines = [f"LUT_3D_SIZE {size}"]
+    # .cube 中红色分量变化最快
+    for b in linear:
+        for g in linear:
+            for r in linear:
+                rgb = [m[0] * r + m[1] * g + m[2] * b for m in BT2020_TO_BT709]
+                mapped = _tonemap_hable(rgb, peak)
+                lines.append(" ".join(f"{min(max(x, 0.0), 1.0) ** (1 / 2.4):.6f}" for x in mapped))
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    with open(tmp_path, "w", encoding="ascii") as f:
+        f.write("\n".join(lines) + "\n")
+    os.replace(tmp_path, path)
+
+
+def get_hdr_lut_path():
+    """fast 预设使用的 LUT 文件，首次使用时生成到缓存目录"""
+    path = os.path.join(get_cache_dir("luts"),
+                        f"hdr_hable_v{HDR_LUT_VERSION}_{HDR_LUT_SIZE}.cube")
+    if not os.path.exists(path):
+        write_hdr_lut(path)
+    return path
+
+
+def escape_filter_path(path):
+    """滤镜参数中的文件路径：统一用正斜杠，转义 Windows 盘符后的冒号并加单引号"""
+    path = path.replace("\\", "/").replace(":", "\\:")
+    return f"'{path}'"
+
+
+@functools.lru_cache(maxsize=None)
+def build_hdr_filter(preset="quality", max_width=None):
+    """HDR转SDR滤镜链。max_width 会在色彩转换之前先缩小画面，运算量随像素数下降"""
+    chain = HDR_PRESETS[preset]
+    if "{lut}" in chain:
+        chain = chain.format(lut=escape_filter_path(get_hdr_lut_path()))
+    if max_width:
+        chain = f"scale=w='min(iw,{int(max_width)})':h=-2,{chain}"
+    return chain
+
+
+def is_video_file(path, video_exts=VIDEO_EXTS):
+    return os.path.isfile(path) and os.path.splitext(path)[1].lower() in video_exts
+
+
+def find_video_files(inputs, recursive=False, video_exts=VIDEO_EXTS):
+    """把输入的文件、文件夹或通配符展开为视频文件列表（绝对路径，去重并保持顺序）"""
+    video_files = []
+    seen = set()
+
+    def add(path):
+        path = os.path.abspath(path)
+        if path not in seen and is_video_file(path, video_exts):
+            seen.add(path)
+            video_files.append(path)
+
+    for item in inputs:
+        if os.path.isdir(item):
+            if recursive:
+                for dirpath, _, filenames in os.walk(item):
+                    for file in sorted(filenames):
+                        add(os.path.join(dirpath, file))
+            else:
+                for file in sorted(os.listdir(item)):
+                    add(os.path.join(item, file))
+        elif os.path.isfile(item):
+            add(item)
+        else:
+            for path in sorted(glob.glob(item, recursive=True)):
+                add(path)
+    return video_files
+
+
+class ExtractionManifest:
+    """每个输出文件夹一份的完成清单：记录源文件指纹、截图参数和完成进度，用于跳过和续传"""
+
+    def __init__(self, output_dir):
+        self.output_dir = output_dir
+        self.cache = JsonCache(os.path.join(output_dir, MANIFEST_NAME))
+
+    @staticmethod
+    def params_key(params):
+        return json.dumps(params, sort_keys=True, ensure_ascii=False)
+
+    def check_source(self, fingerprint):
+        """源视频变化（大小或修改时间不同）时清空所有记录"""
+        source = {"size": fingerprint["size"], "mtime_ns": fingerprint["mtime_ns"]}
+        if self.cache.get("source") != source:
+            self.cache.set("source", source)
+            self.cache.set("entries", {})
+            self.cache.save()
+
+    def get_entry(self, params):
+        return self.cache.get("entries", {}).get(self.params_key(params))
+
+    def start_entry(self, params, date, pattern):
+        """新建记录，并作废输出到同一组文件的旧记录。
+
+        pattern 为展开日期后的截图文件名（序号保留为 {index}），不带日期的模板每次都输出到同一组文件，
+        只比较模板和日期会漏掉这种情况。没有 pattern 的旧版记录无法判断，一并作废。
+        """
+        entries = dict(self.cache.get("entries", {}))
+        for key, entry in list(entries.items()):
+            if entry.get("pattern", pattern) == pattern:
+                del entries[key]
+        entry = {"params": params, "date": date, "pattern": pattern, "status": "partial", "frames_done": 0,
+                 "last_timestamp": None}
+        entries[self.params_key(params)] = entry
+        self.cache.set("entries", entries)
+        self.cache.save()
+        return entry
+
+    def update_entry(self, params, **changes):
+        entries = dict(self.cache.get("entries", {}))
+        entry = dict(entries[self.params_key(params)], **changes)
+        entries[self.params_key(params)] = entry
+        self.cache.set("entries", entries)
+        self.cache.save()
+        return entry
+
+
+def count_existing_frames(output_prefix, output_suffix):
+    """从1开始连续存在的截图数量"""
+    count = 0
+    while os.path.exists(f"{output_prefix}{count + 1:04d}{output_suffix}"):
+        count += 1
+    return count
+
+
+def remove_frames(output_prefix, output_suffix, first=1):
+    """删除序号不小于 first 的截图（序号不要求连续），返回删除的数量"""
+    directory, name_prefix = os.path.split(output_prefix)
+    pattern = re.compile(re.escape(name_prefix) + r"(\d{4,})" + re.escape(output_suffix) + "$")
+    removed = 0
+    for name in os.listdir(directory or "."):
+        match = pattern.match(name)
+        if match and int(match.group(1)) >= first:
+            os.remove(os.path.join(directory, name))
+            removed += 1
+    return removed
+
+
+class ScreenshotExtractor:
+    """视频分片截图核心，不依赖界面，可供GUI、命令行和其他Python代码调用"""
+
+    def __init__(self, ffmpeg_path=None, prober=None, cpu_count=None, controller=None):
+        self.ffmpeg_path = ffmpeg_path or get_ffmpeg_path()
+        self.prober = prober or MediaProber(self.ffmpeg_path)
+        self.cpu_count = cpu_count or os.cpu_count() or 1
+        # 取消/暂停控制，界面线程可随时调用 controller.cancel() / pause() / resume()
+        self.controller = controller or JobController()
+        # 最近一次 process_videos 的截图统计，自适应采样时用于查看节省了多少张
+        self.last_run_stats = {"frames": 0, "dropped": 0}
+        self._stats_lock = threading.Lock()
+
+    @property
+    def default_concurrency(self):
+        return max(1, min(8, self.cpu_count // 4))
+
+    def get_ffmpeg_threads(self, concurrency):
+        """按并行任务数平分CPU核心，避免多个ffmpeg进程争抢"""
+        return max(1, self.cpu_count // concurrency)
+
+    def probe_video(self, video_file):
+        """探测视频元数据（单次 ffprobe，结果持久化缓存）"""
+        try:
+            return self.prober.probe(os.path.abspath(video_file))
+        except Exception as e:
+            print(f"探测视频信息失败 {video_file}: {str(e)}")
+            return {"streams": []}
+
+    def detect_hdr_video(self, video_file, media_info=None):
+        try:
+            # 判断结果随探测缓存一起按文件保存，文件不变时不再重复判断
+            return self.prober.get_decision(os.path.abspath(video_file), "is_hdr", is_hdr)
+        except Exception:
+            if media_info is None:
+                media_info = self.probe_video(video_file)
+            return is_hdr(media_info)
+
+    def detect_dolby_audio(self, video_file, media_info=None):
+        if media_info is None:
+            media_info = self.probe_video(video_file)
+        return has_dolby_audio(media_info)
+
+    def process_videos(self, video_files, interval, hdr_mode="auto", output_format="jpg",
+                       dolby_mode="auto", current_date=None, concurrency=None, extract_mode="fps",
+                       output_root=None, name_template=DEFAULT_NAME_TEMPLATE,
+                       on_progress=None, on_error=None, resume=True,
+                       scene_threshold=DEFAULT_SCENE_THRESHOLD, hdr_preset="quality", hdr_max_width=None,
+                       on_file_progress=None):
+        """并行处理多个视频，返回成功处理的数量。
+
+        on_progress(已完成数, 总数) 在每个视频结束时调用；on_file_progress(视频, 进度字典) 在单个视频
+        处理过程中按节流间隔调用。回调都在工作线程中执行，界面需自行切回主线程。
+        被 controller 取消时提前返回，调用方通过 self.controller.cancelled 判断。
+        """
+        self.last_run_stats = {"frames": 0, "dropped": 0}
+        self.controller.reset()
+        if current_date is None:
+            current_date = datetime.now().strftime("%m%d")
+        total_videos = len(video_files)
+        if not total_videos:
+            return 0
+
+        processed = 0
+        finished = 0
+        max_workers = min(concurrency or self.default_concurrency, total_videos)
+        ffmpeg_threads = self.get_ffmpeg_threads(max_workers)
+
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {
+                    executor.submit(self.process_single_video, video_file, interval,
+                                    hdr_mode=hdr_mode, output_format=output_format,
+                                    dolby_mode=dolby_mode, current_date=current_date,
+                                    ffmpeg_threads=ffmpeg_threads, extract_mode=extract_mode,
+                                    output_root=output_root, name_template=name_template,
+                                    resume=resume, scene_threshold=scene_threshold,
+                                    hdr_preset=hdr_preset, hdr_max_width=hdr_max_width,
+                                    on_file_progress=on_file_progress): video_file
+                    for video_file in video_files
+                }
+
+                for future in as_completed(futures):
+                    video_file = futures[future]
+                    finished += 1
+                    try:
+                        if future.result():
+                            processed += 1
+                    except (JobCancelled, CancelledError):
+                        # 取消后不再启动排队中的任务
+                        executor.shutdown(wait=False, cancel_futures=True)
+                        continue
+                    except Exception as e:
+                        print(f"处理视频 {video_file} 时出错: {str(e)}")
+                        if on_error:
+                            on_error(video_file, e)
+                    if on_progress:
+                        on_progress(finished, total_videos)
+        finally:
+            if self.controller.cancelled:
+                self.controller.cleanup_partial_files()
+            self.prober.save()
+
+        return processed
+
+    def process_single_video(self, video_file, interval, hdr_mode="auto", output_format="jpg",
+                             dolby_mode="auto", current_date=None, ffmpeg_threads=None,
+                             extract_mode="fps", output_root=None, name_template=DEFAULT_NAME_TEMPLATE,
+                             resume=True, scene_threshold=DEFAULT_SCENE_THRESHOLD,
+                             hdr_preset="quality", hdr_max_width=None, on_file_progress=None):
+        # 队列暂停时在这里等待，已取消则直接结束
+        self.controller.wait_if_paused()
+        if current_date is None:
+            current_date = datetime.now().strftime("%m%d")
+        video_path = os.path.abspath(video_file)
+        video_name = os.path.splitext(os.path.basename(video_path))[0]
+        video_name = re.sub(r'[<>:"/\\|?*]', '_', video_name)
+        output_dir = os.path.join(output_root or os.path.dirname(video_path), video_name)
+        os.makedirs(output_dir, exist_ok=True)
+
+        media_info = self.probe_video(video_path)
+        has_dolby = self.detect_dolby_audio(video_path, media_info)
+        remove_audio = False
+
+        if dolby_mode == "auto" and has_dolby:
+            remove_audio = True
+            print(f"检测到杜比音频，自动移除音频: {video_file}")
+        elif dolby_mode == "remove":
+            remove_audio = True
+            print(f"强制移除音频: {video_file}")
+
+        is_hdr_video = False
+        if hdr_mode != "none":
+            is_hdr_video = self.detect_hdr_video(video_path, media_info)
+            if is_hdr_video:
+                print(f"检测到HDR视频: {video_file}")
+
+        apply_hdr = hdr_mode == "force" or (hdr_mode == "auto" and is_hdr_video)
+        hdr_filter = build_hdr_filter(hdr_preset, hdr_max_width) if apply_hdr else None
+        if apply_hdr:
+            print(f"应用HDR转SDR处理({hdr_preset}): {video_file}")
+
+        # 影响输出内容的参数，任一变化都视为新任务
+        params = {
+            "mode": extract_mode,
+            "interval": interval,
+            "format": output_format,
+            "hdr": apply_hdr,
+            "name_template": name_template
+        }
+        if extract_mode == "scene":
+            params["scene_threshold"] = scene_threshold
+        if apply_hdr:
+            params["hdr_preset"] = hdr_preset
+            params["hdr_max_width"] = hdr_max_width
+        manifest = ExtractionManifest(output_dir)
+        manifest.check_source(file_fingerprint(video_path))
+        entry = manifest.get_entry(params) if resume else None
+        resuming = entry is not None
+        if entry:
+            # 沿用上次的日期，续传的截图与已有截图编号连续
+            current_date = entry["date"]
+
+        file_name = name_template.format(video_name=video_name, date=current_date, index="{index}")
+        pattern = f"{file_name}.{output_format}"
+        output_prefix, output_suffix = file_name.split("{index}", 1)
+        output_prefix = os.path.join(output_dir, output_prefix)
+        output_suffix = f"{output_suffix}.{output_format}"
+
+        if entry and entry["status"] == "done":
+            if count_existing_frames(output_prefix, output_suffix) >= entry["frames_done"]:
+                print(f"已完成，跳过: {video_file}")
+                self._record_stats(entry["frames_done"], entry.get("frames_dropped", 0))
+                return True
+            entry = None
+            resuming = False
+        if entry is None:
+            # 重新截图：同名的旧截图可能来自其他参数（如不同间隔），张数也可能更多，先全部删除，
+            # 之后文件夹中这组文件名只有本次写入的截图，续传和完成张数都按它计算
+            entry = manifest.start_entry(params, current_date, pattern)
+            removed = remove_frames(output_prefix, output_suffix)
+            if removed:
+                print(f"删除 {removed} 张旧截图: {video_file}")
+
+        def report(progress):
+            if on_file_progress:
+                on_file_progress(video_file, progress)
+
+        duration = media_info.get("duration")
+        if extract_mode in ("seek", "seek_key") and duration:
+            timestamps = self.get_seek_timestamps(duration, interval)
+            input_args = ["-threads", str(ffmpeg_threads)] if ffmpeg_threads else []
+            # 定位模式按批次记录进度，从上次完成的时间点之后继续
+            first = min(entry["frames_done"], count_existing_frames(output_prefix, output_suffix))
+            for start in range(first, len(timestamps), SEEK_BATCH_SIZE):
+                batch = list(enumerate(timestamps[start:start + SEEK_BATCH_SIZE], start=start + 1))
+                cmd = self.build_seek_command(video_path, batch, hdr_filter, output_format,
+                                              output_prefix, output_suffix, input_args,
+                                              accurate=(extract_mode == "seek"))
+                # 本批次的截图在完成前都视为未完成输出，取消时删除，续传时重新截取
+                batch_files = [f"{output_prefix}{number:04d}{output_suffix}" for number, _ in batch]
+                for path in batch_files:
+                    self.controller.track_partial_file(path)
+                self.run_ffmpeg(cmd)
+                for path in batch_files:
+                    self.controller.untrack_partial_file(path)
+                manifest.update_entry(params, frames_done=batch[-1][0], last_timestamp=batch[-1][1])
+                report({"percent": batch[-1][0] * 100.0 / len(timestamps), "out_time": batch[-1][1],
+                        "fps": None, "speed": None, "eta": None, "finished": batch[-1][0] == len(timestamps)})
+            manifest.update_entry(params, status="done")
+            self._record_stats(len(timestamps), 0)
+            return True
+
+        cmd = [self.ffmpeg_path, "-y"]
+        if ffmpeg_threads:
+            cmd.extend(["-threads", str(ffmpeg_threads), "-filter_threads", str(ffmpeg_threads)])
+
+        start_number = 1
+        remaining_duration = duration
+        if extract_mode == "keyframe":
+            # 只解码关键帧，再按最小间隔筛选，避免解码全部帧；关键帧时间点不固定，中断后重新开始
+            cmd.extend(["-skip_frame", "nokey"])
+            vf_filter = f"select='isnan(prev_selected_t)+gte(t-prev_selected_t,{interval})'"
+        elif extract_mode == "scene":
+            # 场景变化分数超过阈值且与上一张间隔不小于 interval 才输出
+            vf_filter = (f"select='isnan(prev_selected_t)"
+                         f"+gte(t-prev_selected_t,{interval})*gt(scene,{scene_threshold})'")
+        elif extract_mode == "dedup":
+            # 先按间隔抽帧，再用 mpdecimate 丢弃与上一张保留帧几乎相同的画面
+            vf_filter = f"fps=1/{interval},mpdecimate=max=0"
+        else:
+            vf_filter = f"fps=1/{interval}"
+            # 最后一张可能没有写完整，从它开始重新截取
+            existing = count_existing_frames(output_prefix, output_suffix) if resuming else 0
+            if existing > 1:
+                start_number = existing
+                resume_time = round((existing - 1) * interval, 3)
+                cmd.extend(["-ss", f"{resume_time:.3f}"])
+                if duration:
+                    remaining_duration = max(0.001, duration - resume_time)
+                manifest.update_entry(params, frames_done=existing - 1, last_timestamp=resume_time)
+                print(f"从 {resume_time:.3f} 秒继续截图: {video_file}")
+
+        cmd.extend(["-i", video_path])
+        if remove_audio:
+            cmd.extend(["-map", "0:v:0"])
+        if extract_mode == "keyframe" or extract_mode in ADAPTIVE_MODES:
+            cmd.extend(["-fps_mode", "vfr"])
+
+        # 抽帧滤镜在前，HDR浮点转换只处理被保留的帧
+        if hdr_filter:
+            vf_filter = f"{vf_filter},{hdr_filter}"
+        cmd.extend(["-vf", vf_filter])
+        cmd.extend(self.get_quality_args(output_format))
+        cmd.extend(["-start_number", str(start_number)])
+
+        # 图片序列输出中 % 有特殊含义，需要转义
+        cmd.append(f"{output_prefix.replace('%', '%%')}%04d{output_suffix.replace('%', '%%')}")
+
+        try:
+            self.run_ffmpeg(cmd, duration=remaining_duration, on_progress=report)
+        except JobCancelled:
+            # 最后一张可能只写了一半，删除后保留其余截图供续传
+            existing = count_existing_frames(output_prefix, output_suffix)
+            if existing:
+                os.remove(f"{output_prefix}{existing:04d}{output_suffix}")
+            raise
+        frames = count_existing_frames(output_prefix, output_suffix)
+        dropped = 0
+        if extract_mode in ADAPTIVE_MODES and media_info.get("duration"):
+            # 与固定间隔截图相比少输出的张数
+            dropped = max(0, len(self.get_seek_timestamps(media_info["duration"], interval)) - frames)
+            print(f"自适应采样: {video_file} 保留 {frames} 张，丢弃 {dropped} 张相似画面")
+        manifest.update_entry(params, status="done", frames_done=frames, frames_dropped=dropped)
+        self._record_stats(frames, dropped)
+        return True
+
+    def _record_stats(self, frames, dropped):
+        with self._stats_lock:
+            self.last_run_stats["frames"] += frames
+            self.last_run_stats["dropped"] += dropped
+
+    def iter_frames(self, video_file, interval, hdr_mode="auto", pix_fmt="rgb24",
+                    start_time=0, buffer_count=2, ffmpeg_threads=None,
+                    hdr_preset="quality", hdr_max_width=None):
+        """不落盘逐帧读取截图，生成 (时间戳秒, numpy数组)。
+
+        使用与截图相同的 fps/HDR 滤镜，通过管道读取 rawvideo。数组直接引用内部缓冲区（零拷贝），
+        缓冲区只有 buffer_count 个循环复用，需要长期保留的帧请自行 copy()，内存占用不随视频长度增长。
+        """
+        import numpy as np
+
+        if pix_fmt not in RAW_PIX_FMT_CHANNELS:
+            raise ValueError(f"不支持的像素格式: {pix_fmt}")
+        video_path = os.path.abspath(video_file)
+        media_info = self.probe_video(video_path)
+        apply_hdr = hdr_mode == "force" or (hdr_mode == "auto" and self.detect_hdr_video(video_path, media_info))
+
+        vf_filter = f"fps=1/{interval}"
+        if apply_hdr:
+            vf_filter = f"{vf_filter},{build_hdr_filter(hdr_preset, hdr_max_width)}"
+        vf_filter = f"{vf_filter},format={pix_fmt}"
+
+        cmd = [self.ffmpeg_path, "-hide_banner", "-nostdin"]
+        if ffmpeg_threads:
+            cmd.extend(["-threads", str(ffmpeg_threads), "-filter_threads", str(ffmpeg_threads)])
+        if start_time:
+            cmd.extend(["-ss", f"{start_time:.3f}"])
+        cmd.extend(["-i", video_path, "-map", "0:v:0", "-vf", vf_filter,
+                    "-f", "rawvideo", "-pix_fmt", pix_fmt, "pipe:1"])
+
+        self.controller.check_cancelled()
+        process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.PIPE, bufsize=0,
+                                   **popen_kwargs())
+        self.controller.register_process(process)
+        # stderr 只保留最后几十行用于报错，同时从中解析输出画面尺寸（自动旋转后可能与源不同）
+        stderr_tail = deque(maxlen=50)
+        size_ready = threading.Event()
+        frame_size = {}
+
+        def read_stderr():
+            in_output = False
+            for raw_line in process.stderr:
+                line = raw_line.decode('utf-8', errors='ignore').rstrip()
+                stderr_tail.append(line)
+                if line.startswith("Output #0"):
+                    in_output = True
+                match = re.search(r"Video: rawvideo.*?, (\d+)x(\d+)", line) if in_output else None
+                if match and not size_ready.is_set():
+                    frame_size["width"], frame_size["height"] = int(match.group(1)), int(match.group(2))
+                    size_ready.set()
+            size_ready.set()
+
+        stderr_thread = threading.Thread(target=read_stderr, daemon=True)
+        stderr_thread.start()
+
+        try:
+            size_ready.wait()
+            if not frame_size:
+                process.wait()
+                raise Exception(f"读取视频帧失败: {os.linesep.join(stderr_tail)}")
+
+            channels = RAW_PIX_FMT_CHANNELS[pix_fmt]
+            shape = (frame_size["height"], frame_size["width"], channels) if channels > 1 else \
+                (frame_size["height"], frame_size["width"])
+            frame_bytes = frame_size["width"] * frame_size["height"] * channels
+            buffers = [bytearray(frame_bytes) for _ in range(max(1, buffer_count))]
+
+            index = 0
+            while True:
+                buffer = buffers[index % len(buffers)]
+                view = memoryview(buffer)
+                filled = 0
+                while filled < frame_bytes:
+                    read = process.stdout.readinto(view[filled:])
+                    if not read:
+                        break
+                    filled += read
+                if filled < frame_bytes:
+                    break
+                yield round(start_time + index * interval, 3), np.frombuffer(buffer, dtype=np.uint8).reshape(shape)
+                index += 1
+
+            process.wait()
+            stderr_thread.join()
+            self.controller.check_cancelled()
+            if process.returncode != 0:
+                raise Exception(f"读取视频帧失败: {os.linesep.join(stderr_tail)}")
+        finally:
+            if process.poll() is None:
+                process.kill()
+                process.wait()
+            self.controller.unregister_process(process)
+            process.stdout.close()
+
+    def get_seek_timestamps(self, duration, interval):
+        """与 fps=1/interval 一致的截图时间点：0, interval, 2*interval ..."""
+        count = max(1, int(math.ceil(duration / interval)))
+        return [round(i * interval, 3) for i in range(count) if i * interval < duration]
+
+    def get_quality_args(self, output_format):
+        if output_format == "jpg":
+            return ["-q:v", "2"]
+        return ["-compression_level", "6"]
+
+    def build_seek_command(self, video_file, batch, hdr_filter, output_format,
+                           output_prefix, output_suffix, input_args, accurate=True):
+        """一个ffmpeg进程内对多个时间点做输入端 -ss 定位，每个时间点只解码一帧"""
+        cmd = [self.ffmpeg_path, "-hide_banner", "-y"]
+        video_path = os.path.abspath(video_file)
+        for _, timestamp in batch:
+            cmd.extend(input_args)
+            if not accurate:
+                cmd.append("-noaccurate_seek")
+            cmd.extend(["-ss", f"{timestamp:.3f}", "-i", video_path])
+
+        for input_index, (frame_number, _) in enumerate(batch):
+            cmd.extend(["-map", f"{input_index}:v:0", "-frames:v", "1"])
+            if hdr_filter:
+                cmd.extend(["-vf", hdr_filter])
+            cmd.extend(self.get_quality_args(output_format))
+            cmd.extend(["-update", "1", f"{output_prefix}{frame_number:04d}{output_suffix}"])
+        return cmd
+
+    def benchmark_hdr_presets(self, video_file, sample_seconds=10, interval=None,
+                              max_width=None, presets=None):
+        """对视频开头一段分别运行各HDR预设（输出到null），返回 [(预设名, 耗时秒)]，按耗时排序"""
+        video_path = os.path.abspath(video_file)
+        results = []
+        for preset in presets or HDR_PRESETS:
+            vf_filter = build_hdr_filter(preset, max_width)
+            if interval:
+                vf_filter = f"fps=1/{interval},{vf_filter}"
+            cmd = [self.ffmpeg_path, "-hide_banner", "-nostdin", "-t", str(sample_seconds),
+                   "-i", video_path, "-map", "0:v:0", "-vf", vf_filter, "-f", "null", "-"]
+            start = time.perf_counter()
+            self.run_ffmpeg(cmd)
+            results.append((preset, time.perf_counter() - start))
+        return sorted(results, key=lambda item: item[1])
+
+    def run_ffmpeg(self, cmd, duration=None, on_progress=None):
+        result = run_ffmpeg(cmd, duration=duration, on_progress=on_progress, controller=self.controller)
+
+        if result.returncode != 0:
+            error_msg = result.stderr
+            if "Invalid data found" in error_msg:
+                error_msg = "视频文件格式可能损坏或不支持"
+            elif "Permission denied" in error_msg:
+                error_msg = "没有文件访问权限"
+            elif "No such file or directory" in error_msg:
+                error_msg = "视频文件不存在或路径错误"
+
+            print(f"FFmpeg 错误: {error_msg}")
+            raise Exception(f"处理视频时出错: {error_msg}")
+
+
+def describe_progress(progress):
+    """进度字典转为一行说明文字，如 45.0% 120fps 剩余 00:01:23"""
+    parts = []
+    if progress.get("percent") is not None:
+        parts.append(f"{progress['percent']:.1f}%")
+    if progress.get("fps"):
+        parts.append(f"{progress['fps']:.0f}fps")
+    if progress.get("eta") is not None:
+        parts.append(f"剩余 {format_seconds(progress['eta'])}")
+    return " ".join(parts)
+
+
+def print_file_progress(video_file, progress):
+    print(f"  {os.path.basename(video_file)}: {describe_progress(progress)}")
+
+
+def build_arg_parser():
+    parser = argparse.ArgumentParser(description="视频分片截图工具（命令行版）")
+    parser.add_argument("inputs", nargs="*", default=["."],
+                        help="视频文件、文件夹或通配符，默认当前文件夹")
+    parser.add_argument("-i", "--interval", type=float, default=0.5, help="截图间隔(秒)，默认0.5")
+    parser.add_argument("-f", "--format", choices=("jpg", "png"), default="jpg", help="输出格式")
+    parser.add_argument("-m", "--mode", choices=EXTRACT_MODES, default="fps", help="提取模式")
+    parser.add_argument("--hdr", choices=("auto", "force", "none"), default="auto", help="HDR处理")
+    parser.add_argument("--hdr-preset", choices=tuple(HDR_PRESETS), default="quality",
+                        help="HDR转SDR预设：quality高质量 / fast快速 / clip直接裁切")
+    parser.add_argument("--hdr-max-width", type=int, default=None,
+                        help="HDR转换前先把画面缩小到该宽度以内")
+    parser.add_argument("--benchmark-hdr", action="store_true",
+                        help="对第一个视频测试各HDR预设的耗时，不截图")
+    parser.add_argument("--dolby", choices=("auto", "keep", "remove"), default="auto", help="杜比音频处理")
+    parser.add_argument("--scene-threshold", type=float, default=DEFAULT_SCENE_THRESHOLD,
+                        help="场景变化模式的阈值(0~1)，越大保留越少")
+    parser.add_argument("-j", "--jobs", type=int, default=None, help="并行任务数，默认按CPU核心数自动选择")
+    parser.add_argument("-o", "--output-dir", default=None, help="截图输出根目录，默认与视频同目录")
+    parser.add_argument("-r", "--recursive", action="store_true", help="递归扫描子文件夹")
+    parser.add_argument("--date", default=None, help="文件名中的日期部分，默认当天(MMDD)")
+    parser.add_argument("--ffmpeg", default=None, help="ffmpeg可执行文件路径")
+    parser.add_argument("--progress", action="store_true", help="显示单个视频的处理进度")
+    parser.add_argument("--no-resume", action="store_true", help="忽略完成清单，全部重新截图")
+    return parser
+
+
+def main(argv=None):
+    args = build_arg_parser().parse_args(argv)
+    if args.interval <= 0:
+        print("错误：截图间隔必须为正数")
+        return 2
+    if args.jobs is not None and args.jobs <= 0:
+        print("错误：并行任务数必须为正整数")
+        return 2
+
+    video_files = find_video_files(args.inputs, recursive=args.recursive)
+    if not video_files:
+        print("未找到视频文件！")
+        return 1
+
+    extractor = ScreenshotExtractor(ffmpeg_path=args.ffmpeg)
+    if args.benchmark_hdr:
+        print(f"HDR预设测试: {video_files[0]}")
+        for preset, seconds in extractor.benchmark_hdr_presets(video_files[0], interval=args.interval,
+                                                               max_width=args.hdr_max_width):
+            print(f"  {preset:<8} {seconds:.2f} 秒")
+        return 0
+
+    processed = extractor.process_videos(
+        video_files, args.interval, hdr_mode=args.hdr, output_format=args.format,
+        dolby_mode=args.dolby, current_date=args.date, concurrency=args.jobs,
+        extract_mode=args.mode, output_root=args.output_dir, resume=not args.no_resume,
+        scene_threshold=args.scene_threshold, hdr_preset=args.hdr_preset,
+        hdr_max_width=args.hdr_max_width,
+        on_progress=lambda done, total: print(f"已处理: {done}/{total}"),
+        on_file_progress=print_file_progress if args.progress else None
+    )
+    print(f"视频处理完成！共处理 {processed}/{len(video_files)} 个视频文件。")
+    if args.mode in ADAPTIVE_MODES:
+        stats = extractor.last_run_stats
+        print(f"共保留 {stats['frames']} 张截图，丢弃 {stats['dropped']} 张相似画面")
+    return 0 if processed == len(video_files) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
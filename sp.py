@@ -1,8 +1,9 @@
 import os
-import subprocess
 import tkinter as tk
 from tkinter import simpledialog
 
+from screenshot_core import ScreenshotExtractor, find_video_files
+
 # 创建一个简单的对话框输入截图间隔时间
 def get_interval():
     root = tk.Tk()
@@ -18,34 +19,15 @@ def main():
     # 获取截图间隔时间
     interval = get_interval()
 
-    # 当前文件夹路径
-    current_dir = os.getcwd()
-
-    # 视频文件的扩展名
-    video_extensions = ['.mp4', '.avi', '.mov', '.mkv', '.flv']
-
-    # 遍历当前文件夹中的所有文件
-    for file in os.listdir(current_dir):
-        # 检查是否是视频文件
-        if any(file.lower().endswith(ext) for ext in video_extensions):
-            video_path = os.path.join(current_dir, file)
-            video_name, _ = os.path.splitext(file)
-
-            # 创建以视频名命名的文件夹
-            output_folder = os.path.join(current_dir, video_name)
-            os.makedirs(output_folder, exist_ok=True)
-
-            # 构造 FFmpeg 命令
-            output_pattern = os.path.join(output_folder, "frame_%04d.jpg")
-            ffmpeg_command = [
-                "ffmpeg", "-i", video_path,
-                "-vf", f"fps={1/interval}",
-                output_pattern
-            ]
+    # 当前文件夹中的所有视频文件
+    video_files = find_video_files([os.getcwd()])
+    print(f"找到 {len(video_files)} 个视频文件，开始处理...")
 
-            # 执行命令
-            print(f"正在处理视频：{file}")
-            subprocess.run(ffmpeg_command)
+    # 每个视频输出到同名文件夹，文件名为 frame_0001.jpg
+    extractor = ScreenshotExtractor()
+    extractor.process_videos(video_files, interval, hdr_mode="none", dolby_mode="keep",
+                             name_template="frame_{index}",
+                             on_progress=lambda done, total: print(f"已处理: {done}/{total}"))
 
     print("所有视频处理完成！")
 
@@ -0,0 +1,28 @@
+import random
+
+from PIL import Image, ImageChops
+
+from convert_core import SPEED_OPTIONS, save_image
+
+
+def assert_saved_losslessly(img, tmp_path):
+    output = tmp_path / "out.png"
+    save_image(img, str(output), "PNG", SPEED_OPTIONS["png"]["smallest"])
+    with Image.open(output) as saved:
+        assert saved.mode == "P"
+        assert ImageChops.difference(saved.convert("RGB"), img.convert("RGB")).getbbox() is None
+
+
+def test_palette_keeps_colors_one_step_apart(tmp_path):
+    img = Image.new("RGB", (16, 16))
+    img.putdata([(100 + i % 2, 100 + (i // 2) % 2, 100 + (i // 4) % 4) for i in range(256)])
+    assert_saved_losslessly(img, tmp_path)
+
+
+def test_palette_keeps_256_gray_levels(tmp_path):
+    rng = random.Random(0)
+    levels = list(range(256))
+    rng.shuffle(levels)
+    img = Image.new("L", (16, 16))
+    img.putdata(levels)
+    assert_saved_losslessly(img.convert("RGB"), tmp_path)
@@ -1,20 +1,33 @@
 import tkinter as tk
-from tkinter import ttk, messagebox
+from tkinter import ttk, messagebox, filedialog
 from tkinterdnd2 import TkinterDnD, DND_FILES
 import os
 import subprocess
-import re
 from datetime import datetime
 import sys
 import threading
+from collections import deque
+
+from ffmpeg_runner import format_seconds, parse_seconds
+from job_controller import JobController, JobCancelled, popen_kwargs
+from media_probe import MediaProber
+from merge_core import VideoMergeEngine, LOG_DETAIL_LIMIT, reserve_output_path, release_output_path
+from natural_sort import sort_paths
+
+# 日志每隔多少毫秒批量刷新到界面，以及日志框最多保留的行数
+LOG_FLUSH_INTERVAL_MS = 200
+MAX_LOG_LINES = 2000
 
 class VideoMergerApp:
     def __init__(self, root):
         self.root = root
         self.root.title("视频合并工具")
-        self.root.geometry("700x550")
+        self.root.geometry("700x640")
         self.root.configure(bg='#f0f0f0')
         
+        # 待显示的日志，工作线程只负责追加，由主线程定时批量写入日志框
+        self.pending_logs = deque()
+        
         # 设置应用样式
         self.style = ttk.Style()
         self.style.configure('TFrame', background='#f0f0f0')
@@ -34,16 +47,30 @@ class VideoMergerApp:
             self.ffmpeg_path = "ffmpeg"  # 尝试使用系统PATH中的ffmpeg
             self.log_message("警告：未找到内置FFmpeg，将尝试使用系统PATH中的ffmpeg")
         
+        # 媒体信息探测（用于计算合并进度）
+        self.prober = MediaProber(self.ffmpeg_path)
+        
+        # 合并任务控制（取消时结束 ffmpeg 并删除未完成的输出文件）
+        self.controller = JobController()
+        self.engine = VideoMergeEngine(self.ffmpeg_path, prober=self.prober, controller=self.controller,
+                                       log=self.log_message)
+        
         # 创建GUI组件
         self.create_widgets()
+        self.root.after(LOG_FLUSH_INTERVAL_MS, self.flush_logs)
         
         # 设置拖放区域
         self.drop_label.drop_target_register(DND_FILES)
         self.drop_label.dnd_bind('<<Drop>>', self.handle_drop)
         
+        # 合并时写临时输出的目录，为空时直接写到输出目录
+        self.scratch_dir = None
+        
         # 处理状态
         self.processing = False
         self.process_thread = None
+        
+        self.root.protocol("WM_DELETE_WINDOW", self.on_close)
 
     def create_widgets(self):
         # 创建主框架
@@ -66,6 +93,45 @@ class VideoMergerApp:
         check_btn = ttk.Button(ffmpeg_frame, text="检查FFmpeg", command=self.check_ffmpeg)
         check_btn.pack(side=tk.RIGHT, padx=5)
         
+        # 取消按钮，合并时可用
+        self.cancel_btn = ttk.Button(ffmpeg_frame, text="取消合并", command=self.cancel_merge, state=tk.DISABLED)
+        self.cancel_btn.pack(side=tk.RIGHT, padx=5)
+        
+        # 排序方式
+        order_frame = ttk.Frame(main_frame)
+        order_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(order_frame, text="合并顺序:", font=('Arial', 10)).pack(side=tk.LEFT, padx=(0, 10))
+        self.sort_order = tk.StringVar(value="name")
+        ttk.Radiobutton(order_frame, text="按文件名", variable=self.sort_order, value="name").pack(side=tk.LEFT, padx=5)
+        ttk.Radiobutton(order_frame, text="按拍摄时间", variable=self.sort_order, value="time").pack(side=tk.LEFT, padx=5)
+        
+        # 裁剪每段的开头和结尾（流复制，入点对齐关键帧；勾选逐帧精确时只重新编码边界处的不完整GOP）
+        trim_frame = ttk.Frame(main_frame)
+        trim_frame.pack(fill=tk.X, pady=5)
+        
+        ttk.Label(trim_frame, text="每段去掉开头", font=('Arial', 10)).pack(side=tk.LEFT)
+        self.trim_head_var = tk.StringVar(value="0")
+        ttk.Entry(trim_frame, textvariable=self.trim_head_var, width=6).pack(side=tk.LEFT, padx=5)
+        ttk.Label(trim_frame, text="秒，去掉结尾", font=('Arial', 10)).pack(side=tk.LEFT)
+        self.trim_tail_var = tk.StringVar(value="0")
+        ttk.Entry(trim_frame, textvariable=self.trim_tail_var, width=6).pack(side=tk.LEFT, padx=5)
+        ttk.Label(trim_frame, text="秒", font=('Arial', 10)).pack(side=tk.LEFT)
+        self.accurate_trim = tk.BooleanVar(value=False)
+        ttk.Checkbutton(trim_frame, text="逐帧精确", variable=self.accurate_trim).pack(side=tk.LEFT, padx=10)
+        # 勾选后拖入文件时逐段填写入点和出点，代替上面统一的开头/结尾裁剪
+        self.per_clip_trim = tk.BooleanVar(value=False)
+        ttk.Checkbutton(trim_frame, text="逐段设置入点/出点", variable=self.per_clip_trim).pack(side=tk.LEFT)
+        
+        # 临时输出目录（可选，如本地SSD，合并完成后再移动到输出目录）
+        scratch_frame = ttk.Frame(main_frame)
+        scratch_frame.pack(fill=tk.X, pady=5)
+        
+        self.scratch_var = tk.StringVar(value="临时输出目录: 默认（输出目录）")
+        ttk.Label(scratch_frame, textvariable=self.scratch_var, font=('Arial', 9)).pack(side=tk.LEFT)
+        ttk.Button(scratch_frame, text="恢复默认", command=self.clear_scratch_dir).pack(side=tk.RIGHT, padx=5)
+        ttk.Button(scratch_frame, text="选择临时目录", command=self.choose_scratch_dir).pack(side=tk.RIGHT, padx=5)
+        
         # 添加分隔线
         ttk.Separator(main_frame, orient=tk.HORIZONTAL).pack(fill=tk.X, pady=10)
         
@@ -75,7 +141,7 @@ class VideoMergerApp:
         
         self.drop_label = tk.Label(
             drop_frame, 
-            text="拖放视频文件到这里\n(支持任意数量，将按文件名数字顺序或字母顺序合并)",
+            text="拖放视频文件到这里\n(支持任意数量，将按文件名自然顺序或拍摄时间合并)",
             relief="groove", 
             height=8, 
             bg='white',
@@ -125,12 +191,25 @@ class VideoMergerApp:
         self.progress_bar.pack(side=tk.BOTTOM, fill=tk.X)
 
     def log_message(self, message):
-        self.log_text.config(state='normal')
-        self.log_text.insert(tk.END, message + "\n")
-        self.log_text.see(tk.END)
-        self.log_text.config(state='disabled')
-        self.status_var.set(message)
-        self.root.update()
+        """记录日志，任意线程都可以调用；实际显示由 flush_logs 批量完成"""
+        self.pending_logs.append(message)
+
+    def flush_logs(self):
+        """主线程定时把积累的日志一次性写入日志框，大批量文件时界面不会被逐行刷新拖慢"""
+        messages = []
+        while self.pending_logs:
+            messages.append(self.pending_logs.popleft())
+        if messages:
+            self.log_text.config(state='normal')
+            self.log_text.insert(tk.END, "\n".join(messages) + "\n")
+            # 只保留最后 MAX_LOG_LINES 行
+            line_count = int(self.log_text.index('end-1c').split('.')[0])
+            if line_count > MAX_LOG_LINES:
+                self.log_text.delete('1.0', f"{line_count - MAX_LOG_LINES}.0")
+            self.log_text.see(tk.END)
+            self.log_text.config(state='disabled')
+            self.status_var.set(messages[-1])
+        self.root.after(LOG_FLUSH_INTERVAL_MS, self.flush_logs)
 
     def check_ffmpeg(self):
         self.log_message("正在检查FFmpeg...")
@@ -140,7 +219,7 @@ class VideoMergerApp:
                 stdout=subprocess.PIPE,
                 stderr=subprocess.PIPE,
                 text=True,
-                creationflags=subprocess.CREATE_NO_WINDOW
+                **popen_kwargs()
             )
             
             # 检查输出中是否包含ffmpeg版本信息
@@ -162,12 +241,17 @@ class VideoMergerApp:
             
         files = self.root.tk.splitlist(event.data)
         valid_files = []
+        ignored = 0
 
         for f in files:
             if os.path.splitext(f)[1].lower() in self.supported_formats:
                 valid_files.append(f)
             else:
-                self.log_message(f"忽略不支持的文件: {os.path.basename(f)}")
+                ignored += 1
+                if ignored <= LOG_DETAIL_LIMIT:
+                    self.log_message(f"忽略不支持的文件: {os.path.basename(f)}")
+        if ignored > LOG_DETAIL_LIMIT:
+            self.log_message(f"……共忽略 {ignored} 个不支持的文件")
 
         if len(valid_files) < 1:
             self.log_message("错误：至少需要1个视频文件")
@@ -177,132 +261,186 @@ class VideoMergerApp:
             self.log_message("错误：需要至少2个视频文件进行合并")
             return
             
-        self.log_message(f"开始处理 {len(valid_files)} 个视频文件...")
+        if self.per_clip_trim.get():
+            self.ask_clip_trims(valid_files, lambda trims: self.start_merge(valid_files, clip_trims=trims))
+            return
+            
+        try:
+            trim_head = float(self.trim_head_var.get() or 0)
+            trim_tail = float(self.trim_tail_var.get() or 0)
+            if trim_head < 0 or trim_tail < 0:
+                raise ValueError("裁剪时长不能为负数")
+        except ValueError:
+            self.log_message("错误：裁剪时长必须是不小于0的数字")
+            return
+            
+        self.start_merge(valid_files, trim_head, trim_tail)
+
+    def start_merge(self, file_paths, trim_head=0, trim_tail=0, clip_trims=None):
+        if self.processing:
+            self.log_message("警告：当前正在处理中，请等待完成")
+            return
+        self.log_message(f"开始处理 {len(file_paths)} 个视频文件...")
         
         # 启动合并线程
         self.processing = True
+        self.controller.reset()
+        self.cancel_btn.config(state=tk.NORMAL)
         self.process_thread = threading.Thread(
             target=self.merge_videos, 
-            args=(valid_files,),
+            args=(file_paths, trim_head, trim_tail, self.accurate_trim.get(), clip_trims),
             daemon=True
         )
         self.process_thread.start()
 
-    def merge_videos(self, file_paths):
+    def ask_clip_trims(self, file_paths, on_confirm):
+        """逐段填写入点和出点的对话框，留空表示从开头或到结尾；确认后调用 on_confirm({路径: (入点, 出点)})"""
+        dialog = tk.Toplevel(self.root)
+        dialog.title("设置各段入点/出点")
+        dialog.geometry("600x420")
+        dialog.transient(self.root)
+        dialog.grab_set()
+        
+        ttk.Label(dialog, text="时间可填秒数或 分:秒、时:分:秒，留空表示从开头或到结尾（列表按文件名排列）",
+                  font=('Arial', 9)).pack(anchor=tk.W, padx=10, pady=5)
+        button_frame = ttk.Frame(dialog)
+        button_frame.pack(side=tk.BOTTOM, fill=tk.X, pady=10)
+        
+        # 文件很多时列表可以滚动
+        canvas = tk.Canvas(dialog, highlightthickness=0)
+        scrollbar = ttk.Scrollbar(dialog, command=canvas.yview)
+        rows = ttk.Frame(canvas)
+        rows.bind("<Configure>", lambda event: canvas.configure(scrollregion=canvas.bbox("all")))
+        canvas.create_window((0, 0), window=rows, anchor=tk.NW)
+        canvas.configure(yscrollcommand=scrollbar.set)
+        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        canvas.pack(fill=tk.BOTH, expand=True, padx=10)
+        
+        for column, text in enumerate(("文件", "入点", "出点")):
+            ttk.Label(rows, text=text, font=('Arial', 10, 'bold')).grid(row=0, column=column, sticky=tk.W, padx=5)
+        entries = []
+        for row, path in enumerate(sort_paths(file_paths), start=1):
+            ttk.Label(rows, text=os.path.basename(path)).grid(row=row, column=0, sticky=tk.W, padx=5, pady=2)
+            start_var, end_var = tk.StringVar(), tk.StringVar()
+            ttk.Entry(rows, textvariable=start_var, width=12).grid(row=row, column=1, padx=5)
+            ttk.Entry(rows, textvariable=end_var, width=12).grid(row=row, column=2, padx=5)
+            entries.append((path, start_var, end_var))
+        
+        def confirm():
+            trims = {}
+            for path, start_var, end_var in entries:
+                name = os.path.basename(path)
+                try:
+                    start = parse_seconds(start_var.get()) or 0.0
+                    end = parse_seconds(end_var.get())
+                except ValueError:
+                    messagebox.showerror("输入错误", f"{name} 的时间格式不正确", parent=dialog)
+                    return
+                if end is not None and end <= start:
+                    messagebox.showerror("输入错误", f"{name} 的出点必须晚于入点", parent=dialog)
+                    return
+                if start or end is not None:
+                    trims[path] = (start, end)
+            dialog.destroy()
+            on_confirm(trims)
+        
+        ttk.Button(button_frame, text="开始合并", command=confirm).pack(side=tk.RIGHT, padx=10)
+        ttk.Button(button_frame, text="取消", command=dialog.destroy).pack(side=tk.RIGHT)
+
+    def merge_videos(self, file_paths, trim_head=0, trim_tail=0, accurate_trim=False, clip_trims=None):
+        output_path = None
+        succeeded = False
         try:
             # 1. 对文件进行排序
-            sorted_files = self.sort_files(file_paths)
-            self.log_message(f"排序后的文件: {', '.join([os.path.basename(f) for f in sorted_files])}")
+            sorted_files = self.engine.sort_files(file_paths, self.sort_order.get())
+            names = ', '.join([os.path.basename(f) for f in sorted_files[:LOG_DETAIL_LIMIT]])
+            if len(sorted_files) > LOG_DETAIL_LIMIT:
+                names += f" …… 共 {len(sorted_files)} 个"
+            self.log_message(f"排序后的文件: {names}")
             
-            # 2. 创建临时文件列表
-            list_file_path = self.create_file_list(sorted_files)
-            
-            # 3. 确定输出路径
+            # 2. 确定输出路径
             output_dir = os.path.dirname(file_paths[0])
             timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-            output_path = os.path.join(output_dir, f"merged_video_{timestamp}.mp4")
-            
-            # 4. 构建FFmpeg命令
-            command = [
-                self.ffmpeg_path,
-                "-f", "concat",
-                "-safe", "0",
-                "-i", list_file_path,
-                "-c", "copy",  # 直接复制流，不重新编码
-                "-y",  # 覆盖输出文件
-                output_path
-            ]
+            # 先创建占位文件占用文件名，同一秒内在同一文件夹启动的多个合并不会选到同一个名字
+            output_path = reserve_output_path(output_dir, f"merged_video_{timestamp}")
             
-            self.log_message("开始合并视频...")
-            self.log_message(f"命令: {' '.join(command)}")
-            
-            # 5. 执行FFmpeg命令
+            # 3. 预检流参数，不兼容的片段先转码，再统一流复制拼接；通过 -progress 读取真实进度
+            self.log_message("正在检查视频流参数...")
             self.progress_var.set(0)
-            process = subprocess.Popen(
-                command,
-                stdout=subprocess.PIPE,
-                stderr=subprocess.STDOUT,
-                text=True,
-                bufsize=1,
-                universal_newlines=True,
-                creationflags=subprocess.CREATE_NO_WINDOW
-            )
             
-            # 6. 实时读取输出并更新进度
-            for line in process.stdout:
-                if "time=" in line:
-                    # 解析时间信息来更新进度
-                    time_match = re.search(r"time=(\d+:\d+:\d+\.\d+)", line)
-                    if time_match:
-                        time_str = time_match.group(1)
-                        # 简单进度更新（实际应用中需要更复杂的计算）
-                        current = self.progress_var.get()
-                        if current < 95:  # 防止超过100%
-                            self.progress_var.set(current + 0.5)
-                
-                # 将输出记录到日志
-                self.log_message(line.strip())
+            def on_progress(stage, progress):
+                self.root.after(0, lambda: self.update_progress(stage, progress))
             
-            # 等待进程完成
-            process.wait()
+            trims = None
+            if clip_trims:
+                self.log_message(f"按各段入点/出点裁剪 {len(clip_trims)} 个视频"
+                                 f"{'（逐帧精确）' if accurate_trim else '（入点对齐关键帧）'}")
+                trims = clip_trims
+            elif trim_head or trim_tail:
+                self.log_message(f"每段去掉开头 {trim_head} 秒、结尾 {trim_tail} 秒"
+                                 f"{'（逐帧精确）' if accurate_trim else '（入点对齐关键帧）'}")
+                trims = self.engine.build_trims(sorted_files, trim_head, trim_tail)
             
-            # 检查返回码
-            if process.returncode == 0:
-                self.progress_var.set(100)
-                self.log_message(f"视频合并成功！保存路径: {output_path}")
-                # 询问用户是否打开所在文件夹
-                self.root.after(0, lambda: self.ask_open_folder(output_path))
-            else:
-                self.log_message(f"视频合并失败，返回码: {process.returncode}")
-                messagebox.showerror("错误", f"视频合并失败，返回码: {process.returncode}")
+            plan = self.engine.merge(sorted_files, output_path, on_progress=on_progress,
+                                     scratch_dir=self.scratch_dir, trims=trims, accurate_trim=accurate_trim,
+                                     reserved=True)
+            succeeded = True
+            
+            reencoded = sum(1 for segment in plan["segments"] if segment["reencode"])
+            self.progress_var.set(100)
+            if reencoded:
+                self.log_message(f"已重新编码 {reencoded} 个参数不一致的视频")
+            self.log_message(f"视频合并成功！保存路径: {output_path}")
+            # 询问用户是否打开所在文件夹
+            self.root.after(0, lambda: self.ask_open_folder(output_path))
         
+        except JobCancelled:
+            # ffmpeg 此时已退出，再清理一次取消时未能删除的文件
+            self.controller.cleanup_partial_files()
+            self.log_message("已取消合并，未完成的输出文件已删除")
         except Exception as e:
+            error_msg = f"处理过程中发生错误:\n{str(e)}"
             self.log_message(f"处理过程中出错: {str(e)}")
-            messagebox.showerror("错误", f"处理过程中发生错误:\n{str(e)}")
+            self.root.after(0, lambda: messagebox.showerror("错误", error_msg))
         finally:
-            # 清理临时文件
-            if 'list_file_path' in locals() and os.path.exists(list_file_path):
-                try:
-                    os.remove(list_file_path)
-                    self.log_message(f"已清理临时文件: {list_file_path}")
-                except:
-                    pass
-                    
+            if output_path and not succeeded:
+                release_output_path(output_path)
             self.processing = False
             self.progress_var.set(0)
+            self.root.after(0, lambda: self.cancel_btn.config(state=tk.DISABLED))
+
+    def choose_scratch_dir(self):
+        folder = filedialog.askdirectory(title="选择临时输出目录")
+        if folder:
+            self.scratch_dir = folder
+            self.scratch_var.set(f"临时输出目录: {folder}")
+
+    def clear_scratch_dir(self):
+        self.scratch_dir = None
+        self.scratch_var.set("临时输出目录: 默认（输出目录）")
+
+    def cancel_merge(self):
+        if not self.processing:
+            return
+        self.cancel_btn.config(state=tk.DISABLED)
+        self.status_var.set("正在取消...")
+        self.controller.cancel()
 
-    def sort_files(self, file_paths):
-        """智能排序文件：优先按文件名中的数字排序，否则按字母顺序"""
-        def extract_number(filename):
-            # 尝试从文件名中提取数字
-            base = os.path.basename(filename)
-            match = re.search(r'\d+', base)
-            return int(match.group()) if match else float('inf')
-        
-        # 检查所有文件名是否都包含数字
-        all_have_numbers = all(re.search(r'\d+', os.path.basename(f)) for f in file_paths)
-        
-        if all_have_numbers:
-            # 如果所有文件都有数字，按数字排序
-            return sorted(file_paths, key=extract_number)
-        else:
-            # 否则按文件名排序
-            return sorted(file_paths, key=lambda x: os.path.basename(x))
+    def on_close(self):
+        # 关闭窗口时结束正在运行的 ffmpeg，并清理未完成的输出
+        self.controller.cancel()
+        self.root.destroy()
 
-    def create_file_list(self, file_paths):
-        """创建FFmpeg使用的文件列表"""
-        list_file_path = os.path.join(os.path.dirname(file_paths[0]), "ffmpeg_concat_list.txt")
-        
-        with open(list_file_path, 'w', encoding='utf-8') as f:
-            for path in file_paths:
-                # 转义文件名中的特殊字符
-                safe_path = path.replace("'", "'\\''")
-                # Windows路径需要转换为正斜杠
-                safe_path = safe_path.replace("\\", "/")
-                f.write(f"file '{safe_path}'\n")
-                
-        self.log_message(f"已创建临时文件列表: {list_file_path}")
-        return list_file_path
+    def update_progress(self, stage, progress):
+        """在主线程中更新进度条和状态栏"""
+        if progress["percent"] is not None:
+            self.progress_var.set(progress["percent"])
+        status = f"{stage}... {progress['percent'] or 0:.1f}%"
+        if progress["speed"]:
+            status += f"  速度 {progress['speed']:.1f}x"
+        if progress["eta"] is not None:
+            status += f"  剩余 {format_seconds(progress['eta'])}"
+        self.status_var.set(status)
 
     def ask_open_folder(self, file_path):
         if messagebox.askyesno("操作成功", "视频合并完成！是否打开所在文件夹？"):
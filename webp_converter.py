@@ -1,14 +1,22 @@
 import tkinter as tk
 from tkinterdnd2 import TkinterDnD, DND_FILES
-from PIL import Image
 import os
+import threading
 from datetime import datetime
 
+from convert_core import (ImageConvertEngine, ConversionCache, find_image_files, build_output_path, make_task, describe_summary,
+                          encoder_options, DEFAULT_SPEED, SPEED_NAMES, DEFAULT_ANIMATION, ANIMATION_NAMES)
+
 class WebPConverterApp:
     def __init__(self, root):
         self.root = root
         self.root.title("WebP转PNG工具")
         self.root.geometry("600x400")
+        # 转换在进程池中进行，界面线程只负责显示结果；转换过的内容直接返回上次的文件
+        self.engine = ImageConvertEngine(cache=ConversionCache())
+        self.processing = False
+        self.png_profile = tk.StringVar(value=DEFAULT_SPEED)
+        self.animation_mode = tk.StringVar(value=DEFAULT_ANIMATION)
 
         # 初始化组件
         self.create_widgets()
@@ -22,6 +30,22 @@ class WebPConverterApp:
                                  width=50)
         self.drop_label.pack(pady=20)
 
+        # PNG编码预设
+        profile_frame = tk.Frame(self.root)
+        profile_frame.pack()
+        tk.Label(profile_frame, text="PNG压缩:").pack(side=tk.LEFT)
+        for value, text in SPEED_NAMES.items():
+            tk.Radiobutton(profile_frame, text=text, variable=self.png_profile,
+                           value=value).pack(side=tk.LEFT, padx=5)
+
+        # 动态WebP的输出方式：APNG / 每帧一张PNG / 只取第一帧
+        animation_frame = tk.Frame(self.root)
+        animation_frame.pack()
+        tk.Label(animation_frame, text="动图:").pack(side=tk.LEFT)
+        for value, text in ANIMATION_NAMES.items():
+            tk.Radiobutton(animation_frame, text=text, variable=self.animation_mode,
+                           value=value).pack(side=tk.LEFT, padx=5)
+
         # 日志显示区域
         self.log_text = tk.Text(self.root, 
                               height=10, 
@@ -33,18 +57,28 @@ class WebPConverterApp:
         self.drop_label.dnd_bind('<<Drop>>', self.handle_drop)
 
     def log_message(self, message):
+        """记录日志，任意线程都可以调用，实际写入在主线程进行"""
+        self.root.after(0, self.append_log, message)
+
+    def append_log(self, message):
         self.log_text.config(state='normal')
         self.log_text.insert(tk.END, message + "\n")
         self.log_text.see(tk.END)
         self.log_text.config(state='disabled')
 
     def handle_drop(self, event):
+        if self.processing:
+            self.log_message("警告：当前正在转换中，请等待完成")
+            return
+
         files = self.root.tk.splitlist(event.data)
         valid_files = []
 
-        # 过滤WebP文件
+        # 过滤WebP文件，文件夹递归查找其中的WebP文件
         for f in files:
-            if f.lower().endswith('.webp'):
+            if os.path.isdir(f):
+                valid_files.extend(path for path, _ in find_image_files([f], recursive=True, image_exts=('.webp',)))
+            elif f.lower().endswith('.webp'):
                 valid_files.append(f)
             else:
                 self.log_message(f"忽略非WebP文件: {os.path.basename(f)}")
@@ -53,29 +87,41 @@ class WebPConverterApp:
             self.log_message("错误：没有有效的WebP文件")
             return
 
-        # 处理每个文件
-        for file_path in valid_files:
-            try:
-                self.convert_webp_to_png(file_path)
-            except Exception as e:
-                self.log_message(f"转换失败: {os.path.basename(file_path)} - {str(e)}")
-
-    def convert_webp_to_png(self, input_path):
-        # 生成输出路径
-        base_dir = os.path.dirname(input_path)
-        base_name = os.path.splitext(os.path.basename(input_path))[0]
+        self.processing = True
+        self.log_message(f"开始转换 {len(valid_files)} 个文件...")
+        options = encoder_options("png", self.png_profile.get())
+        animation = self.animation_mode.get()
+        threading.Thread(target=self.convert_files, args=(valid_files, options, animation), daemon=True).start()
+
+    def convert_files(self, file_paths, options, animation):
+        """在后台线程中运行，每完成一个文件输出一行日志"""
         timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
-        output_path = os.path.join(
-            base_dir, 
-            f"{base_name}_converted_{timestamp}.png"
-        )
+        tasks = [self.build_task(path, timestamp, options, animation) for path in file_paths]
+        try:
+            summary = self.engine.run(tasks, self.log_result)
+            self.log_message(describe_summary(summary))
+        except Exception as e:
+            self.log_message(f"转换出错: {str(e)}")
+        finally:
+            self.root.after(0, self.finish_convert)
+
+    def finish_convert(self):
+        self.processing = False
 
-        # 转换并保存图片
-        with Image.open(input_path) as img:
-            img.save(output_path, "PNG", compress_level=0)
+    def build_task(self, input_path, timestamp, options, animation):
+        # 输出到源文件旁边，文件名带上转换时间；已经转换过的内容不再生成新文件
+        output_path = build_output_path(input_path, suffix=f"_converted_{timestamp}")
+        return make_task(input_path, output_path, "PNG", options, reuse_output=True, animation=animation)
 
-        self.log_message(f"转换成功: {os.path.basename(input_path)}\n"
-                        f"生成文件: {os.path.basename(output_path)}")
+    def log_result(self, result):
+        if result["ok"] and result["cached"]:
+            self.log_message(f"已转换过: {os.path.basename(result['source'])}\n"
+                             f"已有文件: {os.path.basename(result['output'])}")
+        elif result["ok"]:
+            self.log_message(f"转换成功: {os.path.basename(result['source'])}\n"
+                             f"生成文件: {os.path.basename(result['output'])}")
+        else:
+            self.log_message(f"转换失败: {os.path.basename(result['source'])} - {result['error']}")
 
 if __name__ == '__main__':
     root = TkinterDnD.Tk()